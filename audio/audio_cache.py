@@ -0,0 +1,304 @@
+"""
+Audio Cache Module - Content-addressed cache for synthesized speech
+
+Clips are stored as <sha256 of (text, engine, voice, rate, lang)>.mp3 so
+identical text is synthesized once across all scenes and stories, edited
+text never serves stale audio, and the directory is kept under a byte
+budget with least-recently-used eviction. An on-disk JSON index records
+sizes and access order so the budget survives restarts.
+
+Several processes (server workers, pre-render workers) may share a cache
+directory. Each writes the index under a file lock after merging in the
+entries other processes recorded since it last read it, so no process
+drops another's clips from the index, and each process's eviction counts
+every clip in the directory against the budget.
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from common.singleflight import atomic_output, file_lock
+
+# Default byte budget for cached audio (512 MB)
+DEFAULT_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+# Name of the on-disk index inside the cache directory
+INDEX_FILENAME = ".cache_index.json"
+
+# Minimum seconds between index writes caused only by cache hits
+INDEX_FLUSH_INTERVAL = 30.0
+
+# Seconds to wait for another process writing the index before trying later
+INDEX_LOCK_TIMEOUT = 5.0
+
+
+def audio_cache_key(text, engine, voice=None, rate=None, lang=None):
+    """
+    Compute the content address of a clip
+
+    Args:
+        text (str): The text being synthesized
+        engine (str): TTS backend name (e.g. "gtts", "pyttsx3")
+        voice: Backend-specific voice selection
+        rate: Backend-specific speaking rate
+        lang (str): Language code
+
+    Returns:
+        str: Hex digest identifying the clip
+    """
+    payload = json.dumps([text, engine, voice, rate, lang], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AudioCache:
+    """Size-bounded, content-addressed store of audio clips"""
+
+    def __init__(self, cache_dir="static/audio", max_bytes=DEFAULT_MAX_BYTES, extension=".mp3"):
+        """
+        Args:
+            cache_dir (str): Directory holding the cached clips
+            max_bytes (int): Byte budget before LRU eviction kicks in
+            extension (str): File extension of cached clips
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.extension = extension
+        self.index_path = os.path.join(cache_dir, INDEX_FILENAME)
+        self._index_version = None  # mtime_ns of the index as last read or written here
+        self._entries = OrderedDict()  # key -> size in bytes, oldest first
+        self._bytes = 0
+        self._pinned = set()  # keys never evicted (pre-rendered story audio)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_flush = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def path_for(self, key):
+        """Return the file path a clip with this key is stored at"""
+        return os.path.join(self.cache_dir, f"{key}{self.extension}")
+
+    def lookup(self, key):
+        """
+        Look up a clip and mark it as recently used
+
+        Args:
+            key (str): The clip's content address
+
+        Returns:
+            str: Path to the cached clip, or None on a miss
+        """
+        path = self.path_for(key)
+        with self._lock:
+            if key in self._entries:
+                if os.path.exists(path):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self._dirty = True
+                    self._maybe_flush()
+                    return path
+                # File was removed behind our back
+                self._bytes -= self._entries.pop(key)
+                self._dirty = True
+            elif os.path.exists(path):
+                # Written by another process; adopt it
+                self._add_entry(key, path)
+                self.hits += 1
+                return path
+            self.misses += 1
+            return None
+
+    def touch(self, keys):
+        """
+        Mark clips as recently used, without counting a lookup
+
+        For clips served without a lookup, e.g. through a cached scene
+        payload or a direct /audio request, so they are not evicted first.
+
+        Args:
+            keys (iterable): Content addresses of the clips
+        """
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    self._dirty = True
+            self._maybe_flush()
+
+    def contains(self, key):
+        """Check whether a clip is on disk, without counting a lookup or touching recency"""
+        return os.path.exists(self.path_for(key))
+
+    def commit(self, key, path=None):
+        """
+        Record a newly written clip and evict old clips if over budget
+
+        Args:
+            key (str): The clip's content address
+            path (str): Where the clip was written (defaults to path_for(key))
+
+        Returns:
+            str: Path to the cached clip, or None if the file does not exist
+        """
+        path = path or self.path_for(key)
+        if not os.path.exists(path):
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)
+            self._add_entry(key, path)
+            self._evict()
+            self._flush()
+        return path
+
+    def pin(self, keys):
+        """
+        Exempt clips from eviction
+
+        Args:
+            keys (iterable): Content addresses of clips to keep
+        """
+        with self._lock:
+            self._pinned.update(keys)
+
+    def stats(self):
+        """Return cache statistics"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "pinned": len(self._pinned)
+            }
+
+    def flush(self):
+        """Persist the index to disk"""
+        with self._lock:
+            self._flush()
+
+    def _add_entry(self, key, path):
+        """Add an entry for an existing file (lock held)"""
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        self._entries[key] = size
+        self._bytes += size
+        self._dirty = True
+
+    def _evict(self):
+        """Remove least recently used clips until within budget (lock held)"""
+        if self._bytes <= self.max_bytes:
+            return
+        for key in list(self._entries):
+            if self._bytes <= self.max_bytes or len(self._entries) <= 1:
+                break
+            if key in self._pinned:
+                continue
+            self._bytes -= self._entries.pop(key)
+            self.evictions += 1
+            try:
+                os.remove(self.path_for(key))
+            except OSError:
+                pass
+            self._dirty = True
+
+    def _maybe_flush(self):
+        """Persist the index if the last write is old enough (lock held)"""
+        if time.time() - self._last_flush >= INDEX_FLUSH_INTERVAL:
+            self._flush()
+
+    def _flush(self):
+        """Merge in other processes' entries and write the index atomically (lock held)"""
+        if not self._dirty:
+            return
+        try:
+            with file_lock(f"{self.index_path}.lock", INDEX_LOCK_TIMEOUT) as locked:
+                if not locked:
+                    # Another process is writing it; stay dirty and try again later
+                    return
+                self._merge_index()
+                self._evict()
+                with atomic_output(self.index_path) as tmp_path:
+                    with open(tmp_path, 'w') as f:
+                        json.dump({"entries": list(self._entries.items())}, f)
+                self._index_version = self._index_mtime()
+            self._dirty = False
+            self._last_flush = time.time()
+        except OSError as e:
+            print(f"Error writing audio cache index: {e}")
+
+    def _index_mtime(self):
+        try:
+            return os.stat(self.index_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _merge_index(self):
+        """
+        Adopt entries another process added to the on-disk index (lock held)
+
+        Skipped if the index is unchanged since this process last read or
+        wrote it. Clips that are only known from disk are treated as older
+        than every clip this process has used.
+        """
+        version = self._index_mtime()
+        if version is None or version == self._index_version:
+            return
+        try:
+            with open(self.index_path, 'r') as f:
+                entries = json.load(f).get("entries", [])
+        except (OSError, ValueError) as e:
+            print(f"Error reading audio cache index, not merging it: {e}")
+            return
+        on_disk = {key for key, _ in entries}
+        for key in [key for key in self._entries if key not in on_disk]:
+            # Evicted by another process (or written here since the last flush)
+            if not os.path.exists(self.path_for(key)):
+                self._bytes -= self._entries.pop(key)
+        known = list(self._entries)
+        for key, _ in entries:
+            if key not in self._entries and os.path.exists(self.path_for(key)):
+                self._add_entry(key, self.path_for(key))
+        for key in known:
+            self._entries.move_to_end(key)
+        self._index_version = version
+
+    def _load_index(self):
+        """Load the on-disk index, dropping entries whose files are gone"""
+        self._merge_index()
+        self._evict()
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_audio_cache(cache_dir="static/audio"):
+    """
+    Get the shared AudioCache for a directory
+
+    Args:
+        cache_dir (str): Directory holding the cached clips
+
+    Returns:
+        AudioCache: The process-wide cache instance for that directory
+    """
+    cache_dir = os.path.normpath(cache_dir)
+    with _caches_lock:
+        cache = _caches.get(cache_dir)
+        if cache is None:
+            cache = AudioCache(cache_dir)
+            _caches[cache_dir] = cache
+        return cache
@@ -0,0 +1,159 @@
+"""
+Audio Delivery Module - Range-aware, cache-friendly audio responses
+
+Serves audio files with correct single and suffix HTTP Range handling,
+strong ETags and conditional requests. Content-addressed clips (named by
+the hash of their inputs) never change, so they are marked immutable and
+cached by browsers for a year. Response bodies are handed to the WSGI
+server's file wrapper, which lets servers such as gunicorn use sendfile.
+"""
+import os
+import re
+import hashlib
+import mimetypes
+from flask import Response, request
+from werkzeug.http import http_date
+from werkzeug.security import safe_join
+from werkzeug.wsgi import wrap_file
+
+# File names produced by the content-addressed audio cache
+CONTENT_ADDRESSED_NAME = re.compile(r"^([0-9a-f]{64})\.[a-z0-9]+$")
+
+# Cache lifetime of content-addressed files (one year)
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Read size for bounded ranges that cannot use the file wrapper
+CHUNK_SIZE = 64 * 1024
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(header, size):
+    """
+    Parse a single-range Range header
+
+    Args:
+        header (str): The Range header value
+        size (int): Size of the file in bytes
+
+    Returns:
+        tuple: (start, end) inclusive byte offsets, None to serve the whole
+               file (no/ignored header), or "unsatisfiable"
+    """
+    if not header:
+        return None
+    match = _RANGE_RE.match(header.strip().replace(" ", ""))
+    if not match:
+        # Multiple ranges or another unit: fall back to the full file
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if size == 0:
+        # An empty file has no bytes to select, whatever the range
+        return "unsatisfiable"
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return "unsatisfiable"
+        return max(0, size - length), size - 1
+
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or (last and end < start):
+        return "unsatisfiable"
+    return start, min(end, size - 1)
+
+
+def _bounded_reader(f, length):
+    """Yield exactly length bytes from an open file, then close it"""
+    try:
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def _etag_for(filename, stat_result):
+    """Strong validator: the content hash for cached clips, else size and mtime"""
+    match = CONTENT_ADDRESSED_NAME.match(filename)
+    if match:
+        return match.group(1), True
+    digest = hashlib.sha1(f"{stat_result.st_size}-{stat_result.st_mtime_ns}".encode()).hexdigest()
+    return digest[:32], False
+
+
+def _etag_matches(header, etag):
+    """Check an If-None-Match / If-Range header against our ETag"""
+    if not header:
+        return False
+    candidates = [value.strip() for value in header.split(",")]
+    return "*" in candidates or f'"{etag}"' in candidates
+
+
+def serve_audio_file(directory, filename):
+    """
+    Build a response for an audio file, honouring Range and validators
+
+    Args:
+        directory (str): Directory holding the audio files
+        filename (str): Requested file name (relative to directory)
+
+    Returns:
+        Response: 200, 206, 304, 404 or 416 response
+    """
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        return Response("Not Found", status=404, mimetype="text/plain")
+
+    stat_result = os.stat(path)
+    size = stat_result.st_size
+    etag, immutable = _etag_for(os.path.basename(path), stat_result)
+    mimetype = mimetypes.guess_type(path)[0] or "audio/mpeg"
+
+    headers = {
+        "ETag": f'"{etag}"',
+        "Accept-Ranges": "bytes",
+        "Cache-Control": f"public, max-age={IMMUTABLE_MAX_AGE}, immutable" if immutable else "public, no-cache"
+    }
+    if not immutable:
+        headers["Last-Modified"] = http_date(stat_result.st_mtime)
+
+    if _etag_matches(request.headers.get("If-None-Match"), etag):
+        return Response(status=304, headers=headers)
+
+    byte_range = parse_range(request.headers.get("Range"), size)
+    if_range = request.headers.get("If-Range")
+    if byte_range is not None and if_range and not _etag_matches(if_range, etag):
+        # The client's partial copy is stale; send everything
+        byte_range = None
+
+    if byte_range == "unsatisfiable":
+        headers["Content-Range"] = f"bytes */{size}"
+        return Response(status=416, headers=headers)
+
+    start, end = byte_range if byte_range else (0, size - 1)
+    length = max(0, end - start + 1)
+    f = open(path, 'rb')
+    f.seek(start)
+
+    if end == size - 1:
+        # Reads to EOF: let the server's file wrapper (sendfile) do the work
+        body = wrap_file(request.environ, f)
+    else:
+        body = _bounded_reader(f, length)
+
+    headers["Content-Length"] = str(length)
+    status = 200
+    if byte_range:
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    return Response(body, status=status, headers=headers, mimetype=mimetype, direct_passthrough=True)
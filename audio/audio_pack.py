@@ -0,0 +1,86 @@
+"""
+Audio Pack Module - One file per scene with a byte-offset index
+
+A pack concatenates a scene's clips (narrative first, then choices) into
+a single file stored in the content-addressed audio cache, so a client can
+fetch a whole scene in one request or read individual clips with Range
+requests. Packs are named by the hash of their member clips, are built
+lazily the first time a scene's clips are all available, and are evicted
+under the same byte budget as the clips themselves. Concurrent requests
+for the same pack, in this or another process sharing the cache, build
+it once.
+"""
+import os
+import hashlib
+from audio.audio_cache import get_audio_cache
+from common.singleflight import SingleFlight, atomic_output
+
+# Coalesces concurrent builds of the same pack
+pack_flight = SingleFlight("pack")
+
+
+def pack_key(member_paths):
+    """
+    Compute the content address of a pack from its member clips
+
+    Args:
+        member_paths (list): Paths of the member clips, in pack order
+
+    Returns:
+        str: Hex digest identifying the pack
+    """
+    names = "\n".join(os.path.basename(path) for path in member_paths)
+    return hashlib.sha256(f"pack\n{names}".encode("utf-8")).hexdigest()
+
+
+def _pack_index(labels, member_paths):
+    """Byte offsets of each member, computed from the member file sizes"""
+    index = {}
+    offset = 0
+    for label, path in zip(labels, member_paths):
+        length = os.path.getsize(path)
+        index[label] = {"offset": offset, "length": length}
+        offset += length
+    return index
+
+
+def build_scene_pack(clips, output_dir="static/audio"):
+    """
+    Get (building if needed) the pack for a scene's clips
+
+    Args:
+        clips (list): (label, path) pairs in pack order; every path must exist
+        output_dir (str): Directory of the audio cache
+
+    Returns:
+        tuple: (pack path, index dict of label -> {"offset", "length"}),
+               or (None, None) if a clip is missing
+    """
+    if not clips or any(not path or not os.path.exists(path) for _, path in clips):
+        return None, None
+
+    labels = [label for label, _ in clips]
+    member_paths = [path for _, path in clips]
+    cache = get_audio_cache(output_dir)
+    key = pack_key(member_paths)
+
+    def job():
+        # Built by an earlier flight or another process while we waited
+        if cache.contains(key):
+            return cache.commit(key)
+        with atomic_output(cache.path_for(key)) as tmp_path:
+            with open(tmp_path, 'wb') as out:
+                for path in member_paths:
+                    with open(path, 'rb') as member:
+                        out.write(member.read())
+        return cache.commit(key)
+
+    try:
+        index = _pack_index(labels, member_paths)
+        pack_path = cache.lookup(key)
+        if pack_path:
+            return pack_path, index
+        return pack_flight.do(key, job, os.path.join(cache.cache_dir, ".locks")), index
+    except OSError as e:
+        print(f"Error building audio pack: {e}")
+        return None, None
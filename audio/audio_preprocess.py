@@ -0,0 +1,154 @@
+"""
+Audio Preprocess Module - Normalizes and trims speech before recognition
+
+Utterances are converted to 16 kHz mono 16-bit PCM and leading/trailing
+silence is removed with a simple energy-based voice activity detector.
+The noise floor used by the detector is calibrated once per session and
+then refined from each utterance's quietest frames, instead of spending
+the first second of every clip on ambient noise adjustment.
+"""
+import os
+import math
+import time
+import array
+import threading
+from collections import OrderedDict
+from common.lazy_imports import lazy_import
+
+# Recognizers are fed 16 kHz mono 16-bit audio
+TARGET_RATE = 16000
+TARGET_WIDTH = 2
+
+# Analysis frame length for the energy detector
+FRAME_MS = 30
+
+# Voiced frames must be this many times louder than the noise floor
+VAD_THRESHOLD_RATIO = float(os.getenv("VAD_THRESHOLD_RATIO", 3.0))
+
+# Absolute minimum RMS treated as speech (16-bit sample units)
+VAD_MIN_ENERGY = float(os.getenv("VAD_MIN_ENERGY", 150))
+
+# Silence kept around detected speech so word edges are not clipped
+PADDING_MS = 200
+
+# Weight of a new measurement when updating a session's noise floor
+NOISE_FLOOR_SMOOTHING = 0.3
+
+# Sessions whose calibration is remembered, and for how long
+CALIBRATION_MAX_SESSIONS = 10000
+CALIBRATION_TTL = 30 * 60
+
+
+class NoiseCalibrationCache:
+    """Per-session noise floor estimates with LRU and TTL bounds"""
+
+    def __init__(self, max_sessions=CALIBRATION_MAX_SESSIONS, ttl=CALIBRATION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._floors = OrderedDict()  # session -> (expires_at, noise floor)
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        """Return a session's noise floor, or None if not calibrated"""
+        if session_id is None:
+            return None
+        with self._lock:
+            entry = self._floors.get(session_id)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._floors[session_id]
+                return None
+            self._floors.move_to_end(session_id)
+            return entry[1]
+
+    def update(self, session_id, measured_floor):
+        """
+        Blend a new measurement into a session's noise floor
+
+        Returns:
+            float: The updated noise floor
+        """
+        if session_id is None:
+            return measured_floor
+        with self._lock:
+            entry = self._floors.get(session_id)
+            if entry is None:
+                floor = measured_floor
+            else:
+                floor = (1 - NOISE_FLOOR_SMOOTHING) * entry[1] + NOISE_FLOOR_SMOOTHING * measured_floor
+            self._floors[session_id] = (time.time() + self.ttl, floor)
+            self._floors.move_to_end(session_id)
+            while len(self._floors) > self.max_sessions:
+                self._floors.popitem(last=False)
+            return floor
+
+
+# Shared calibration cache
+noise_calibration = NoiseCalibrationCache()
+
+
+def _frame_energies(samples, frame_length):
+    """RMS energy of each complete frame of 16-bit samples"""
+    energies = []
+    for start in range(0, len(samples) - frame_length + 1, frame_length):
+        frame = samples[start:start + frame_length]
+        energies.append(math.sqrt(sum(s * s for s in frame) / frame_length))
+    return energies
+
+
+def preprocess_audio(audio_data, session_id=None):
+    """
+    Downsample to 16 kHz mono and trim leading/trailing silence
+
+    Args:
+        audio_data (sr.AudioData): Captured audio
+        session_id (str): Session whose noise calibration to use and refine
+
+    Returns:
+        tuple: (trimmed sr.AudioData, stats dict with original_ms, kept_ms,
+               trimmed_ms and noise_floor)
+    """
+    sr = lazy_import("speech_recognition")
+    raw = audio_data.get_raw_data(convert_rate=TARGET_RATE, convert_width=TARGET_WIDTH)
+    samples = array.array('h')
+    samples.frombytes(raw[:len(raw) - len(raw) % TARGET_WIDTH])
+
+    frame_length = TARGET_RATE * FRAME_MS // 1000
+    energies = _frame_energies(samples, frame_length)
+    original_ms = len(samples) * 1000 // TARGET_RATE
+
+    if not energies:
+        return sr.AudioData(raw, TARGET_RATE, TARGET_WIDTH), {
+            "original_ms": original_ms, "kept_ms": original_ms, "trimmed_ms": 0, "noise_floor": None
+        }
+
+    # The quietest tenth of the clip approximates the background level
+    quiet = sorted(energies)[:max(1, len(energies) // 10)]
+    measured_floor = sum(quiet) / len(quiet)
+    cached_floor = noise_calibration.get(session_id)
+    noise_floor = noise_calibration.update(session_id, measured_floor)
+    if cached_floor is not None:
+        # A calibrated session is less fooled by clips that are all speech
+        noise_floor = min(noise_floor, cached_floor * 2)
+
+    threshold = max(noise_floor * VAD_THRESHOLD_RATIO, VAD_MIN_ENERGY)
+    voiced = [i for i, energy in enumerate(energies) if energy >= threshold]
+
+    if not voiced:
+        # Nothing above the threshold - pass the clip through untouched
+        start_sample, end_sample = 0, len(samples)
+    else:
+        padding = PADDING_MS // FRAME_MS
+        start_sample = max(0, voiced[0] - padding) * frame_length
+        end_sample = min(len(samples), (voiced[-1] + 1 + padding) * frame_length)
+
+    trimmed = samples[start_sample:end_sample]
+    kept_ms = len(trimmed) * 1000 // TARGET_RATE
+    stats = {
+        "original_ms": original_ms,
+        "kept_ms": kept_ms,
+        "trimmed_ms": original_ms - kept_ms,
+        "noise_floor": round(noise_floor, 1)
+    }
+    return sr.AudioData(trimmed.tobytes(), TARGET_RATE, TARGET_WIDTH), stats
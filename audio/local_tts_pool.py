@@ -0,0 +1,265 @@
+"""
+Local TTS Pool Module - Long-lived pyttsx3 worker processes
+
+Each worker process initializes a pyttsx3 engine once (driver startup,
+voice enumeration, rate and volume) and then serves synthesis jobs from a
+shared queue. Jobs are submitted as futures that resolve only after the
+output file has been fully written, so callers never see a path to a
+missing file. Each worker publishes the job it is running in shared
+memory, so when one dies its job fails at once instead of leaving the caller to time out, and
+output written for a job its caller already cancelled is deleted.
+"""
+import os
+import time
+import queue
+import atexit
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import Future, InvalidStateError
+
+# Number of worker processes (each holds one initialized engine)
+LOCAL_TTS_WORKERS = int(os.getenv("LOCAL_TTS_WORKERS", min(4, os.cpu_count() or 1)))
+
+# Seconds between checks for crashed workers
+WORKER_CHECK_INTERVAL = 1.0
+
+
+def _init_engine(rate, volume, voice_index):
+    """Create and configure a pyttsx3 engine inside a worker process"""
+    import pyttsx3
+
+    engine = pyttsx3.init()
+    engine.setProperty('rate', rate)  # Speed of speech
+    engine.setProperty('volume', volume)  # Volume (0.0 to 1.0)
+
+    voices = engine.getProperty('voices')
+    if voices:
+        if len(voices) > voice_index:
+            engine.setProperty('voice', voices[voice_index].id)
+        else:
+            engine.setProperty('voice', voices[0].id)
+    return engine
+
+
+def _worker_main(job_queue, result_queue, current_job, rate, volume, voice_index):
+    """
+    Worker process loop: initialize an engine once, then synthesize jobs
+
+    Args:
+        job_queue: Queue of (job_id, text, output_path) tuples, None to stop
+        result_queue: Queue receiving (job_id, output_path, error) tuples
+        current_job: Shared value holding the id of the job being synthesized
+            (-1 when idle), read by the parent if this process dies
+        rate (int): Speaking rate
+        volume (float): Volume (0.0 to 1.0)
+        voice_index (int): Index of the preferred installed voice
+    """
+    engine = None
+    init_error = None
+    try:
+        engine = _init_engine(rate, volume, voice_index)
+    except Exception as e:
+        init_error = f"Could not initialize local TTS engine: {e}"
+
+    while True:
+        job = job_queue.get()
+        if job is None:
+            break
+
+        job_id, text, output_path = job
+        if engine is None:
+            result_queue.put((job_id, None, init_error))
+            continue
+
+        current_job.value = job_id
+        try:
+            engine.save_to_file(text, output_path)
+            engine.runAndWait()
+            if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+                raise RuntimeError("engine produced no audio")
+            result_queue.put((job_id, output_path, None))
+        except Exception as e:
+            result_queue.put((job_id, None, str(e)))
+        finally:
+            current_job.value = -1
+
+
+class LocalTTSPool:
+    """Pool of persistent local TTS worker processes"""
+
+    def __init__(self, workers=LOCAL_TTS_WORKERS, rate=150, volume=0.9, voice_index=1):
+        """
+        Args:
+            workers (int): Number of worker processes
+            rate (int): Speaking rate passed to every engine
+            volume (float): Volume passed to every engine
+            voice_index (int): Index of the preferred installed voice
+        """
+        self.workers = max(1, workers)
+        self.settings = (rate, volume, voice_index)
+        self._ctx = multiprocessing.get_context("spawn")
+        self._job_queue = self._ctx.Queue()
+        self._result_queue = self._ctx.Queue()
+        self._processes = []  # (process, shared id of the job it is running)
+        self._pending = {}  # job id -> Future
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._collector = None
+        self._closed = False
+
+    def start(self):
+        """Start the worker processes and the result collector thread"""
+        with self._lock:
+            if self._collector is not None:
+                return
+            for _ in range(self.workers):
+                self._processes.append(self._spawn_worker())
+            self._collector = threading.Thread(target=self._collect_results,
+                                               name="local-tts-collector", daemon=True)
+            self._collector.start()
+
+    def submit(self, text, output_path):
+        """
+        Queue a synthesis job
+
+        Args:
+            text (str): The text to convert to speech
+            output_path (str): Path to save the audio file
+
+        Returns:
+            Future: Resolves to output_path once the file is written.
+                Cancel it when giving up on the job, so a late output file
+                is deleted rather than left behind.
+        """
+        if self._collector is None:
+            self.start()
+
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Local TTS pool is shut down")
+            job_id = next(self._ids)
+            self._pending[job_id] = future
+        self._job_queue.put((job_id, text, output_path))
+        return future
+
+    def pending(self):
+        """Number of jobs queued or in progress"""
+        with self._lock:
+            return len(self._pending)
+
+    def shutdown(self, timeout=5):
+        """Stop all workers, failing any jobs that have not completed"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            processes = list(self._processes)
+
+        for _ in processes:
+            self._job_queue.put(None)
+        for process, _ in processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for future in pending:
+            if not future.done():
+                future.set_exception(RuntimeError("Local TTS pool shut down"))
+
+    def _spawn_worker(self):
+        """Start one worker process"""
+        current_job = self._ctx.Value('q', -1, lock=False)
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(self._job_queue, self._result_queue, current_job) + self.settings,
+            daemon=True
+        )
+        process.start()
+        return process, current_job
+
+    def _collect_results(self):
+        """Resolve futures from worker results and replace crashed workers"""
+        next_check = time.monotonic() + WORKER_CHECK_INTERVAL
+        while not self._closed:
+            if time.monotonic() >= next_check:
+                self._restart_dead_workers()
+                next_check = time.monotonic() + WORKER_CHECK_INTERVAL
+            try:
+                message = self._result_queue.get(timeout=WORKER_CHECK_INTERVAL)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                time.sleep(0.1)
+                continue
+
+            job_id, output_path, error = message
+            with self._lock:
+                future = self._pending.pop(job_id, None)
+            self._resolve(future, output_path, error)
+
+    @staticmethod
+    def _resolve(future, output_path, error):
+        """Complete a job's future, deleting the output of a cancelled job"""
+        try:
+            if future is None or future.cancelled():
+                raise InvalidStateError
+            if error:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(output_path)
+        except InvalidStateError:
+            # Nobody is waiting for this file any more
+            if output_path and os.path.exists(output_path):
+                os.remove(output_path)
+
+    def _restart_dead_workers(self):
+        """Replace worker processes that exited unexpectedly and fail their jobs"""
+        lost = []
+        with self._lock:
+            if self._closed:
+                return
+            for i, (process, current_job) in enumerate(self._processes):
+                if not process.is_alive():
+                    print(f"Local TTS worker {process.pid} exited ({process.exitcode}); restarting")
+                    job_id = current_job.value
+                    if job_id >= 0:
+                        lost.append((job_id, self._pending.pop(job_id, None)))
+                    self._processes[i] = self._spawn_worker()
+        for job_id, future in lost:
+            self._resolve(future, None, f"Local TTS worker died while synthesizing job {job_id}")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_local_tts_pool(rate=150, volume=0.9, voice_index=1):
+    """
+    Get the process-wide local TTS pool, starting it on first use
+
+    Args:
+        rate (int): Speaking rate
+        volume (float): Volume (0.0 to 1.0)
+        voice_index (int): Index of the preferred installed voice
+
+    Returns:
+        LocalTTSPool: The shared pool
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = LocalTTSPool(LOCAL_TTS_WORKERS, rate, volume, voice_index)
+            _pool.start()
+            atexit.register(_pool.shutdown)
+        return _pool
+
+
+def local_tts_pending():
+    """Clips queued on or running in the local TTS pool (0 if it never started)"""
+    pool = _pool
+    return pool.pending() if pool is not None else 0
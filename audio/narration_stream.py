@@ -0,0 +1,208 @@
+"""
+Narration Stream Module - Sentence-chunked streaming narration
+
+Long narratives are split into sentences that are synthesized in order
+through a small lookahead pipeline. MP3 frames are yielded to the client
+as soon as the first sentence is ready, and the complete narration is
+written into the normal audio cache once the stream finishes, so later
+requests are served from disk.
+
+ScenePipeline applies the same sentence chunking to scenes that are still
+being generated: it listens to a streamed Gemini response and starts
+synthesizing each sentence and choice as soon as the parser completes it.
+"""
+import os
+import re
+import threading
+from collections import deque
+from concurrent.futures import wait
+from audio.audio_cache import get_audio_cache
+from audio.tts_engine import (GTTS_AVAILABLE, SCENE_AUDIO_DEADLINE, generate_audio, get_tts_executor,
+                              online_cache_key, store_clip, synthesize_online_bytes)
+from story.scene_stream import SceneStreamListener
+
+# Sentences synthesized ahead of the one currently being sent
+NARRATION_LOOKAHEAD = int(os.getenv("NARRATION_LOOKAHEAD", 2))
+
+# Read size when streaming an already cached file
+STREAM_CHUNK_SIZE = 16 * 1024
+
+_SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+
+
+def split_sentences(text):
+    """
+    Split narrative text into sentences
+
+    Args:
+        text (str): The narrative text
+
+    Returns:
+        list: Non-empty sentences in reading order
+    """
+    return [sentence.strip() for sentence in _SENTENCE_BOUNDARY.split(text or "") if sentence.strip()]
+
+
+def _read_file(path, chunk_size=STREAM_CHUNK_SIZE):
+    """Yield a file's contents in chunks"""
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def stream_narration(text, output_dir="static/audio", use_online=True):
+    """
+    Stream narration audio, synthesizing sentence by sentence if not cached
+
+    Args:
+        text (str): The narrative text
+        output_dir (str): Directory of the audio cache
+        use_online (bool): Whether to use online TTS
+
+    Yields:
+        bytes: MP3 data in playback order
+    """
+    if not (use_online and GTTS_AVAILABLE):
+        # Local TTS writes whole files only; stream the finished clip
+        path = generate_audio(text, "narration_stream", output_dir, use_online=False)
+        if path:
+            yield from _read_file(path)
+        return
+
+    cache = get_audio_cache(output_dir)
+    key = online_cache_key(text)
+    cached_path = cache.lookup(key)
+    if cached_path:
+        yield from _read_file(cached_path)
+        return
+
+    executor = get_tts_executor()
+    sentences = iter(split_sentences(text))
+    pending = deque()
+    parts = []
+
+    def submit_next():
+        sentence = next(sentences, None)
+        if sentence is not None:
+            pending.append(executor.submit(synthesize_online_bytes, sentence))
+
+    try:
+        for _ in range(max(1, NARRATION_LOOKAHEAD)):
+            submit_next()
+
+        while pending:
+            try:
+                data = pending.popleft().result()
+            except Exception as e:
+                # Headers are already sent; end the stream early
+                print(f"Error synthesizing narration sentence: {e}")
+                return
+            submit_next()
+            parts.append(data)
+            yield data
+
+        # Store the full narration so the next request is a cache hit
+        store_clip(cache, key, parts)
+    finally:
+        # Client went away or synthesis failed - drop queued sentences
+        for future in pending:
+            future.cancel()
+
+
+class ScenePipeline(SceneStreamListener):
+    """
+    Synthesizes a scene's audio while the scene is still being generated
+
+    Narrative sentences are synthesized with gTTS as they are completed and
+    joined into the narrative clip, stored under the same cache key a full
+    synthesis would use. Choices are synthesized as soon as they are parsed.
+    With local TTS only, the narrative is synthesized once it is complete.
+    After generation, call wait() so the scene's clips are cache hits.
+    """
+
+    def __init__(self, output_dir="static/audio", use_online=True):
+        """
+        Args:
+            output_dir (str): Directory of the audio cache
+            use_online (bool): Whether to use online TTS
+        """
+        self.output_dir = output_dir
+        self.use_online = use_online
+        self.sentence_mode = use_online and GTTS_AVAILABLE
+        self._executor = get_tts_executor()
+        self._lock = threading.Lock()
+        self._text = ""  # narrative text not yet split into sentences
+        self._sentences = []  # futures of narrative sentence audio, in order
+        self._clips = []  # futures of whole clips written to the cache
+        self._narrative = None
+
+    def on_narrative(self, text):
+        if not self.sentence_mode:
+            return
+        with self._lock:
+            self._text += text
+            while True:
+                match = _SENTENCE_BOUNDARY.search(self._text)
+                # A boundary at the very end may still grow; wait for more text
+                if match is None or match.end() == len(self._text):
+                    break
+                self._submit_sentence(self._text[:match.start()])
+                self._text = self._text[match.end():]
+
+    def on_narrative_end(self, narrative):
+        with self._lock:
+            self._narrative = narrative
+            if self.sentence_mode:
+                self._submit_sentence(self._text)
+                self._text = ""
+            else:
+                self._clips.append(self._executor.submit(
+                    generate_audio, narrative, "narrative", self.output_dir, self.use_online))
+
+    def on_choice(self, choice):
+        text = choice.get("text")
+        if not text:
+            return
+        with self._lock:
+            self._clips.append(self._executor.submit(
+                generate_audio, text, choice.get("id"), self.output_dir, self.use_online))
+
+    def _submit_sentence(self, sentence):
+        sentence = sentence.strip()
+        if sentence:
+            self._sentences.append(self._executor.submit(synthesize_online_bytes, sentence))
+
+    def wait(self, timeout=None):
+        """
+        Wait for the pipelined clips and store the joined narrative
+
+        Args:
+            timeout (float): Seconds to wait (defaults to SCENE_AUDIO_DEADLINE)
+
+        Returns:
+            bool: True if every clip was ready in time
+        """
+        with self._lock:
+            sentences = list(self._sentences)
+            clips = list(self._clips)
+            narrative = self._narrative
+        if not sentences and not clips:
+            return True
+
+        _, not_done = wait(sentences + clips, timeout=SCENE_AUDIO_DEADLINE if timeout is None else timeout)
+        if sentences and narrative is not None and not any(future in not_done for future in sentences):
+            try:
+                self._store_narrative(narrative, [future.result() for future in sentences])
+            except Exception as e:
+                # generate_scene_audio will synthesize the narrative as a whole
+                print(f"Error synthesizing pipelined narration: {e}")
+        return not not_done
+
+    def _store_narrative(self, narrative, parts):
+        cache = get_audio_cache(self.output_dir)
+        key = online_cache_key(narrative)
+        if not cache.contains(key):
+            store_clip(cache, key, parts)
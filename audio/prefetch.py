@@ -0,0 +1,324 @@
+"""
+Prefetch Module - Speculative synthesis of the scenes a player can reach next
+
+Once a static scene is served, the player picks one of its choices within
+seconds. The clips of every scene reachable from it are synthesized in
+the background on a small pool of their own, so most transitions find
+their audio already cached. Prefetching is low priority: it yields while
+interactive clips are queued on the shared TTS executor, queues behind
+interactive calls at the backend schedulers, skips clips that
+are already on disk, and a player's outstanding prefetches are cancelled
+as soon as they move to a scene. At interpreter exit queued prefetches
+are cancelled and running ones stop after their current clip.
+"""
+import os
+import time
+import atexit
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from audio import tts_engine
+from audio.audio_cache import get_audio_cache
+from audio.prerender import expected_key
+from common.scheduler import PREFETCH, priority_class
+
+# Set to false to disable speculative synthesis
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() == "true"
+
+# Threads synthesizing prefetched clips (separate from the interactive TTS pool)
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", 2))
+
+# Scenes waiting to be prefetched before new requests are dropped
+PREFETCH_MAX_PENDING = int(os.getenv("PREFETCH_MAX_PENDING", 64))
+
+# Players whose prefetch targets are remembered for hit accounting
+PREFETCH_MAX_SESSIONS = int(os.getenv("PREFETCH_MAX_SESSIONS", 10000))
+
+# Seconds between checks of the interactive TTS queue while yielding to it
+PREFETCH_BACKOFF = 0.05
+
+# Longest a prefetched clip yields to interactive work before it runs anyway
+PREFETCH_MAX_YIELD = float(os.getenv("PREFETCH_MAX_YIELD", 2.0))
+
+# Target states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+WARM = "warm"
+CANCELLED = "cancelled"
+FAILED = "failed"
+
+
+class _Target:
+    """A child scene being prefetched for one player"""
+
+    __slots__ = ("scene_id", "state", "future")
+
+    def __init__(self, scene_id, state=QUEUED):
+        self.scene_id = scene_id
+        self.state = state
+        self.future = None
+
+
+def scene_texts(scene, include_narrative=True):
+    """
+    List the texts a compiled scene's audio is synthesized from
+
+    Args:
+        scene (CompiledScene): The scene
+        include_narrative (bool): Set to False when the narrative is streamed
+
+    Returns:
+        list: Narrative text (if included) followed by choice texts
+    """
+    texts = [scene.narrative] if include_narrative and scene.narrative else []
+    texts.extend(text for _, text, _ in scene.choices)
+    return texts
+
+
+class ScenePrefetcher:
+    """Background synthesis of child scenes, tracked per player"""
+
+    def __init__(self, finish_scene=None, is_warm=None, output_dir="static/audio",
+                 workers=PREFETCH_WORKERS, max_pending=PREFETCH_MAX_PENDING,
+                 max_sessions=PREFETCH_MAX_SESSIONS):
+        """
+        Args:
+            finish_scene (callable): Called with (story, scene, stream_narrative)
+                once a scene's clips are cached, e.g. to build its payload
+            is_warm (callable): Called with (story, scene, stream_narrative);
+                returns True if the scene needs no prefetching
+            output_dir (str): Directory of the audio cache
+            workers (int): Prefetch threads
+            max_pending (int): Scenes queued or running before new ones are dropped
+            max_sessions (int): Players remembered for hit accounting
+        """
+        self.finish_scene = finish_scene
+        self.is_warm = is_warm
+        self.output_dir = output_dir
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_sessions = max_sessions
+        self._executor = None
+        self._closed = False
+        self._sessions = OrderedDict()  # session id -> (story key, {scene id: _Target})
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.scheduled = 0
+        self.completed = 0
+        self.skipped_warm = 0
+        self.cancelled = 0
+        self.dropped = 0
+        self.failed = 0
+        self.clips = 0
+        self.hits = 0
+        self.late = 0
+        self.misses = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                thread_name_prefix="prefetch")
+            # Runs before the interpreter joins executor threads, unlike atexit
+            getattr(threading, "_register_atexit", atexit.register)(self.shutdown)
+        return self._executor
+
+    def shutdown(self):
+        """Cancel every queued prefetch and stop running ones after their current clip"""
+        with self._lock:
+            self._closed = True
+            for session_id in list(self._sessions):
+                self._cancel_locked(session_id)
+            self._sessions.clear()
+
+    def schedule(self, session_id, story, scene_id, stream_narrative=False):
+        """
+        Prefetch every scene reachable from the one a player was just served
+
+        Replaces (and cancels) the player's previous prefetch targets.
+
+        Args:
+            session_id (str): The player's ID
+            story (CompiledStory): The static story being played
+            scene_id (str): The scene the player is now in
+            stream_narrative (bool): Whether the player streams narrative audio
+
+        Returns:
+            int: Number of scenes queued for synthesis
+        """
+        scene = story.get_scene(scene_id)
+        if not PREFETCH_ENABLED or scene is None or self._closed:
+            return 0
+
+        children = []
+        for _, _, next_scene in scene.choices:
+            child = story.get_scene(next_scene)
+            if child is not None and child not in children:
+                children.append(child)
+        warm = {child.scene_id for child in children
+                if self.is_warm and self.is_warm(story, child, stream_narrative)}
+
+        queued = 0
+        with self._lock:
+            self._cancel_locked(session_id)
+            targets = {}
+            self._sessions[session_id] = (story.story_key, targets)
+            while len(self._sessions) > self.max_sessions:
+                _, (_, evicted) = self._sessions.popitem(last=False)
+                for target in evicted.values():
+                    self._cancel_target_locked(target)
+
+            for child in children:
+                if child.scene_id in warm:
+                    targets[child.scene_id] = _Target(child.scene_id, WARM)
+                    self.skipped_warm += 1
+                    continue
+                if self._pending >= self.max_pending:
+                    self.dropped += 1
+                    continue
+                target = targets[child.scene_id] = _Target(child.scene_id)
+                self._pending += 1
+                self.scheduled += 1
+                queued += 1
+                target.future = self._get_executor().submit(
+                    self._run, target, story, child, stream_narrative)
+        return queued
+
+    def record_transition(self, session_id, story_key, scene_id):
+        """
+        Account for a player moving to a scene and cancel their other prefetches
+
+        Args:
+            session_id (str): The player's ID
+            story_key (str): Catalog key of the story being played
+            scene_id (str): The scene the player moved to
+
+        Returns:
+            str: "hit" if the scene was prefetched in time, "late" if its
+                 prefetch was still in flight, "miss" if it was not
+                 prefetched, or None if nothing was prefetched for the player
+        """
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is None:
+                return None
+            if session[0] != story_key:
+                # The player switched stories; none of these scenes is coming
+                for other in session[1].values():
+                    self._cancel_target_locked(other)
+                return None
+            target = session[1].get(scene_id)
+            if target is not None and target.state in (DONE, WARM):
+                outcome = "hit"
+                self.hits += 1
+            elif target is not None and target.state in (QUEUED, RUNNING):
+                outcome = "late"
+                self.late += 1
+            else:
+                outcome = "miss"
+                self.misses += 1
+            for other in session[1].values():
+                # A running prefetch of the chosen scene still saves the request some work
+                if other is not target or other.state == QUEUED:
+                    self._cancel_target_locked(other)
+            return outcome
+
+    def cancel(self, session_id):
+        """Cancel a player's outstanding prefetches"""
+        with self._lock:
+            self._cancel_locked(session_id)
+            self._sessions.pop(session_id, None)
+
+    def _cancel_locked(self, session_id):
+        session = self._sessions.get(session_id)
+        if session is not None:
+            for target in session[1].values():
+                self._cancel_target_locked(target)
+
+    def _cancel_target_locked(self, target):
+        if target.state not in (QUEUED, RUNNING):
+            return
+        if target.future is not None and target.future.cancel():
+            # Never started, so _run will not release its pending slot
+            self._pending -= 1
+        target.state = CANCELLED
+        self.cancelled += 1
+
+    def _yield_to_interactive(self, target):
+        """
+        Wait while interactive clips are queued; False if cancelled meanwhile
+
+        The wait is bounded: under sustained load prefetching still makes
+        progress, and the queue never empties once the executor is shutting
+        down (its wake-up sentinels stay queued).
+        """
+        deadline = time.monotonic() + PREFETCH_MAX_YIELD
+        while tts_engine.tts_queue_depth() > 0 and time.monotonic() < deadline:
+            if target.state == CANCELLED:
+                return False
+            time.sleep(PREFETCH_BACKOFF)
+        return target.state != CANCELLED
+
+    def _run(self, target, story, scene, stream_narrative):
+        """Synthesize a child scene's missing clips (runs on the prefetch pool)"""
+        try:
+            with self._lock:
+                if target.state != QUEUED:
+                    return
+                target.state = RUNNING
+
+            cache = get_audio_cache(self.output_dir)
+            with priority_class(PREFETCH):
+                for text in scene_texts(scene, include_narrative=not stream_narrative):
+                    if not self._yield_to_interactive(target):
+                        return
+                    if cache.contains(expected_key(text, tts_engine.GTTS_AVAILABLE)):
+                        continue
+                    if tts_engine.generate_audio(text, scene.scene_id, self.output_dir):
+                        with self._lock:
+                            self.clips += 1
+
+                if self.finish_scene and target.state != CANCELLED:
+                    self.finish_scene(story, scene, stream_narrative)
+            with self._lock:
+                if target.state == RUNNING:
+                    target.state = DONE
+                    self.completed += 1
+        except Exception as e:
+            with self._lock:
+                if self._closed:
+                    # Backends refuse new work at exit; nothing went wrong
+                    self._cancel_target_locked(target)
+                    return
+                target.state = FAILED
+                self.failed += 1
+            print(f"Error prefetching audio for scene {scene.scene_id}: {e}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def pending(self):
+        """Scenes queued or being synthesized"""
+        with self._lock:
+            return self._pending
+
+    def stats(self):
+        """Return prefetch statistics"""
+        with self._lock:
+            transitions = self.hits + self.late + self.misses
+            return {
+                "pending": self._pending,
+                "sessions": len(self._sessions),
+                "scheduled": self.scheduled,
+                "completed": self.completed,
+                "skipped_warm": self.skipped_warm,
+                "cancelled": self.cancelled,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "clips": self.clips,
+                "hits": self.hits,
+                "late": self.late,
+                "misses": self.misses,
+                "hit_rate": (self.hits / transitions) if transitions else 0.0
+            }
@@ -0,0 +1,366 @@
+"""
+Prerender Module - Offline synthesis of a story's audio
+
+Walks a static story's scene graph from its start scene and synthesizes
+every narrative and choice through generate_audio on a pool of worker
+processes. A manifest records the content address of each scene's clips;
+on the next run only clips whose text or voice settings changed (and so
+whose address changed) are rebuilt. The server loads the manifest at
+startup, pins the listed clips in the audio cache and serves shipped
+stories without touching TTS.
+
+Usage:
+    python -m audio.prerender [story_id ...] [--all] [--workers N] [--local] [--force] [--dry-run]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+
+from audio.audio_cache import get_audio_cache
+from audio import tts_engine, local_tts_pool
+from common.scheduler import PRERENDER, priority_class
+from common.singleflight import atomic_output
+from story.story_catalog import StoryCatalog, SAMPLE_STORY_ID
+
+# Location of the manifest written by the CLI and read by the server
+DEFAULT_MANIFEST_PATH = os.getenv("PRERENDER_MANIFEST", "static/audio/prerender_manifest.json")
+
+# Worker processes used for synthesis
+DEFAULT_WORKERS = int(os.getenv("PRERENDER_WORKERS", os.cpu_count() or 2))
+
+MANIFEST_VERSION = 1
+
+
+def voice_settings(use_online=True):
+    """Voice settings that clips are rendered with (recorded in the manifest)"""
+    if use_online:
+        return {"engine": "gtts", "lang": tts_engine.TTS_LANG, "tld": tts_engine.GTTS_TLD}
+    return {"engine": "pyttsx3", "lang": tts_engine.TTS_LANG,
+            "voice_index": tts_engine.LOCAL_TTS_VOICE_INDEX, "rate": tts_engine.LOCAL_TTS_RATE}
+
+
+def expected_key(text, use_online=True):
+    """Content address generate_audio stores a clip under with the current settings"""
+    if use_online:
+        return tts_engine.online_cache_key(text)
+    return tts_engine.local_cache_key(text)
+
+
+def _key_of(path):
+    """Content address of a cached clip from its file name"""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def walk_scenes(story):
+    """
+    Order a story's scenes breadth-first from the start scene
+
+    Scenes that cannot be reached from the start are appended at the end,
+    so every scene of a shipped story is rendered.
+
+    Args:
+        story (CompiledStory): The compiled story
+
+    Returns:
+        list: CompiledScene objects
+    """
+    order = []
+    seen = {story.start_scene_id}
+    queue = deque([story.start_scene_id])
+    while queue:
+        scene = story.get_scene(queue.popleft())
+        order.append(scene)
+        for _, _, next_scene in scene.choices:
+            if next_scene not in seen and story.has_scene(next_scene):
+                seen.add(next_scene)
+                queue.append(next_scene)
+    order.extend(scene for scene_id, scene in story.scenes.items() if scene_id not in seen)
+    return order
+
+
+def scene_clips(scene):
+    """(slot, text) pairs of a scene: "narrative" and each choice id"""
+    clips = [("narrative", scene.narrative)]
+    clips.extend((choice_id, text) for choice_id, text, _ in scene.choices)
+    return clips
+
+
+def _init_worker():
+    """
+    Worker process initializer: run one local TTS engine per worker
+
+    Each worker would otherwise start a full LocalTTSPool, multiplying
+    engine processes by the number of prerender workers.
+    """
+    local_tts_pool.LOCAL_TTS_WORKERS = 1
+
+
+def _render_clip(text, label, output_dir, use_online):
+    """Worker process entry point: synthesize one clip into the cache"""
+    # Schedulers are per process, so this only orders calls within the
+    # worker; concurrency is bounded by the number of workers
+    with priority_class(PRERENDER):
+        return tts_engine.generate_audio(text, label, output_dir, use_online)
+
+
+class PrerenderManifest:
+    """Content addresses of pre-rendered clips, per story and scene"""
+
+    def __init__(self, path=DEFAULT_MANIFEST_PATH, data=None):
+        self.path = path
+        self.data = data or {"version": MANIFEST_VERSION, "stories": {}}
+        self.stories = self.data.setdefault("stories", {})
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path=DEFAULT_MANIFEST_PATH):
+        """
+        Load a manifest, or return an empty one if missing or unreadable
+
+        Args:
+            path (str): Path to the manifest file
+
+        Returns:
+            PrerenderManifest: The loaded manifest
+        """
+        if not os.path.exists(path):
+            return cls(path)
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error reading prerender manifest, ignoring it: {e}")
+            return cls(path)
+        if data.get("version") != MANIFEST_VERSION:
+            print(f"Ignoring prerender manifest with version {data.get('version')}")
+            return cls(path)
+        return cls(path, data)
+
+    def save(self):
+        """Write the manifest atomically"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with atomic_output(self.path) as tmp_path:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.data, f, indent=2, sort_keys=True)
+
+    def keys(self):
+        """All clip addresses listed in the manifest"""
+        for story in self.stories.values():
+            for clips in story.get("scenes", {}).values():
+                yield from clips.values()
+
+    def pin(self, output_dir="static/audio"):
+        """Protect the listed clips from eviction in the audio cache"""
+        get_audio_cache(output_dir).pin(self.keys())
+
+    def scene_audio(self, story_key, scene_data, output_dir="static/audio", include_narrative=True):
+        """
+        Get the pre-rendered clips of a scene in generate_scene_audio's format
+
+        A clip only counts if its text and voice settings still produce the
+        recorded address and the file is present.
+
+        Args:
+            story_key (str): Catalog key of the story
+            scene_data (dict): The scene, with narrative and choices
+            output_dir (str): Directory of the audio cache
+            include_narrative (bool): Whether the narrative clip is wanted
+
+        Returns:
+            dict: Paths keyed "narrative" and "choice_N", or None if any clip
+                  is not pre-rendered
+        """
+        clips = self.stories.get(story_key, {}).get("scenes", {}).get(scene_data.get("scene_id"))
+        audio_paths = self._resolve(clips, scene_data, output_dir, include_narrative)
+        with self._lock:
+            if audio_paths is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return audio_paths
+
+    def _resolve(self, clips, scene_data, output_dir, include_narrative):
+        """Map a scene's slots to recorded clip paths (None if incomplete)"""
+        if not clips:
+            return None
+        jobs = []
+        if include_narrative:
+            jobs.append(("narrative", "narrative", scene_data.get("narrative", "")))
+        for i, choice in enumerate(scene_data.get("choices", [])):
+            jobs.append((f"choice_{i+1}", choice["id"], choice["text"]))
+
+        cache = get_audio_cache(output_dir)
+        audio_paths = {}
+        for audio_key, slot, text in jobs:
+            key = clips.get(slot)
+            if key is None or key not in (expected_key(text, True), expected_key(text, False)):
+                return None
+            path = cache.path_for(key)
+            if not os.path.exists(path):
+                return None
+            audio_paths[audio_key] = path
+        return audio_paths
+
+    def stats(self):
+        """Return lookup statistics"""
+        with self._lock:
+            return {
+                "stories": len(self.stories),
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+def prerender_story(story, manifest, output_dir="static/audio", workers=DEFAULT_WORKERS,
+                    use_online=True, force=False, dry_run=False):
+    """
+    Synthesize every clip of a story that is missing or out of date
+
+    Args:
+        story (CompiledStory): The story to render
+        manifest (PrerenderManifest): Manifest to check against and update
+        output_dir (str): Directory of the audio cache
+        workers (int): Number of worker processes
+        use_online (bool): Render with gTTS (falls back to local per clip)
+        force (bool): Re-synthesize clips even if they are up to date
+        dry_run (bool): Only report what would be rendered
+
+    Returns:
+        dict: Counts of "rendered", "unchanged" and "failed" clips
+    """
+    cache = get_audio_cache(output_dir)
+    previous = manifest.stories.get(story.story_key, {}).get("scenes", {})
+    scenes = {}
+    pending = {}  # expected key -> (text, label, [(scene_id, slot), ...])
+    unchanged = 0
+
+    for scene in walk_scenes(story):
+        scenes[scene.scene_id] = {}
+        for slot, text in scene_clips(scene):
+            key = expected_key(text, use_online)
+            recorded = previous.get(scene.scene_id, {}).get(slot)
+            if not force and recorded == key and os.path.exists(cache.path_for(key)):
+                scenes[scene.scene_id][slot] = key
+                unchanged += 1
+                continue
+            if not force and key not in pending and cache.lookup(key):
+                # Already synthesized on demand; just record it
+                scenes[scene.scene_id][slot] = key
+                unchanged += 1
+                continue
+            if force and key not in pending and os.path.exists(cache.path_for(key)):
+                os.remove(cache.path_for(key))
+            label = f"{scene.scene_id}_{slot}"
+            pending.setdefault(key, (text, label, []))[2].append((scene.scene_id, slot))
+
+    if dry_run:
+        for text, label, _ in pending.values():
+            print(f"  would render {label}: {text[:60]!r}")
+        return {"rendered": 0, "unchanged": unchanged, "failed": 0, "pending": len(pending)}
+
+    rendered = failed = 0
+    if pending:
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=max(1, workers), mp_context=context,
+                                 initializer=_init_worker) as pool:
+            futures = {
+                pool.submit(_render_clip, text, label, output_dir, use_online): key
+                for key, (text, label, _) in pending.items()
+            }
+            for future in as_completed(futures):
+                text, label, slots = pending[futures[future]]
+                try:
+                    path = future.result()
+                except Exception as e:
+                    print(f"  failed {label}: {e}")
+                    path = None
+                if not path:
+                    failed += 1
+                    continue
+                # Adopt the worker's file into this process's index
+                key = _key_of(path)
+                cache.commit(key, path)
+                for scene_id, slot in slots:
+                    scenes[scene_id][slot] = key
+                rendered += 1
+                print(f"  rendered {label}")
+
+    manifest.stories[story.story_key] = {
+        "title": story.title,
+        "settings": voice_settings(use_online),
+        "rendered_at": time.time(),
+        "scenes": {scene_id: clips for scene_id, clips in scenes.items() if clips}
+    }
+    cache.pin(manifest.keys())
+    cache.flush()
+    return {"rendered": rendered, "unchanged": unchanged, "failed": failed}
+
+
+def load_prerender_manifest(path=DEFAULT_MANIFEST_PATH, output_dir="static/audio"):
+    """
+    Load the manifest at server startup and pin its clips in the audio cache
+
+    Args:
+        path (str): Path to the manifest file
+        output_dir (str): Directory of the audio cache
+
+    Returns:
+        PrerenderManifest: The loaded (possibly empty) manifest
+    """
+    manifest = PrerenderManifest.load(path)
+    manifest.pin(output_dir)
+    return manifest
+
+
+def main(argv=None):
+    """Command-line entry point for pre-rendering story audio"""
+    parser = argparse.ArgumentParser(description="Pre-render the audio of static stories")
+    parser.add_argument("stories", nargs="*", help="Story ids (file names under --story-dir without .json)")
+    parser.add_argument("--all", action="store_true", help="Render every story in --story-dir")
+    parser.add_argument("--story-dir", default="sample_data", help="Directory of story files")
+    parser.add_argument("--output-dir", default="static/audio", help="Audio cache directory")
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST_PATH, help="Manifest path")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Worker processes")
+    parser.add_argument("--local", action="store_true", help="Render with local TTS instead of gTTS")
+    parser.add_argument("--force", action="store_true", help="Re-render clips that are up to date")
+    parser.add_argument("--dry-run", action="store_true", help="List clips that would be rendered")
+    args = parser.parse_args(argv)
+
+    catalog = StoryCatalog(args.story_dir)
+    story_keys = catalog.list_stories() if args.all else (args.stories or [SAMPLE_STORY_ID])
+    manifest = PrerenderManifest.load(args.manifest)
+    use_online = not args.local and tts_engine.GTTS_AVAILABLE
+
+    status = 0
+    for story_key in story_keys:
+        story = catalog.get(story_key)
+        if story is None:
+            print(f"Skipping {story_key}: story not found or invalid")
+            status = 1
+            continue
+        print(f"Rendering {story_key} ({len(story.scenes)} scenes)")
+        started = time.time()
+        counts = prerender_story(story, manifest, args.output_dir, args.workers,
+                                 use_online, args.force, args.dry_run)
+        print(f"{story_key}: {counts} in {time.time() - started:.1f}s")
+        if counts["failed"]:
+            status = 1
+
+    if not args.dry_run:
+        manifest.save()
+        print(f"Wrote {args.manifest}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,108 +1,222 @@
 """
 Speech-to-Text Engine Module - Converts speech to text
 """
+import io
 import os
-import speech_recognition as sr
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from pathlib import Path
+from story.choice_matcher import ChoiceMatcher
+from audio.audio_preprocess import preprocess_audio, NoiseCalibrationCache
+from common.metrics import span
+from common.lazy_imports import lazy_import
 
-def get_text_from_audio(audio_path):
+# Microphone energy thresholds, calibrated once per session
+mic_calibration = NoiseCalibrationCache()
+
+# Size of the worker pool running speech recognition
+STT_MAX_WORKERS = int(os.getenv("STT_MAX_WORKERS", 4))
+
+# Seconds a request waits for recognition before giving up
+STT_DEADLINE = float(os.getenv("STT_DEADLINE", 10))
+
+# Lowest match confidence that advances the story; weaker matches ask the player again
+VOICE_MIN_CONFIDENCE = float(os.getenv("VOICE_MIN_CONFIDENCE", 0.35))
+
+_stt_executor = None
+_stt_executor_lock = threading.Lock()
+
+def get_stt_executor():
+    """Get the shared, bounded executor used for speech recognition"""
+    global _stt_executor
+    with _stt_executor_lock:
+        if _stt_executor is None:
+            _stt_executor = ThreadPoolExecutor(max_workers=STT_MAX_WORKERS,
+                                               thread_name_prefix="stt")
+        return _stt_executor
+
+def stt_queue_depth():
+    """Recognitions waiting for an STT worker thread (0 before the executor starts)"""
+    executor = _stt_executor
+    return executor._work_queue.qsize() if executor is not None else 0
+
+def transcribe_audio(audio_source, session_id=None):
     """
-    Convert speech in an audio file to text
+    Convert speech in an audio file to text, trimming silence first
     
     Args:
-        audio_path (str): Path to the audio file
+        audio_source: Path to a WAV/AIFF/FLAC file, its raw bytes, or a
+            binary file-like object (uploads are decoded from memory)
+        session_id (str): Session whose cached noise calibration to use
         
     Returns:
-        str: Extracted text from the audio or an error message
+        tuple: (extracted text or an error message, preprocessing stats or None)
     """
-    # Check if file exists
-    if not os.path.isfile(audio_path):
-        return "Error: Audio file not found"
+    if isinstance(audio_source, (bytes, bytearray)):
+        audio_source = io.BytesIO(audio_source)
+    elif isinstance(audio_source, (str, Path)) and not os.path.isfile(audio_source):
+        return "Error: Audio file not found", None
     
+    sr = lazy_import("speech_recognition")
     recognizer = sr.Recognizer()
+    stats = None
     
     try:
-        with sr.AudioFile(audio_path) as source:
-            # Adjust for ambient noise
-            recognizer.adjust_for_ambient_noise(source)
-            
-            # Record the audio
+        with sr.AudioFile(audio_source) as source:
+            # Record the whole clip; noise is handled by preprocessing, so
+            # the first second is no longer spent on ambient adjustment
             audio_data = recognizer.record(source)
-            
-            # Use Google's Speech Recognition
+        
+        # 16 kHz mono with leading/trailing silence removed
+        with span("stt.preprocess"):
+            audio_data, stats = preprocess_audio(audio_data, session_id)
+        
+        # Use Google's Speech Recognition
+        with span("stt.recognize", "google"):
             text = recognizer.recognize_google(audio_data)
-            return text
+        return text, stats
     except sr.UnknownValueError:
-        return "Error: Speech recognition could not understand audio"
+        return "Error: Speech recognition could not understand audio", stats
     except sr.RequestError as e:
-        return f"Error: Could not request results from service; {e}"
+        return f"Error: Could not request results from service; {e}", stats
     except Exception as e:
-        return f"Error processing audio: {e}"
+        return f"Error processing audio: {e}", stats
+
+def get_text_from_audio(audio_source, session_id=None):
+    """
+    Convert speech in an audio file to text
+    
+    Args:
+        audio_source: Path to a WAV/AIFF/FLAC file, its raw bytes, or a
+            binary file-like object (uploads are decoded from memory)
+        session_id (str): Session whose cached noise calibration to use
+        
+    Returns:
+        str: Extracted text from the audio or an error message
+    """
+    text, _ = transcribe_audio(audio_source, session_id)
+    return text
 
-def process_voice_command(audio_path, available_choices=None):
+def recognize_with_deadline(audio_source, deadline=None, session_id=None):
+    """
+    Run transcribe_audio on the STT worker pool with a deadline
+    
+    Args:
+        audio_source: Anything transcribe_audio accepts
+        deadline (float): Seconds to wait (defaults to STT_DEADLINE)
+        session_id (str): Session whose cached noise calibration to use
+        
+    Returns:
+        tuple: (extracted text or an error message, preprocessing stats or None)
+    """
+    future = get_stt_executor().submit(transcribe_audio, audio_source, session_id)
+    try:
+        return future.result(timeout=STT_DEADLINE if deadline is None else deadline)
+    except FutureTimeoutError:
+        future.cancel()
+        return "Error: Speech recognition timed out", None
+
+def match_choice(text, available_choices, matcher=None):
+    """
+    Match transcribed text to one of the available choices
+    
+    Args:
+        text (str): Transcribed speech
+        available_choices (list): List of available choice dictionaries
+        matcher (ChoiceMatcher): Prebuilt index for these choices (built on the fly if None)
+        
+    Returns:
+        dict: The matched choice plus "confidence", "transcript" and "ranked"
+              (all candidates best first), or an error message. Ties and
+              matches below VOICE_MIN_CONFIDENCE are errors that carry the
+              "candidates" to re-prompt with.
+    """
+    if matcher is None:
+        matcher = ChoiceMatcher(available_choices)
+    
+    ranked = matcher.match(text)
+    if not ranked:
+        return {"error": "Could not match voice command to any available choice", "transcript": text}
+    if ranked[0].get("ambiguous"):
+        return {"error": "Voice command matches more than one choice equally well", "transcript": text,
+                "candidates": [candidate for candidate in ranked if candidate.get("ambiguous")]}
+    if ranked[0]["confidence"] < VOICE_MIN_CONFIDENCE:
+        return {"error": "Voice command did not clearly match any choice", "transcript": text,
+                "candidates": ranked}
+    
+    choices_by_id = {choice["id"]: choice for choice in available_choices}
+    best = ranked[0]
+    result = dict(choices_by_id.get(best["id"], {"id": best["id"], "text": best["text"]}))
+    result["confidence"] = best["confidence"]
+    result["transcript"] = text
+    result["ranked"] = ranked
+    return result
+
+def process_voice_command(audio_source, available_choices=None, matcher=None, deadline=None,
+                          session_id=None):
     """
     Process a voice command and match it to an available choice
     
     Args:
-        audio_path (str): Path to the audio file
+        audio_source: Path to the audio file, its bytes, or a file-like object
         available_choices (list): List of available choice dictionaries
+        matcher (ChoiceMatcher): Prebuilt index for the scene's choices, if available
+        deadline (float): Seconds to wait for recognition (defaults to STT_DEADLINE)
+        session_id (str): Session whose cached noise calibration to use
         
     Returns:
-        dict: Matched choice or error message if no match found
+        dict: Matched choice or error message if no match found; both carry
+              "audio" with how much silence was trimmed
     """
     if not available_choices:
         return {"error": "No available choices provided."}
         
-    # Get text from audio
-    text = get_text_from_audio(audio_path)
+    # Get text from audio on the recognition pool
+    text, audio_stats = recognize_with_deadline(audio_source, deadline, session_id)
     
     if text.startswith("Error"):
-        return {"error": text}
-    
-    # Simple matching algorithm - find choice with most words matching the transcribed text
-    best_match = None
-    max_matches = 0
-    
-    text_words = set(text.lower().split())
+        return {"error": text, "audio": audio_stats}
     
-    for choice in available_choices:
-        choice_words = set(choice["text"].lower().split())
-        matches = len(text_words.intersection(choice_words))
-        
-        if matches > max_matches:
-            max_matches = matches
-            best_match = choice
-    
-    # If we have a reasonable match (at least one matching word)
-    if max_matches > 0:
-        return best_match
-    else:
-        return {"error": "Could not match voice command to any available choice"}
+    result = match_choice(text, available_choices, matcher)
+    result["audio"] = audio_stats
+    return result
 
-def mic_speech_to_text(timeout=5):
+def mic_speech_to_text(timeout=5, session_id=None):
     """
     Convert speech from microphone to text
     
+    Ambient noise calibration runs once per session; later calls reuse the
+    cached energy threshold so the start of the utterance is not lost.
+    
     Args:
         timeout (int): Maximum number of seconds to listen
+        session_id (str): Session whose calibration to reuse
         
     Returns:
         str: Extracted text from speech or an error message
     """
+    sr = lazy_import("speech_recognition")
     recognizer = sr.Recognizer()
     
     try:
         with sr.Microphone() as source:
-            print("Listening...")
-            # Adjust for ambient noise
-            recognizer.adjust_for_ambient_noise(source)
+            cached_threshold = mic_calibration.get(session_id)
+            if cached_threshold is not None:
+                recognizer.energy_threshold = cached_threshold
+            else:
+                # Adjust for ambient noise (first call of the session only)
+                recognizer.adjust_for_ambient_noise(source, duration=0.5)
             
+            print("Listening...")
             # Listen for speech
             audio_data = recognizer.listen(source, timeout=timeout)
+            mic_calibration.update(session_id, recognizer.energy_threshold)
             
-            print("Recognizing...")
+            audio_data, stats = preprocess_audio(audio_data, session_id)
+            print(f"Recognizing... (trimmed {stats['trimmed_ms']} ms of silence)")
             # Use Google's Speech Recognition
-            text = recognizer.recognize_google(audio_data)
+            with span("stt.recognize", "google"):
+                text = recognizer.recognize_google(audio_data)
             return text
     except sr.UnknownValueError:
         return "Error: Speech recognition could not understand audio"
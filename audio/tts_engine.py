@@ -5,62 +5,212 @@ This module provides functionality to convert text to speech and save
 audio files using both local (pyttsx3) and internet-based (gTTS) methods.
 """
 import os
+import io
 import threading
-import requests
-import tempfile
-import pyttsx3
-try:
-    from gtts import gTTS
-    GTTS_AVAILABLE = True
-except ImportError:
-    GTTS_AVAILABLE = False
+from concurrent.futures import wait, TimeoutError as FutureTimeoutError
 from urllib.parse import urlparse
+from audio.audio_cache import get_audio_cache, audio_cache_key
+from common.metrics import span
+from common.lazy_imports import is_available, lazy_import
+from common.singleflight import SingleFlight, atomic_output, temp_path
+from common.scheduler import Overloaded, PriorityThreadPoolExecutor, backend_scheduler
+from audio.local_tts_pool import get_local_tts_pool, LOCAL_TTS_WORKERS
 
-# Global lock to ensure only one TTS operation runs at a time
-tts_lock = threading.Lock()
+# gTTS is imported on first synthesis (see _gtts_class)
+GTTS_AVAILABLE = is_available("gtts")
+gTTS = None
 
-def generate_audio(scene_text, scene_id, output_dir="static/audio", use_online=True):
+# Size of the shared pool that synthesizes scene clips in parallel
+TTS_MAX_WORKERS = int(os.getenv("TTS_MAX_WORKERS", 8))
+
+# Seconds generate_scene_audio waits for clips before returning what is ready
+SCENE_AUDIO_DEADLINE = float(os.getenv("TTS_SCENE_DEADLINE", 20))
+
+# Clips allowed to wait for a TTS thread before new scenes are rejected
+TTS_MAX_QUEUE = int(os.getenv("TTS_MAX_QUEUE", 64))
+
+# Maximum concurrent synthesis calls per backend (further calls queue by priority)
+BACKEND_CONCURRENCY = {
+    "gtts": int(os.getenv("GTTS_CONCURRENCY", 4)),
+    "pyttsx3": int(os.getenv("LOCAL_TTS_CONCURRENCY", LOCAL_TTS_WORKERS))
+}
+
+_tts_executor = None
+_tts_executor_lock = threading.Lock()
+_queued_clips = 0  # scene clips submitted but not yet started or cancelled
+
+# Concurrent requests for the same clip share one synthesis, across processes too
+tts_flight = SingleFlight("tts")
+
+# Seconds to wait for a local synthesis job before giving up
+LOCAL_TTS_TIMEOUT = float(os.getenv("LOCAL_TTS_TIMEOUT", 60))
+
+# Voice settings - part of every cache key, so changing them re-synthesizes
+TTS_LANG = os.getenv("TTS_LANG", "en")
+GTTS_TLD = os.getenv("GTTS_TLD", "com")
+LOCAL_TTS_RATE = 150
+LOCAL_TTS_VOLUME = 0.9
+LOCAL_TTS_VOICE_INDEX = 1
+
+def backend_slot(engine, priority=None):
+    """
+    Take a slot from a TTS backend's scheduler
+    
+    Args:
+        engine (str): "gtts" or "pyttsx3"
+        priority (int or PriorityHandle): Defaults to the caller's priority
+    
+    Raises:
+        Overloaded: If the backend's queue is full
+    """
+    return backend_scheduler(engine, BACKEND_CONCURRENCY[engine]).slot(priority)
+
+def get_tts_executor():
+    """Get the shared, bounded executor used for clip synthesis"""
+    global _tts_executor
+    with _tts_executor_lock:
+        if _tts_executor is None:
+            # Clips keep the priority of the request or prefetch that submitted them
+            _tts_executor = PriorityThreadPoolExecutor(max_workers=TTS_MAX_WORKERS,
+                                                       thread_name_prefix="tts")
+        return _tts_executor
+
+def _gtts_class():
+    """Import gTTS on first use"""
+    global gTTS
+    if gTTS is None:
+        gTTS = lazy_import("gtts").gTTS
+    return gTTS
+
+def tts_queue_depth():
+    """Clips waiting for a TTS worker thread (0 before the executor starts)"""
+    executor = _tts_executor
+    return executor._work_queue.qsize() if executor is not None else 0
+
+def online_cache_key(text):
+    """Cache key of a clip synthesized with gTTS and the current settings"""
+    return audio_cache_key(text, "gtts", GTTS_TLD, "normal", TTS_LANG)
+
+def local_cache_key(text):
+    """Cache key of a clip synthesized with pyttsx3 and the current settings"""
+    return audio_cache_key(text, "pyttsx3", LOCAL_TTS_VOICE_INDEX, LOCAL_TTS_RATE, TTS_LANG)
+
+def generate_audio(scene_text, scene_id=None, output_dir="static/audio", use_online=True):
     """
     Generate audio file from scene text - with option to use online TTS
     
+    Files are content-addressed by (text, engine, voice, rate, lang), so
+    identical text is only ever synthesized once.
+    
     Args:
         scene_text (str): The text to convert to speech
-        scene_id (str): Scene ID to use in the filename
-        output_dir (str): Directory to save the audio file
+        scene_id (str): Scene the text belongs to (used for log messages only)
+        output_dir (str): Directory of the audio cache
         use_online (bool): Whether to use online TTS (True) or local TTS (False)
         
     Returns:
         str: Path to the generated audio file
     """
-    # Create output directory if it doesn't exist
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # Prepare output path
-    output_path = os.path.join(output_dir, f"{scene_id}.mp3")
-    
-    # Check if file already exists - if so, just return the path
-    if os.path.exists(output_path):
-        return output_path
+    cache = get_audio_cache(output_dir)
     
     # Choose TTS method based on parameter
     if use_online and GTTS_AVAILABLE:
+        key = online_cache_key(scene_text)
+        cached_path = cache.lookup(key)
+        if cached_path:
+            return cached_path
+        
         # Use Google TTS (requires internet)
+        def synthesize_online(output_path):
+            with span("tts.clip", "gtts"):
+                return generate_online_audio(scene_text, output_path)
         try:
-            return generate_online_audio(scene_text, output_path)
+            return _synthesize_clip(cache, key, synthesize_online, "gtts")
+        except Overloaded:
+            # Local synthesis is slower still; let the caller shed the request
+            raise
         except Exception as e:
-            print(f"Online TTS failed: {e}. Falling back to local TTS.")
+            print(f"Online TTS failed for {scene_id}: {e}. Falling back to local TTS.")
+    
+    # Use local pyttsx3
+    key = local_cache_key(scene_text)
+    cached_path = cache.lookup(key)
+    if cached_path:
+        return cached_path
+    
+    def synthesize_local(output_path):
+        with span("tts.clip", "pyttsx3"):
             return generate_local_audio(scene_text, output_path)
-    else:
-        # Use local pyttsx3
-        return generate_local_audio(scene_text, output_path)
+    return _synthesize_clip(cache, key, synthesize_local, "pyttsx3")
 
-def generate_online_audio(text, output_path):
+def _synthesize_clip(cache, key, synthesize, engine):
+    """
+    Synthesize a clip into the cache, once however many callers ask for it
+    
+    The caller that runs the synthesis takes the engine's scheduler slot
+    before the cross-process clip lock, so it never queues for a slot while
+    other processes wait on the lock.
+    
+    Args:
+        cache (AudioCache): The audio cache
+        key (str): The clip's content address
+        synthesize (callable): Writes the clip to the path it is given;
+            returns a falsy value on failure
+        engine (str): TTS backend whose slot the synthesis takes
+    
+    Returns:
+        str: Path to the cached clip, or None if synthesis failed
+    """
+    def job():
+        # Written by an earlier flight or another process while we waited
+        if cache.contains(key):
+            return cache.commit(key)
+        output_path = cache.path_for(key)
+        tmp_path = temp_path(output_path)
+        try:
+            if not synthesize(tmp_path) or not os.path.exists(tmp_path):
+                return None
+            os.replace(tmp_path, output_path)
+            return cache.commit(key)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return tts_flight.do(key, job, os.path.join(cache.cache_dir, ".locks"),
+                         admission=lambda priority: backend_slot(engine, priority))
+
+def store_clip(cache, key, parts):
+    """
+    Write audio synthesized elsewhere (e.g. sentence by sentence) into the cache
+    
+    Goes through the same single-flight and clip lock as synthesis, so it
+    never races a synthesis of the same clip in this or another process.
+    
+    Args:
+        cache (AudioCache): The audio cache
+        key (str): The clip's content address
+        parts (list): MP3 chunks making up the clip, in order
+    
+    Returns:
+        str: Path to the cached clip
+    """
+    def job():
+        if cache.contains(key):
+            return cache.commit(key)
+        with atomic_output(cache.path_for(key)) as tmp_path:
+            with open(tmp_path, 'wb') as f:
+                f.write(b"".join(parts))
+        return cache.commit(key)
+    return tts_flight.do(key, job, os.path.join(cache.cache_dir, ".locks"))
+
+def generate_online_audio(text, output_path, lang=None, tld=None):
     """
     Generate audio using Google's Text-to-Speech API
     
     Args:
         text (str): The text to convert to speech
         output_path (str): Path to save the audio file
+        lang (str): Language code (defaults to TTS_LANG)
+        tld (str): Google domain selecting the accent (defaults to GTTS_TLD)
         
     Returns:
         str: Path to the generated audio file
@@ -69,68 +219,59 @@ def generate_online_audio(text, output_path):
         if not GTTS_AVAILABLE:
             raise ImportError("gTTS is not installed. Run 'pip install gtts' to use online TTS.")
             
-        tts = gTTS(text=text, lang='en', slow=False)
+        tts = _gtts_class()(text=text, lang=lang or TTS_LANG, tld=tld or GTTS_TLD, slow=False)
         tts.save(output_path)
         return output_path
     except Exception as e:
         print(f"Error generating online audio: {e}")
         raise
 
-def generate_local_audio(scene_text, output_path):
+def synthesize_online_bytes(text, lang=None, tld=None):
     """
-    Generate audio using local pyttsx3 engine
+    Synthesize text with gTTS into memory
     
     Args:
-        scene_text (str): The text to convert to speech
-        output_path (str): Path to save the audio file
+        text (str): The text to convert to speech
+        lang (str): Language code (defaults to TTS_LANG)
+        tld (str): Google domain selecting the accent (defaults to GTTS_TLD)
         
     Returns:
-        str: Path to the generated audio file
+        bytes: MP3 data
     """
-    # Generate in a separate thread
-    tts_thread = threading.Thread(
-        target=_generate_audio_threaded,
-        args=(scene_text, output_path)
-    )
-    tts_thread.start()
+    if not GTTS_AVAILABLE:
+        raise ImportError("gTTS is not installed. Run 'pip install gtts' to use online TTS.")
     
-    return output_path
+    buffer = io.BytesIO()
+    with backend_slot("gtts"), span("tts.sentence", "gtts"):
+        _gtts_class()(text=text, lang=lang or TTS_LANG, tld=tld or GTTS_TLD, slow=False).write_to_fp(buffer)
+    return buffer.getvalue()
 
-def _generate_audio_threaded(scene_text, output_path):
+def generate_local_audio(scene_text, output_path, timeout=None):
     """
-    Thread worker function to generate audio locally
+    Generate audio using the pool of persistent local pyttsx3 workers
+    
+    Blocks until the worker has finished writing the file.
     
     Args:
         scene_text (str): The text to convert to speech
         output_path (str): Path to save the audio file
+        timeout (float): Seconds to wait (defaults to LOCAL_TTS_TIMEOUT)
+        
+    Returns:
+        str: Path to the generated audio file, or None if synthesis failed
     """
     try:
-        with tts_lock:  # Ensure only one TTS operation at a time
-            # Initialize a new engine each time
-            engine = pyttsx3.init()
-            
-            # Set properties
-            engine.setProperty('rate', 150)  # Speed of speech
-            engine.setProperty('volume', 0.9)  # Volume (0.0 to 1.0)
-            
-            # Get available voices and set a voice
-            voices = engine.getProperty('voices')
-            if voices:
-                # Try to find a female voice (often index 1)
-                if len(voices) > 1:
-                    engine.setProperty('voice', voices[1].id)
-                else:
-                    engine.setProperty('voice', voices[0].id)
-            
-            # Save to file
-            engine.save_to_file(scene_text, output_path)
-            engine.runAndWait()
-            
-            # Clean up
-            engine.stop()
-            
+        pool = get_local_tts_pool(LOCAL_TTS_RATE, LOCAL_TTS_VOLUME, LOCAL_TTS_VOICE_INDEX)
+        future = pool.submit(scene_text, output_path)
+        try:
+            return future.result(timeout=LOCAL_TTS_TIMEOUT if timeout is None else timeout)
+        except FutureTimeoutError:
+            # The pool deletes the file if the worker finishes after all
+            future.cancel()
+            raise
     except Exception as e:
         print(f"Error generating audio locally: {e}")
+        return None
 
 def use_audio_from_url(url, scene_id, output_dir="static/audio"):
     """
@@ -163,70 +304,158 @@ def use_audio_from_url(url, scene_id, output_dir="static/audio"):
     
     # Download the file
     try:
-        response = requests.get(url, stream=True)
+        response = lazy_import("requests").get(url, stream=True)
         response.raise_for_status()  # Raise an exception for HTTP errors
         
-        with open(output_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        with atomic_output(output_path) as tmp_path:
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=8192):
+                    f.write(chunk)
         
         return output_path
     except Exception as e:
         print(f"Error downloading audio from URL: {e}")
         return None
 
-def generate_scene_audio(scene_data, output_dir="static/audio", use_online=True):
+def _admit_clips(count, engine, deadline):
+    """
+    Reject a scene at once if its clips cannot be synthesized in time
+    
+    Clips only reach their backend's scheduler once a TTS thread picks them
+    up, so the executor's queue is bounded here, when they are submitted:
+    by TTS_MAX_QUEUE, and by the scene's deadline given recent clip times.
+    
+    Args:
+        count (int): Clips about to be submitted
+        engine (str): TTS backend the clips will use
+        deadline (float): Seconds the caller will wait for the clips
+    
+    Raises:
+        Overloaded: If the queue cannot take the clips
+    """
+    global _queued_clips
+    scheduler = backend_scheduler(engine, BACKEND_CONCURRENCY[engine])
+    with _tts_executor_lock:
+        queued = _queued_clips
+        if not queued:
+            reason = None
+        elif queued + count > TTS_MAX_QUEUE:
+            reason = "TTS queue full"
+        elif scheduler.expected_wait(queued) > deadline:
+            reason = "TTS queue longer than the scene deadline"
+        else:
+            reason = None
+        if reason is None:
+            _queued_clips += count
+            return
+    raise Overloaded(engine, scheduler.retry_after(queued), reason)
+
+def _clips_left_queue(count):
+    """Forget admitted clips once they start or are cancelled"""
+    global _queued_clips
+    with _tts_executor_lock:
+        _queued_clips -= count
+
+def _run_clip(text, label, output_dir, use_online):
+    """Executor entry point of an admitted scene clip"""
+    _clips_left_queue(1)
+    return generate_audio(text, label, output_dir, use_online)
+
+def generate_scene_audio(scene_data, output_dir="static/audio", use_online=True, deadline=None,
+                         include_narrative=True):
     """
     Generate audio files for a complete scene
     
+    Cached clips are returned at once; the rest are synthesized in parallel
+    on the shared TTS executor. When the executor's queue is full the scene
+    is rejected with Overloaded instead of waiting out the deadline. Clips
+    still queued at the deadline are cancelled; those already running keep
+    going and land in the cache for the next request.
+    
     Args:
         scene_data (dict): The scene data with narrative and choices
         output_dir (str): Directory to save the audio files
         use_online (bool): Whether to use online TTS
+        deadline (float): Seconds to wait for all clips (defaults to SCENE_AUDIO_DEADLINE)
+        include_narrative (bool): Set to False when the narrative is streamed instead
         
     Returns:
-        dict: Paths to the generated audio files
+        dict: Paths to the generated audio files (None for clips not ready in time)
+        
+    Raises:
+        Overloaded: If the TTS queue is full or a TTS backend rejected a clip
     """
-    audio_paths = {}
+    jobs = []
+    
+    # Audio for the narrative
+    if include_narrative and "narrative" in scene_data:
+        jobs.append(("narrative", scene_data["narrative"], f"{scene_data['scene_id']}_narrative"))
     
-    # Generate audio for the narrative
-    if "narrative" in scene_data:
-        narrative_path = generate_audio(
-            scene_data["narrative"], 
-            f"{scene_data['scene_id']}_narrative", 
-            output_dir,
-            use_online
-        )
-        audio_paths["narrative"] = narrative_path
-    
-    # Generate audio for each choice
+    # Audio for each choice
     for i, choice in enumerate(scene_data.get("choices", [])):
-        choice_text = choice["text"]
-        choice_id = choice["id"]
-        
-        choice_path = generate_audio(
-            choice_text,
-            f"{scene_data['scene_id']}_{choice_id}",
-            output_dir,
-            use_online
-        )
-        audio_paths[f"choice_{i+1}"] = choice_path
+        jobs.append((f"choice_{i+1}", choice["text"], f"{scene_data['scene_id']}_{choice['id']}"))
+    
+    audio_paths = {}
+    online = use_online and GTTS_AVAILABLE
+    cache = get_audio_cache(output_dir)
+    missing = []
+    for audio_key, text, label in jobs:
+        cached_path = cache.lookup(online_cache_key(text) if online else local_cache_key(text))
+        if cached_path:
+            audio_paths[audio_key] = cached_path
+        else:
+            missing.append((audio_key, text, label))
+    if not missing:
+        return audio_paths
+    
+    timeout = SCENE_AUDIO_DEADLINE if deadline is None else deadline
+    _admit_clips(len(missing), "gtts" if online else "pyttsx3", timeout)
+    executor = get_tts_executor()
+    futures = [
+        (audio_key, executor.submit(_run_clip, text, label, output_dir, use_online))
+        for audio_key, text, label in missing
+    ]
+    
+    with span("tts.scene"):
+        _, not_done = wait([future for _, future in futures], timeout=timeout)
+    if not_done:
+        # Nobody is waiting for these any more; free the queue for live requests
+        cancelled = sum(1 for future in not_done if future.cancel())
+        _clips_left_queue(cancelled)
+        print(f"Scene {scene_data.get('scene_id')}: {len(not_done)} audio clips not ready after {timeout}s "
+              f"({cancelled} cancelled before starting)")
+    
+    for audio_key, future in futures:
+        if future in not_done:
+            audio_paths[audio_key] = None
+            continue
+        try:
+            audio_paths[audio_key] = future.result()
+        except Overloaded:
+            raise
+        except Exception as e:
+            print(f"Error generating {audio_key} audio for {scene_data.get('scene_id')}: {e}")
+            audio_paths[audio_key] = None
     
-    return audio_paths
+    # Keep the narrative-then-choices order of the payload
+    return {audio_key: audio_paths[audio_key] for audio_key, _, _ in jobs}
 
 def text_to_speech_demo():
-    """A simple demo function to test TTS functionality"""
+    """
+    A simple demo function to test TTS functionality
+    
+    Returns:
+        tuple: (status message, path to the demo audio file or None)
+    """
     try:
-        # Use a temporary file for the demo
-        temp_file = os.path.join("static/audio", "demo.mp3")
-        os.makedirs("static/audio", exist_ok=True)
-        
         demo_text = "Welcome to the Interactive Audio Quest. Your adventure awaits!"
-        generate_audio(demo_text, "demo", use_online=GTTS_AVAILABLE)
+        demo_path = generate_audio(demo_text, "demo", use_online=GTTS_AVAILABLE)
+        if not demo_path:
+            return "TTS demo failed: no audio was generated", None
         
-        return "TTS demo queued successfully. Audio will be available at: " + temp_file
+        return f"TTS demo generated successfully. Audio saved at: {demo_path}", demo_path
     except Exception as e:
-        return f"TTS demo failed: {e}"
+        return f"TTS demo failed: {e}", None
 
 # Sample premium audio URLs - for demonstration purposes only
 # In a real implementation, these would be actual URLs to audio files
@@ -0,0 +1,11 @@
+"""
+Benchmarks Package - Reproducible load tests for the Flask API
+
+Drives the app in-process with a concurrent load generator while Gemini,
+gTTS, local TTS and Firestore are replaced by local stand-ins with
+configurable latency and failure rates, and compares the results against
+stored JSON baselines.
+
+Usage:
+    python -m benchmarks [--requests N] [--concurrency C] [--save-baseline NAME] [--compare NAME]
+"""
@@ -0,0 +1,155 @@
+"""
+Command-line entry point for the benchmark suite
+
+Runs every scenario in a scratch working directory (so caches, the audio
+directory and the offline database start empty and the repository is not
+touched), prints a latency table and optionally saves or checks a baseline.
+Exits with status 1 when a regression against the baseline is found.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+
+from benchmarks.stand_ins import LatencyProfile, install_stand_ins
+from benchmarks.load import default_scenarios, run_scenario
+from benchmarks.baseline import (baseline_path, save_baseline, load_baseline, compare,
+                                 DEFAULT_LATENCY_THRESHOLD,
+                                 DEFAULT_THROUGHPUT_THRESHOLD, DEFAULT_ERROR_RATE_THRESHOLD)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _add_profile_arguments(parser, name, latency_ms, jitter_ms):
+    """Add --<name>-latency/-jitter/-failure options for one stand-in"""
+    parser.add_argument(f"--{name}-latency", type=float, default=latency_ms,
+                        help=f"Mean {name} stand-in latency in ms (default {latency_ms})")
+    parser.add_argument(f"--{name}-jitter", type=float, default=jitter_ms,
+                        help=f"{name} stand-in latency jitter in ms (default {jitter_ms})")
+    parser.add_argument(f"--{name}-failure", type=float, default=0.0,
+                        help=f"{name} stand-in failure rate between 0 and 1 (default 0)")
+
+
+def _profile(args, name, seed):
+    """Build a LatencyProfile from the parsed options of one stand-in"""
+    key = name.replace("-", "_")
+    return LatencyProfile(getattr(args, f"{key}_latency"), getattr(args, f"{key}_jitter"),
+                          getattr(args, f"{key}_failure"), seed)
+
+
+def _prepare_workdir():
+    """Switch to a scratch directory that sees the repository's stories"""
+    workdir = tempfile.mkdtemp(prefix="audio-quest-bench-")
+    os.symlink(os.path.join(REPO_ROOT, "sample_data"), os.path.join(workdir, "sample_data"))
+    os.chdir(workdir)
+    # Offline at startup; the Firestore stand-in is attached afterwards
+    os.environ["FIREBASE_KEY_PATH"] = ""
+    os.environ["GEMINI_API_KEY"] = os.environ.get("GEMINI_API_KEY") or "benchmark"
+    return workdir
+
+
+def main(argv=None):
+    """Run the benchmark suite"""
+    parser = argparse.ArgumentParser(description="Load-test the API against local stand-ins")
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent client threads")
+    parser.add_argument("--warmup", type=int, default=10, help="Unmeasured requests per scenario")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for requests and stand-ins")
+    parser.add_argument("--scenario", action="append", help="Only run the named scenario(s)")
+    parser.add_argument("--story", default="sample_story", help="Static story to walk")
+    _add_profile_arguments(parser, "gemini", 300.0, 100.0)
+    _add_profile_arguments(parser, "gtts", 150.0, 50.0)
+    _add_profile_arguments(parser, "local-tts", 400.0, 100.0)
+    _add_profile_arguments(parser, "firestore", 15.0, 5.0)
+    parser.add_argument("--output", help="Write the results JSON to this path")
+    parser.add_argument("--save-baseline", metavar="NAME", help="Save results as a baseline")
+    parser.add_argument("--compare", metavar="NAME", help="Compare results against a baseline")
+    parser.add_argument("--latency-threshold", type=float, default=DEFAULT_LATENCY_THRESHOLD,
+                        help="Allowed relative p50/p95/p99 growth")
+    parser.add_argument("--throughput-threshold", type=float, default=DEFAULT_THROUGHPUT_THRESHOLD,
+                        help="Allowed relative requests-per-second drop")
+    parser.add_argument("--error-rate-threshold", type=float, default=DEFAULT_ERROR_RATE_THRESHOLD,
+                        help="Allowed absolute error rate growth")
+    args = parser.parse_args(argv)
+
+    # Resolve baseline paths before leaving the current directory
+    save_path = baseline_path(args.save_baseline) if args.save_baseline else None
+    save_path = os.path.abspath(save_path) if save_path else None
+    output_path = os.path.abspath(args.output) if args.output else None
+    baseline = load_baseline(args.compare) if args.compare else None
+
+    workdir = _prepare_workdir()
+    sys.path.insert(0, REPO_ROOT)
+    import main as app_module
+
+    profiles = {
+        "gemini": _profile(args, "gemini", args.seed),
+        "gtts": _profile(args, "gtts", args.seed + 1),
+        "local_tts": _profile(args, "local-tts", args.seed + 2),
+        "firestore": _profile(args, "firestore", args.seed + 3)
+    }
+    install_stand_ins(app_module, profiles["gemini"], profiles["gtts"],
+                      profiles["local_tts"], profiles["firestore"])
+
+    story = app_module.story_catalog.get(args.story)
+    if story is None:
+        print(f"Story {args.story} not found")
+        return 2
+    scenarios = [s for s in default_scenarios(story) if not args.scenario or s.name in args.scenario]
+
+    results = {
+        "created_at": time.time(),
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+            "seed": args.seed,
+            "story": args.story,
+            "stand_ins": {name: profile.to_dict() for name, profile in profiles.items()}
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count()
+        },
+        "scenarios": {}
+    }
+
+    print(f"Benchmarking in {workdir}")
+    print(f"{'scenario':<24}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for scenario in scenarios:
+        summary = run_scenario(app_module.app, scenario, args.requests, args.concurrency,
+                               args.warmup, args.seed)
+        results["scenarios"][scenario.name] = summary
+        print(f"{scenario.name:<24}{summary['rps']:>9.1f}{summary['p50_ms']:>10.1f}"
+              f"{summary['p95_ms']:>10.1f}{summary['p99_ms']:>10.1f}{summary['errors']:>8}")
+
+    app_module.firebase.flush()
+    results["stand_in_calls"] = {name: profile.stats() for name, profile in profiles.items()}
+
+    if output_path:
+        with open(output_path, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Wrote {output_path}")
+    if save_path:
+        print(f"Saved baseline {save_baseline(save_path, results)}")
+
+    if baseline is not None:
+        if baseline.get("config") != results["config"]:
+            print("Warning: baseline was recorded with a different configuration")
+        regressions = compare(results, baseline, args.latency_threshold,
+                              args.throughput_threshold, args.error_rate_threshold)
+        if regressions:
+            print("Regressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+Baseline Module - Stored benchmark results and regression checks
+
+Results are saved as benchmarks/baselines/<name>.json. A later run is
+compared scenario by scenario: latency percentiles may not grow, and
+throughput may not drop, by more than the configured fractions.
+"""
+import os
+import json
+
+# Directory holding saved baselines
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+# Allowed relative growth of p50/p95/p99 latency before a run counts as a regression
+DEFAULT_LATENCY_THRESHOLD = 0.25
+
+# Allowed relative drop in requests per second
+DEFAULT_THROUGHPUT_THRESHOLD = 0.15
+
+# Allowed absolute growth of the error rate
+DEFAULT_ERROR_RATE_THRESHOLD = 0.01
+
+# Latency growth below this many milliseconds is treated as noise
+MIN_LATENCY_DELTA_MS = 2.0
+
+LATENCY_METRICS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def baseline_path(name):
+    """Resolve a baseline name (or explicit .json path) to a file path"""
+    if name.endswith(".json"):
+        return name
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def save_baseline(name, results):
+    """
+    Write benchmark results as a baseline
+
+    Args:
+        name (str): Baseline name or path
+        results (dict): Output of a benchmark run
+
+    Returns:
+        str: Path the baseline was written to
+    """
+    path = baseline_path(name)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+    return path
+
+
+def load_baseline(name):
+    """
+    Read a saved baseline
+
+    Raises:
+        FileNotFoundError: If the baseline does not exist
+    """
+    with open(baseline_path(name), 'r') as f:
+        return json.load(f)
+
+
+def compare(results, baseline, latency_threshold=DEFAULT_LATENCY_THRESHOLD,
+            throughput_threshold=DEFAULT_THROUGHPUT_THRESHOLD,
+            error_rate_threshold=DEFAULT_ERROR_RATE_THRESHOLD):
+    """
+    Compare a run against a baseline
+
+    Args:
+        results (dict): Output of the current run
+        baseline (dict): Output of the baseline run
+        latency_threshold (float): Allowed relative latency growth
+        throughput_threshold (float): Allowed relative throughput drop
+        error_rate_threshold (float): Allowed absolute error rate growth
+
+    Returns:
+        list: Human-readable regression descriptions (empty if none)
+    """
+    regressions = []
+    for name, current in results.get("scenarios", {}).items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            continue
+        for metric in LATENCY_METRICS:
+            limit = previous[metric] * (1 + latency_threshold)
+            if current[metric] > limit and current[metric] - previous[metric] > MIN_LATENCY_DELTA_MS:
+                regressions.append(f"{name}: {metric} {current[metric]:.1f} > {limit:.1f} "
+                                   f"(baseline {previous[metric]:.1f})")
+        floor = previous["rps"] * (1 - throughput_threshold)
+        if current["rps"] < floor:
+            regressions.append(f"{name}: rps {current['rps']:.1f} < {floor:.1f} "
+                               f"(baseline {previous['rps']:.1f})")
+        if current["error_rate"] > previous["error_rate"] + error_rate_threshold:
+            regressions.append(f"{name}: error rate {current['error_rate']:.3f} "
+                               f"(baseline {previous['error_rate']:.3f})")
+    return regressions
@@ -0,0 +1,152 @@
+"""
+Load Module - Concurrent load generator and latency statistics
+
+Each scenario builds one request (method, path, JSON body) per index from
+a seeded random generator, and run_scenario() replays them against the
+Flask app from a pool of client threads, timing every request.
+"""
+import math
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of already sorted values
+
+    Args:
+        sorted_values (list): Values in ascending order
+        fraction (float): Percentile as a fraction (0.95 for p95)
+
+    Returns:
+        float: The percentile, or 0.0 for no values
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, errors, wall_seconds):
+    """
+    Summarize one scenario run
+
+    Args:
+        latencies (list): Per-request latencies in seconds
+        errors (int): Requests that failed or returned a non-2xx status
+        wall_seconds (float): Wall-clock duration of the run
+
+    Returns:
+        dict: requests, errors, error_rate, rps and latency figures in ms
+    """
+    ordered = sorted(latencies)
+    count = len(ordered)
+    return {
+        "requests": count,
+        "errors": errors,
+        "error_rate": round(errors / count, 4) if count else 0.0,
+        "rps": round(count / wall_seconds, 2) if wall_seconds > 0 else 0.0,
+        "mean_ms": round(1000 * sum(ordered) / count, 2) if count else 0.0,
+        "p50_ms": round(1000 * percentile(ordered, 0.50), 2),
+        "p95_ms": round(1000 * percentile(ordered, 0.95), 2),
+        "p99_ms": round(1000 * percentile(ordered, 0.99), 2),
+        "max_ms": round(1000 * ordered[-1], 2) if count else 0.0
+    }
+
+
+class Scenario:
+    """A named endpoint workload"""
+
+    def __init__(self, name, build_request):
+        """
+        Args:
+            name (str): Name used in reports and baselines
+            build_request (callable): (index, rng) -> (method, path, json body or None)
+        """
+        self.name = name
+        self.build_request = build_request
+
+
+def default_scenarios(story):
+    """
+    Workloads for /start_story, /next_scene (static and generated) and /test_audio
+
+    Args:
+        story (CompiledStory): Static story whose transitions /next_scene walks
+
+    Returns:
+        list: Scenario objects
+    """
+    transitions = sorted((scene_id, choice_id)
+                         for (scene_id, choice_id), next_scene in story.transitions.items()
+                         if story.has_scene(next_scene))
+
+    def start_story(index, rng):
+        return "GET", f"/start_story?user_id=bench-{index}&story_id={story.story_key}", None
+
+    def next_scene(index, rng):
+        scene_id, choice_id = rng.choice(transitions)
+        return "POST", "/next_scene", {"user_id": f"bench-{index}", "scene_id": scene_id,
+                                       "choice_id": choice_id, "story_id": story.story_key}
+
+    def next_scene_generated(index, rng):
+        # A fresh choice per request misses the generation cache and reaches Gemini
+        return "POST", "/next_scene", {"user_id": f"bench-{index}", "scene_id": "start",
+                                       "choice_id": f"bench_choice_{index}", "use_sample": False}
+
+    def test_audio(index, rng):
+        return "GET", "/test_audio", None
+
+    return [
+        Scenario("start_story", start_story),
+        Scenario("next_scene", next_scene),
+        Scenario("next_scene_generated", next_scene_generated),
+        Scenario("test_audio", test_audio)
+    ]
+
+
+def run_scenario(app, scenario, requests=200, concurrency=8, warmup=10, seed=0):
+    """
+    Replay a scenario against the app from concurrent client threads
+
+    Args:
+        app (Flask): The application under test
+        scenario (Scenario): The workload
+        requests (int): Measured requests
+        concurrency (int): Client threads
+        warmup (int): Unmeasured requests sent first
+        seed (int): Seed of the request generator
+
+    Returns:
+        dict: Summary from summarize()
+    """
+    rng = random.Random(f"{seed}-{scenario.name}")
+    planned = [scenario.build_request(i, rng) for i in range(warmup + requests)]
+    clients = threading.local()
+
+    def send(request_spec):
+        method, path, body = request_spec
+        client = getattr(clients, "client", None)
+        if client is None:
+            client = clients.client = app.test_client()
+        started = time.perf_counter()
+        try:
+            response = client.open(path, method=method, json=body)
+            ok = 200 <= response.status_code < 300
+            response.close()
+        except Exception as e:
+            print(f"{scenario.name}: request failed: {e}")
+            ok = False
+        return time.perf_counter() - started, ok
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bench") as pool:
+        list(pool.map(send, planned[:warmup]))
+        started = time.perf_counter()
+        results = list(pool.map(send, planned[warmup:]))
+        wall_seconds = time.perf_counter() - started
+
+    latencies = [latency for latency, _ in results]
+    errors = sum(1 for _, ok in results if not ok)
+    return summarize(latencies, errors, wall_seconds)
@@ -0,0 +1,305 @@
+"""
+Stand-ins Module - Local replacements for external services
+
+Each stand-in sleeps for a configurable latency (with jitter) and fails at
+a configurable rate, driven by a seeded random generator so runs are
+reproducible. install_stand_ins() patches them into the application's
+modules in place of Gemini, gTTS, the local pyttsx3 pool and Firestore.
+"""
+import re
+import json
+import time
+import uuid
+import random
+import hashlib
+import threading
+
+
+class StandInFailure(Exception):
+    """Raised by a stand-in to simulate a failed backend call"""
+
+
+class LatencyProfile:
+    """Latency and failure behaviour of one stand-in backend"""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, failure_rate=0.0, seed=0):
+        """
+        Args:
+            latency_ms (float): Mean added latency per call
+            jitter_ms (float): Maximum deviation from the mean, uniformly drawn
+            failure_rate (float): Probability in [0, 1] that a call fails
+            seed (int): Seed of the profile's random generator
+        """
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self.failures = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def draw(self):
+        """
+        Draw one call's behaviour
+
+        Returns:
+            tuple: (latency in seconds, whether the call fails)
+        """
+        with self._lock:
+            delay = self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)
+            fail = self._random.random() < self.failure_rate
+            self.calls += 1
+            if fail:
+                self.failures += 1
+        return max(delay, 0.0) / 1000.0, fail
+
+    def wait(self, name):
+        """Sleep for one call's latency, then raise if the call is chosen to fail"""
+        delay, fail = self.draw()
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            raise StandInFailure(f"{name} stand-in failure")
+
+    def to_dict(self):
+        """Return the configuration, for recording alongside results"""
+        return {"latency_ms": self.latency_ms, "jitter_ms": self.jitter_ms,
+                "failure_rate": self.failure_rate}
+
+    def stats(self):
+        """Return call counts"""
+        with self._lock:
+            return {"calls": self.calls, "failures": self.failures}
+
+
+# ---------------------------------------------------------------- Gemini
+
+class _GeminiResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+_NUMBERED_LINE = re.compile(r"^\s*\d+\.\s", re.MULTILINE)
+
+# Characters per streamed response chunk
+STREAM_CHUNK_CHARS = 32
+
+
+class FakeGeminiModel:
+    """Answers scene and emotion prompts with deterministic JSON"""
+
+    EMOTIONS = ("happy", "curious", "excited", "scared", "neutral")
+
+    def __init__(self, profile):
+        self.profile = profile
+
+    def generate_content(self, prompt, stream=False):
+        if stream:
+            return self._stream(self._respond(prompt))
+        self.profile.wait("gemini")
+        return _GeminiResponse(self._respond(prompt))
+
+    def _stream(self, text):
+        """Yield the response in chunks, spreading the call's latency across them"""
+        delay, fail = self.profile.draw()
+        if fail:
+            raise StandInFailure("gemini stand-in failure")
+        chunks = [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)]
+        for chunk in chunks:
+            time.sleep(delay / len(chunks))
+            yield _GeminiResponse(chunk)
+
+    def _respond(self, prompt):
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        if "JSON array of emotion names" in prompt:
+            count = len(_NUMBERED_LINE.findall(prompt))
+            return json.dumps([self._emotion(digest, i) for i in range(count)])
+        if "Return only the emotion name" in prompt:
+            return self._emotion(digest, 0)
+        return "```json\n" + json.dumps(self._scene(digest)) + "\n```"
+
+    def _emotion(self, digest, i):
+        return self.EMOTIONS[int(digest[i % 60:i % 60 + 4], 16) % len(self.EMOTIONS)]
+
+    def _scene(self, digest):
+        tag = digest[:8]
+        return {
+            "scene_id": f"generated_{tag}",
+            "title": f"Generated Scene {tag}",
+            "narrative": (f"The path bends beneath old branches marked {tag}. Somewhere ahead, water "
+                          "runs over stones, and a lantern flickers in the mist. You sense that the "
+                          "forest is waiting to see what you will do next."),
+            "ambience": "Running water, distant owls",
+            "choices": [
+                {"id": f"follow_water_{tag}", "text": f"Follow the sound of water {tag}"},
+                {"id": f"approach_lantern_{tag}", "text": f"Approach the lantern {tag}"},
+                {"id": f"wait_{tag}", "text": f"Wait in the shadows {tag}"}
+            ]
+        }
+
+
+# ---------------------------------------------------------------- TTS
+
+def _fake_mp3(text):
+    """Deterministic bytes roughly proportional to the length of the speech"""
+    return b"ID3" + hashlib.sha256(text.encode("utf-8")).digest() * max(1, len(text) // 8)
+
+
+# Longest text gTTS sends in a single request
+GTTS_REQUEST_CHARS = 100
+
+
+def make_fake_gtts(profile):
+    """Build a gTTS replacement class bound to a latency profile"""
+
+    class FakeGTTS:
+        def __init__(self, text, lang="en", tld="com", slow=False, **kwargs):
+            self.text = text
+
+        def _requests(self):
+            # gTTS sends one request per GTTS_REQUEST_CHARS of text, one after another
+            for _ in range(max(1, -(-len(self.text) // GTTS_REQUEST_CHARS))):
+                profile.wait("gtts")
+
+        def write_to_fp(self, fp):
+            self._requests()
+            fp.write(_fake_mp3(self.text))
+
+        def save(self, path):
+            self._requests()
+            with open(path, 'wb') as f:
+                f.write(_fake_mp3(self.text))
+
+    return FakeGTTS
+
+
+def make_fake_local_tts(profile):
+    """Build a generate_local_audio replacement bound to a latency profile"""
+
+    def generate_local_audio(scene_text, output_path, timeout=None):
+        try:
+            profile.wait("pyttsx3")
+        except StandInFailure as e:
+            print(f"Error generating audio locally: {e}")
+            return None
+        with open(output_path, 'wb') as f:
+            f.write(_fake_mp3(scene_text))
+        return output_path
+
+    return generate_local_audio
+
+
+# ---------------------------------------------------------------- Firestore
+
+class _Snapshot:
+    def __init__(self, data):
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class _DocumentRef:
+    def __init__(self, store, collection, document_id):
+        self._store = store
+        self._collection = collection
+        self.id = document_id
+
+    def set(self, data, merge=False):
+        self._store.profile.wait("firestore")
+        self._store.write(self._collection, self.id, data, merge)
+
+    def get(self):
+        self._store.profile.wait("firestore")
+        return _Snapshot(self._store.read(self._collection, self.id))
+
+
+class _CollectionRef:
+    def __init__(self, store, name):
+        self._store = store
+        self._name = name
+
+    def document(self, document_id=None):
+        return _DocumentRef(self._store, self._name, document_id or uuid.uuid4().hex)
+
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return None, ref
+
+
+class _WriteBatch:
+    def __init__(self, store):
+        self._store = store
+        self._writes = []
+
+    def set(self, ref, data, merge=False):
+        self._writes.append((ref, data, merge))
+
+    def commit(self):
+        self._store.profile.wait("firestore")
+        for ref, data, merge in self._writes:
+            self._store.write(ref._collection, ref.id, data, merge)
+
+
+class FakeFirestore:
+    """In-memory Firestore client supporting the calls the app makes"""
+
+    def __init__(self, profile):
+        self.profile = profile
+        self._documents = {}
+        self._lock = threading.Lock()
+
+    def collection(self, name):
+        return _CollectionRef(self, name)
+
+    def batch(self):
+        return _WriteBatch(self)
+
+    def write(self, collection, document_id, data, merge):
+        with self._lock:
+            key = (collection, document_id)
+            current = self._documents.get(key) if merge else None
+            self._documents[key] = {**(current or {}), **data}
+
+    def read(self, collection, document_id):
+        with self._lock:
+            data = self._documents.get((collection, document_id))
+            return dict(data) if data is not None else None
+
+
+# ---------------------------------------------------------------- Installation
+
+def install_stand_ins(app_module, gemini, gtts, local_tts, firestore):
+    """
+    Replace the app's external services with stand-ins
+
+    Args:
+        app_module (module): The imported main module
+        gemini (LatencyProfile): Profile of the Gemini stand-in
+        gtts (LatencyProfile): Profile of the gTTS stand-in
+        local_tts (LatencyProfile): Profile of the local TTS stand-in
+        firestore (LatencyProfile): Profile of the Firestore stand-in
+    """
+    from story import gemini_client
+    from audio import tts_engine, narration_stream
+    from firebase import firebase_handler
+    from firebase.write_behind import WriteBehindQueue
+
+    gemini_client._model = FakeGeminiModel(gemini)
+
+    tts_engine.gTTS = make_fake_gtts(gtts)
+    tts_engine.GTTS_AVAILABLE = True
+    narration_stream.GTTS_AVAILABLE = True
+    tts_engine.generate_local_audio = make_fake_local_tts(local_tts)
+
+    if not firebase_handler.FIREBASE_AVAILABLE:
+        # The handler needs firebase_admin's sentinels; stay in offline mode
+        print("firebase_admin not installed; benchmarking the offline store instead of Firestore")
+        return
+    handler = app_module.firebase
+    handler.db = FakeFirestore(firestore)
+    handler.connected = True
+    if firebase_handler.WRITE_BEHIND_ENABLED:
+        handler.writer = WriteBehindQueue(handler.db)
@@ -0,0 +1,65 @@
+"""
+Lazy Imports Module - Deferred backend imports with timing
+
+Heavy client libraries (Gemini, Firebase, gTTS, speech recognition,
+requests) are imported on first use instead of when the app module loads,
+so a worker that only serves static stories never pays for them. Every
+import made through lazy_import() is timed, which gives the warm-up hook
+an import-time breakdown.
+"""
+import sys
+import time
+import importlib
+import importlib.util
+import threading
+
+_import_seconds = {}
+_import_lock = threading.RLock()
+
+
+def is_available(module_name):
+    """
+    Check whether a module can be imported, without importing it
+
+    Args:
+        module_name (str): Dotted module name
+
+    Returns:
+        bool: True if the module is installed
+    """
+    if module_name in sys.modules:
+        return True
+    try:
+        return importlib.util.find_spec(module_name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def lazy_import(module_name):
+    """
+    Import a module on first use, recording how long the import took
+
+    Args:
+        module_name (str): Dotted module name
+
+    Returns:
+        module: The imported module
+
+    Raises:
+        ImportError: If the module is not installed
+    """
+    # import_module waits on the module's import lock, so a module another
+    # thread is still initializing is never handed out half-imported
+    first = module_name not in sys.modules
+    started = time.perf_counter()
+    module = importlib.import_module(module_name)
+    if first:
+        with _import_lock:
+            _import_seconds.setdefault(module_name, time.perf_counter() - started)
+    return module
+
+
+def import_times():
+    """Return {module name: seconds} for modules imported through lazy_import()"""
+    with _import_lock:
+        return dict(_import_seconds)
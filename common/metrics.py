@@ -0,0 +1,179 @@
+"""
+Metrics Module - In-process timing histograms and Prometheus exposition
+
+Hot paths wrap their work in span(name, backend) blocks. Each span's
+duration is recorded in a cumulative histogram labelled by span, backend
+and outcome, so the cost of a scene transition can be broken down into
+audio synthesis, Gemini calls, Firestore operations and recognition.
+Gauges such as cache hit ratios and queue depths are read from registered
+collectors when /metrics is scraped, rather than being kept up to date.
+"""
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Prefix of every exported metric name
+METRIC_PREFIX = "audio_quest"
+
+# Histogram bucket upper bounds in seconds (spans range from cache hits to Gemini calls)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Content type of the Prometheus text format
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """Thread-safe cumulative histogram keyed by label values"""
+
+    def __init__(self, name, help_text, labelnames, buckets=DEFAULT_BUCKETS):
+        """
+        Args:
+            name (str): Metric name, without the prefix
+            help_text (str): Description shown in the exposition
+            labelnames (tuple): Names of the labels every observation carries
+            buckets (tuple): Ascending bucket upper bounds
+        """
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        """Record one observation for the given label values"""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self):
+        """Return {label values: (cumulative bucket counts, sum, count)}"""
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        snapshot = {}
+        for labels, series in items:
+            cumulative = []
+            running = 0
+            for count in series[:len(self.buckets)]:
+                running += count
+                cumulative.append(running)
+            snapshot[labels] = (cumulative, series[-2], series[-1])
+        return snapshot
+
+
+# Duration of every instrumented span
+span_seconds = Histogram("span_seconds", "Duration of instrumented operations",
+                         ("span", "backend", "outcome"))
+
+# Duration of every HTTP request, by Flask endpoint and status code
+request_seconds = Histogram("request_seconds", "Duration of HTTP requests",
+                            ("endpoint", "method", "status"))
+
+# Time backend calls spent waiting for a slot, by backend, priority class and outcome
+queue_wait_seconds = Histogram("queue_wait_seconds", "Time backend calls waited for a scheduler slot",
+                               ("backend", "priority", "outcome"))
+
+_histograms = [span_seconds, request_seconds, queue_wait_seconds]
+_collectors = []
+_collectors_lock = threading.Lock()
+
+
+@contextmanager
+def span(name, backend=""):
+    """
+    Time a block and record it in the span histogram
+
+    Args:
+        name (str): Operation name (e.g. "tts.clip", "gemini.generate_scene")
+        backend (str): Backend that served the operation, if any
+    """
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        span_seconds.observe(time.perf_counter() - started, name, backend or "", outcome)
+
+
+def register_collector(collector):
+    """
+    Register a callable read at scrape time
+
+    Args:
+        collector (callable): Returns an iterable of (name, type, help, samples)
+            where type is "gauge" or "counter" and samples is a list of
+            (labels dict, value) pairs
+    """
+    with _collectors_lock:
+        _collectors.append(collector)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value):
+    if value is None:
+        return "NaN"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus():
+    """
+    Render all histograms and collector samples in the Prometheus text format
+
+    Returns:
+        str: The exposition body
+    """
+    lines = []
+    for histogram in _histograms:
+        name = f"{METRIC_PREFIX}_{histogram.name}"
+        lines.append(f"# HELP {name} {histogram.help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for labelvalues, (cumulative, total, count) in sorted(histogram.snapshot().items()):
+            labels = dict(zip(histogram.labelnames, labelvalues))
+            for bound, bucket_count in zip(histogram.buckets, cumulative):
+                lines.append(f"{name}_bucket{_format_labels({**labels, 'le': repr(bound)})} {bucket_count}")
+            lines.append(f"{name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+    with _collectors_lock:
+        collectors = list(_collectors)
+    families = {}
+    for collector in collectors:
+        try:
+            for metric_name, metric_type, help_text, samples in collector():
+                family = families.setdefault(metric_name, (metric_type, help_text, []))
+                family[2].extend(samples)
+        except Exception as e:
+            print(f"Error collecting metrics from {getattr(collector, '__name__', collector)}: {e}")
+
+    for metric_name, (metric_type, help_text, samples) in families.items():
+        name = f"{METRIC_PREFIX}_{metric_name}"
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
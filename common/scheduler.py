@@ -0,0 +1,347 @@
+"""
+Scheduler Module - Admission control and priority queues for backend calls
+
+gTTS, Gemini and Firestore calls used to start as soon as a thread asked
+for them, so a burst of prefetching could delay the requests players are
+waiting on, and an overloaded backend built up an unbounded pile of
+blocked threads. Every call now takes a slot from its backend's
+BackendScheduler. Each backend has a configurable concurrency limit and a
+bounded queue of waiters served in priority order: interactive requests
+ahead of prefetch ahead of pre-render. When a queue is full the call is
+rejected at once with Overloaded, which the app answers with 503 and a
+Retry-After estimate, instead of letting the request hang. Time spent
+queued is recorded in the queue wait histogram.
+
+The priority of a call is taken from the calling context (see
+priority_class), so background pools only need to set it once. A call
+may instead pass a PriorityHandle, whose priority can be raised while the
+call is queued, e.g. when an interactive request starts waiting on a
+prefetch's result.
+"""
+import os
+import math
+import time
+import heapq
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from common.metrics import queue_wait_seconds
+
+# Priority classes, most urgent first
+INTERACTIVE = 0
+PREFETCH = 1
+PRERENDER = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", PREFETCH: "prefetch", PRERENDER: "prerender"}
+
+# Calls allowed to wait for a slot per backend before new ones are rejected
+SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", 64))
+
+# Seconds a call waits for a slot before it is rejected
+SCHEDULER_QUEUE_TIMEOUT = float(os.getenv("SCHEDULER_QUEUE_TIMEOUT", 10))
+
+# Upper bound of the Retry-After estimate, in seconds
+SCHEDULER_MAX_RETRY_AFTER = int(os.getenv("SCHEDULER_MAX_RETRY_AFTER", 30))
+
+# Weight of the latest call in the moving average of slot hold times
+_HOLD_TIME_WEIGHT = 0.2
+
+_priority = contextvars.ContextVar("backend_priority", default=INTERACTIVE)
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+class Overloaded(Exception):
+    """A backend's queue is full, or a call waited too long for a slot"""
+
+    def __init__(self, backend, retry_after, reason="queue full", priority=None):
+        """
+        Args:
+            backend (str): The overloaded backend
+            retry_after (int): Seconds after which a retry is likely to be admitted
+            reason (str): Why the call was rejected
+            priority (int): Priority class the call was rejected at, if known
+        """
+        super().__init__(f"{backend} is overloaded ({reason}); retry after {retry_after}s")
+        self.backend = backend
+        self.retry_after = retry_after
+        self.reason = reason
+        self.priority = priority
+
+
+def current_priority():
+    """Priority class of backend calls made from the current context"""
+    return _priority.get()
+
+
+@contextmanager
+def priority_class(priority):
+    """
+    Make backend calls in a block with the given priority
+
+    Args:
+        priority (int): INTERACTIVE, PREFETCH or PRERENDER
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class PriorityThreadPoolExecutor(ThreadPoolExecutor):
+    """Thread pool whose jobs run with the priority of the code that submitted them"""
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class PriorityHandle:
+    """A call's priority class, which can be raised while it waits for a slot"""
+
+    def __init__(self, priority=None):
+        """
+        Args:
+            priority (int): Initial priority class (defaults to the calling context's)
+        """
+        self.priority = current_priority() if priority is None else priority
+        self._queued = []  # (scheduler, _Waiter) the call is waiting as
+        self._lock = threading.Lock()
+
+    def escalate(self, priority):
+        """Raise the priority to at least the given class, also where the call is queued"""
+        with self._lock:
+            if priority >= self.priority:
+                return
+            self.priority = priority
+            queued = list(self._queued)
+        for scheduler, waiter in queued:
+            scheduler._reprioritize(waiter, priority)
+
+    def _attach(self, scheduler, waiter):
+        """Follow a queued waiter (scheduler lock held); returns the current priority"""
+        with self._lock:
+            self._queued.append((scheduler, waiter))
+            return self.priority
+
+    def _detach(self, scheduler, waiter):
+        with self._lock:
+            self._queued.remove((scheduler, waiter))
+
+
+class _Waiter:
+    """A call queued for a slot; ordered by priority, then arrival"""
+
+    __slots__ = ("priority", "seq", "state")
+
+    def __init__(self, priority, seq):
+        self.priority = priority
+        self.seq = seq
+        self.state = None  # "granted" or "evicted" once decided
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class BackendScheduler:
+    """Concurrency limit and bounded priority queue in front of one backend"""
+
+    def __init__(self, name, limit, max_queue=SCHEDULER_MAX_QUEUE,
+                 queue_timeout=SCHEDULER_QUEUE_TIMEOUT):
+        """
+        Args:
+            name (str): Backend name (used in errors and metrics)
+            limit (int): Calls allowed to run at once
+            max_queue (int): Calls allowed to wait before new ones are rejected
+            queue_timeout (float): Seconds a call may wait for a slot
+        """
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self._waiters = []  # heap of _Waiter
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._active = 0
+        self._hold_seconds = None  # moving average of how long a call holds its slot
+        self.admitted = 0
+        self.rejected = 0
+        self.evicted = 0
+        self.timed_out = 0
+
+    @contextmanager
+    def slot(self, priority=None):
+        """
+        Run a block while holding one of the backend's slots
+
+        Args:
+            priority (int or PriorityHandle): Priority class (defaults to the
+                calling context's)
+
+        Raises:
+            Overloaded: If the queue is full or no slot freed up in time
+        """
+        if priority is None:
+            priority = current_priority()
+        self._acquire(priority)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._release(time.perf_counter() - started)
+
+    def _acquire(self, priority):
+        handle = priority if isinstance(priority, PriorityHandle) else None
+        if handle is not None:
+            priority = handle.priority
+        label = PRIORITY_NAMES.get(priority, str(priority))
+        started = time.perf_counter()
+        with self._cond:
+            if self._active < self.limit and not self._waiters:
+                self._active += 1
+                self.admitted += 1
+                queue_wait_seconds.observe(0.0, self.name, label, "admitted")
+                return
+
+            if len(self._waiters) >= self.max_queue:
+                # Make room by evicting the least urgent waiter, if it is less urgent than us
+                worst = max(self._waiters) if self._waiters else None
+                if worst is None or worst.priority <= priority:
+                    self.rejected += 1
+                    queue_wait_seconds.observe(0.0, self.name, label, "rejected")
+                    raise Overloaded(self.name, self._retry_after_locked(), priority=priority)
+                self._waiters.remove(worst)
+                heapq.heapify(self._waiters)
+                worst.state = "evicted"
+                self.evicted += 1
+                self._cond.notify_all()
+
+            waiter = _Waiter(priority, next(self._seq))
+            if handle is not None:
+                # Catch an escalation that happened since the priority was read
+                waiter.priority = min(priority, handle._attach(self, waiter))
+            heapq.heappush(self._waiters, waiter)
+            deadline = started + self.queue_timeout
+            try:
+                while waiter.state is None:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        self._waiters.remove(waiter)
+                        heapq.heapify(self._waiters)
+                        self.timed_out += 1
+                        queue_wait_seconds.observe(time.perf_counter() - started, self.name, label, "timed_out")
+                        raise Overloaded(self.name, self._retry_after_locked(), "queue timeout",
+                                         priority=waiter.priority)
+                    self._cond.wait(remaining)
+            finally:
+                if handle is not None:
+                    handle._detach(self, waiter)
+
+            waited = time.perf_counter() - started
+            if waiter.state == "evicted":
+                queue_wait_seconds.observe(waited, self.name, label, "evicted")
+                raise Overloaded(self.name, self._retry_after_locked(), "evicted by a more urgent call",
+                                 priority=waiter.priority)
+            self.admitted += 1
+            queue_wait_seconds.observe(waited, self.name, label, "admitted")
+
+    def _reprioritize(self, waiter, priority):
+        """Move a queued waiter up to a more urgent priority class"""
+        with self._cond:
+            if waiter.state is None and priority < waiter.priority:
+                waiter.priority = priority
+                heapq.heapify(self._waiters)
+
+    def _release(self, held):
+        with self._cond:
+            if self._hold_seconds is None:
+                self._hold_seconds = held
+            else:
+                self._hold_seconds += _HOLD_TIME_WEIGHT * (held - self._hold_seconds)
+            if self._waiters:
+                # Hand the slot straight to the most urgent waiter
+                heapq.heappop(self._waiters).state = "granted"
+                self._cond.notify_all()
+            else:
+                self._active -= 1
+
+    def _retry_after_locked(self, backlog=0):
+        """Seconds until the current queue has likely drained, at least 1"""
+        hold = self._hold_seconds or 1.0
+        estimate = math.ceil(hold * (len(self._waiters) + backlog + 1) / self.limit)
+        return min(max(1, estimate), SCHEDULER_MAX_RETRY_AFTER)
+
+    def expected_wait(self, backlog=0):
+        """
+        Estimated seconds before a call queued now would get a slot
+
+        Args:
+            backlog (int): Calls queued for this backend elsewhere that will
+                reach the scheduler first
+
+        Returns:
+            float: The estimate (assuming 1 s per call until one has completed)
+        """
+        with self._cond:
+            hold = self._hold_seconds or 1.0
+            return hold * (len(self._waiters) + backlog) / self.limit
+
+    def retry_after(self, backlog=0):
+        """
+        Current Retry-After estimate in seconds
+
+        Args:
+            backlog (int): Calls queued for this backend elsewhere (e.g. in a
+                thread pool) that have not reached the scheduler yet
+        """
+        with self._cond:
+            return self._retry_after_locked(backlog)
+
+    def stats(self):
+        """Return slot, queue and admission statistics"""
+        with self._cond:
+            queued = {name: 0 for name in PRIORITY_NAMES.values()}
+            for waiter in self._waiters:
+                name = PRIORITY_NAMES.get(waiter.priority, str(waiter.priority))
+                queued[name] = queued.get(name, 0) + 1
+            return {
+                "limit": self.limit,
+                "active": self._active,
+                "queued": queued,
+                "max_queue": self.max_queue,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "evicted": self.evicted,
+                "timed_out": self.timed_out
+            }
+
+
+def backend_scheduler(name, limit=1):
+    """
+    Get the process-wide scheduler of a backend, creating it on first use
+
+    Args:
+        name (str): Backend name, e.g. "gtts", "gemini" or "firestore"
+        limit (int): Concurrency limit used if the scheduler does not exist yet
+
+    Returns:
+        BackendScheduler: The backend's scheduler
+    """
+    scheduler = _schedulers.get(name)
+    if scheduler is not None:
+        return scheduler
+    with _schedulers_lock:
+        scheduler = _schedulers.get(name)
+        if scheduler is None:
+            scheduler = _schedulers[name] = BackendScheduler(name, limit)
+        return scheduler
+
+
+def scheduler_stats():
+    """Return {backend name: stats} for every scheduler created so far"""
+    with _schedulers_lock:
+        schedulers = list(_schedulers.values())
+    return {scheduler.name: scheduler.stats() for scheduler in schedulers}
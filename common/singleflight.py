@@ -0,0 +1,302 @@
+"""
+Single-Flight Module - Coalesces concurrent identical backend jobs
+
+When many players reach the same scene at once, each request used to
+start its own gTTS or Gemini call for the same output. SingleFlight runs
+one job per key at a time: concurrent callers with the same key wait for
+the in-flight job and share its result. Given a lock directory, the job
+also holds an exclusive file lock, so worker processes sharing a cache
+directory coalesce too; jobs re-check their cache after taking the lock.
+Outputs are written to a temporary file and renamed into place, so
+readers never see a half-written file.
+
+Waits are bounded. The leader takes its admission slot (see
+common.scheduler) before the file lock, so it never queues for a slot
+while holding a lock other processes are waiting on. A lock that cannot
+be taken in time is skipped, which only costs duplicate work because
+outputs are written atomically. A follower more urgent than the leader
+raises the leader's priority where it is queued for its slot, so an
+interactive request never waits behind a prefetch's place in the queue;
+a follower whose leader was shed with Overloaded for being less urgent
+retries the job at its own priority.
+"""
+import os
+import time
+import hashlib
+import threading
+from contextlib import contextmanager, nullcontext
+
+from common.scheduler import Overloaded, PriorityHandle, current_priority
+
+try:
+    import fcntl
+except ImportError:  # Windows: in-process coalescing only
+    fcntl = None
+
+# Lock files per flight and directory (keys are hashed onto them, bounding the file count)
+LOCK_STRIPES = int(os.getenv("SINGLEFLIGHT_LOCK_STRIPES", 1024))
+
+# Seconds a caller waits for an identical in-flight job before giving up
+WAIT_TIMEOUT = float(os.getenv("SINGLEFLIGHT_WAIT_TIMEOUT", 60))
+
+# Seconds to wait for another process's file lock before running uncoordinated
+LOCK_TIMEOUT = float(os.getenv("SINGLEFLIGHT_LOCK_TIMEOUT", 30))
+
+# Seconds between attempts to take a contended file lock
+LOCK_POLL_INTERVAL = 0.02
+
+
+def temp_path(path):
+    """A unique temporary path next to path that keeps its extension"""
+    base, extension = os.path.splitext(path)
+    return f"{base}.{os.getpid()}.{threading.get_ident()}.tmp{extension}"
+
+
+@contextmanager
+def atomic_output(path):
+    """
+    Write a file atomically
+
+    Yields a temporary path to write to. If the block succeeds and wrote
+    something, the file is renamed over path; otherwise it is removed.
+
+    Args:
+        path (str): The final path
+
+    Yields:
+        str: The temporary path
+    """
+    tmp_path = temp_path(path)
+    try:
+        yield tmp_path
+        if os.path.exists(tmp_path):
+            os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@contextmanager
+def file_lock(path, timeout=None):
+    """
+    Hold an exclusive advisory lock on a file, across processes
+
+    A no-op where fcntl is unavailable.
+
+    Args:
+        path (str): The lock file (created if missing)
+        timeout (float): Seconds to wait for the lock, or None to wait forever
+
+    Yields:
+        bool: True if the lock is held, False if the wait timed out
+    """
+    if fcntl is None:
+        yield True
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, 'a') as f:
+        if timeout is None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        yield False
+                        return
+                    time.sleep(LOCK_POLL_INTERVAL)
+        try:
+            yield True
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class _Call:
+    """An in-flight job and the result its waiters will share"""
+
+    __slots__ = ("done", "result", "error", "priority")
+
+    def __init__(self, priority):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.priority = PriorityHandle(priority)  # the leader's, raised by urgent followers
+
+
+class SingleFlight:
+    """Runs at most one job per key at a time and shares its result"""
+
+    def __init__(self, name):
+        """
+        Args:
+            name (str): Name of the jobs (used in lock file names and stats)
+        """
+        self.name = name
+        self._calls = {}  # key -> _Call
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.coalesced = 0
+        self.retried = 0
+        self.timed_out = 0
+        self.lock_timeouts = 0
+
+    def lock_path(self, lock_dir, key):
+        """Lock file guarding a key in a directory"""
+        stripe = int(hashlib.sha1(str(key).encode("utf-8")).hexdigest()[:8], 16) % LOCK_STRIPES
+        return os.path.join(lock_dir, f"{self.name}-{stripe:04d}.lock")
+
+    def do(self, key, job, lock_dir=None, admission=None):
+        """
+        Run a job, or wait for the identical job already in flight
+
+        Args:
+            key: Identifies the job's output
+            job (callable): Produces the output; called with no arguments.
+                With lock_dir set it should first check whether another
+                process already produced the output.
+            lock_dir (str): Directory for cross-process lock files, or None
+                to coalesce within this process only
+            admission (callable): Called with the leader's PriorityHandle;
+                returns a context manager the leader holds around the lock
+                and the job, e.g. a backend scheduler slot
+
+        Returns:
+            The job's result (shared with every coalesced caller)
+
+        Raises:
+            TimeoutError: If the in-flight job did not finish within WAIT_TIMEOUT
+            Exception: Whatever the job raised, in every coalesced caller
+        """
+        deadline = time.monotonic() + WAIT_TIMEOUT
+        while True:
+            priority = current_priority()
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call(priority)
+                    self.executions += 1
+                else:
+                    self.coalesced += 1
+
+            if leader:
+                return self._lead(key, call, job, lock_dir, admission)
+            # Wait at our own priority, not behind the leader's place in the queue
+            call.priority.escalate(priority)
+
+            if not call.done.wait(max(0.0, deadline - time.monotonic())):
+                with self._lock:
+                    self.timed_out += 1
+                raise TimeoutError(f"Timed out waiting for an in-flight {self.name} job")
+            if call.error is None:
+                return call.result
+            shed_at = getattr(call.error, "priority", None)
+            if shed_at is None:
+                shed_at = call.priority.priority
+            if isinstance(call.error, Overloaded) and shed_at > priority:
+                # The leader was shed for being less urgent; run the job at our own priority
+                with self._lock:
+                    self.retried += 1
+                continue
+            raise call.error
+
+    def _lead(self, key, call, job, lock_dir, admission):
+        """Run a job as its leader and publish the outcome to its followers"""
+        try:
+            with admission(call.priority) if admission else nullcontext():
+                if lock_dir:
+                    with file_lock(self.lock_path(lock_dir, key), LOCK_TIMEOUT) as locked:
+                        if not locked:
+                            with self._lock:
+                                self.lock_timeouts += 1
+                            print(f"Timed out waiting for the {self.name} lock of {key}; running without it")
+                        call.result = job()
+                else:
+                    call.result = job()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def do_batch(self, keys, job):
+        """
+        Run one batch job for the keys not already in flight, and wait for the rest
+
+        Every key the batch covers is registered before the job starts, so
+        concurrent callers of do() or do_batch() for any of them wait for it.
+
+        Args:
+            keys (list): Keys of the outputs wanted
+            job (callable): Called with the list of keys this caller leads;
+                returns a dict of key -> output
+
+        Returns:
+            dict: key -> output for every key (None if the job left one out)
+
+        Raises:
+            TimeoutError: If an in-flight job did not finish within WAIT_TIMEOUT
+            Exception: Whatever the batch job or a joined job raised
+        """
+        deadline = time.monotonic() + WAIT_TIMEOUT
+        priority = current_priority()
+        led, joined = {}, {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                call = self._calls.get(key)
+                if call is None:
+                    led[key] = self._calls[key] = _Call(priority)
+                    self.executions += 1
+                else:
+                    joined[key] = call
+                    self.coalesced += 1
+
+        results = {}
+        if led:
+            try:
+                outputs = job(list(led))
+                for key, call in led.items():
+                    call.result = results[key] = outputs.get(key)
+            except BaseException as e:
+                for call in led.values():
+                    call.error = e
+                raise
+            finally:
+                with self._lock:
+                    for key in led:
+                        del self._calls[key]
+                for call in led.values():
+                    call.done.set()
+
+        for key, call in joined.items():
+            if not call.done.wait(max(0.0, deadline - time.monotonic())):
+                with self._lock:
+                    self.timed_out += 1
+                raise TimeoutError(f"Timed out waiting for an in-flight {self.name} job")
+            if call.error is not None:
+                raise call.error
+            results[key] = call.result
+        return results
+
+    def in_flight(self):
+        """Number of keys with a job running"""
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self):
+        """Return coalescing statistics"""
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "retried": self.retried,
+                "timed_out": self.timed_out,
+                "lock_timeouts": self.lock_timeouts
+            }
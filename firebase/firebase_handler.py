@@ -2,50 +2,109 @@
 Firebase Handler Module - Handles user state, bookmarks, and metrics
 """
 import os
-import json
 import datetime
+import threading
+from functools import wraps
 from dotenv import load_dotenv
+from firebase.write_behind import WriteBehindQueue
+from firebase.offline_store import OfflineStore
+from firebase.state_cache import UserStateCache, _merge
+from common.metrics import span
+from common.lazy_imports import is_available, lazy_import
+from common.scheduler import Overloaded, backend_scheduler
 
-# Conditionally import firebase_admin
-try:
-    import firebase_admin
-    from firebase_admin import credentials, firestore
-    FIREBASE_AVAILABLE = True
-except ImportError:
-    FIREBASE_AVAILABLE = False
+# firebase_admin is imported when the handler first connects
+FIREBASE_AVAILABLE = is_available("firebase_admin")
 
 # Load environment variables
 load_dotenv()
 
+# Queue Firestore writes and commit them in batches off the request thread
+WRITE_BEHIND_ENABLED = os.getenv("FIREBASE_WRITE_BEHIND", "true").lower() == "true"
+
+# Maximum concurrent Firestore calls from request threads (further calls queue by priority)
+FIRESTORE_CONCURRENCY = int(os.getenv("FIRESTORE_CONCURRENCY", 16))
+
+def _firestore_slot():
+    """Take a slot from the Firestore scheduler, with the caller's priority"""
+    return backend_scheduler("firestore", FIRESTORE_CONCURRENCY).slot()
+
+def _traced(method):
+    """Record a handler method's duration, labelled with the backend in use"""
+    name = f"firebase.{method.__name__}"
+    
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with span(name, "firestore" if self.connected else "offline"):
+            return method(self, *args, **kwargs)
+    return wrapper
+
 class FirebaseHandler:
     def __init__(self):
-        """Initialize the Firebase handler with optional connection to Firebase"""
+        """Initialize the Firebase handler; the connection is opened on first use"""
         self.db = None
-        self.connected = False
+        self.writer = None
+        self._connected = None
+        self._firestore = None
+        self._connect_lock = threading.Lock()
+        self._offline_store = None
+        self.state_cache = UserStateCache()
         
         if not FIREBASE_AVAILABLE:
             print("Firebase packages not installed. Running in offline mode.")
-            return
-            
-        # Try to initialize Firebase connection
+            self._connected = False
+    
+    @property
+    def connected(self):
+        """Whether Firestore is in use, connecting on first access"""
+        if self._connected is None:
+            with self._connect_lock:
+                if self._connected is None:
+                    self._connected = self._connect()
+        return self._connected
+    
+    @connected.setter
+    def connected(self, value):
+        self._connected = value
+    
+    def _connect(self):
+        """
+        Import firebase_admin and connect to Firestore
+        
+        Returns:
+            bool: True if connected
+        """
         try:
             firebase_key_path = os.getenv("FIREBASE_KEY_PATH")
             
             if firebase_key_path and os.path.exists(firebase_key_path):
+                firebase_admin = lazy_import("firebase_admin")
+                credentials = lazy_import("firebase_admin.credentials")
+                self._firestore = lazy_import("firebase_admin.firestore")
+                
                 # Initialize Firebase with credentials
                 cred = credentials.Certificate(firebase_key_path)
                 firebase_admin.initialize_app(cred)
                 
                 # Initialize Firestore
-                self.db = firestore.client()
-                self.connected = True
+                self.db = self._firestore.client()
+                if WRITE_BEHIND_ENABLED:
+                    self.writer = WriteBehindQueue(self.db)
                 print("Connected to Firebase successfully")
-            else:
-                print("Firebase key not found. Running in offline mode.")
+                return True
+            print("Firebase key not found. Running in offline mode.")
                 
         except Exception as e:
             print(f"Error connecting to Firebase: {e}")
+        return False
     
+    def _server_timestamp(self):
+        """Firestore's server timestamp sentinel"""
+        if self._firestore is None:
+            self._firestore = lazy_import("firebase_admin.firestore")
+        return self._firestore.SERVER_TIMESTAMP
+    
+    @_traced
     def save_user_progress(self, user_id, scene_id):
         """
         Save the user's current scene
@@ -58,23 +117,41 @@ class FirebaseHandler:
             bool: Success status
         """
         if not self.connected:
-            # In offline mode, save to a local file
-            return self._save_offline_data("user_progress", user_id, {
+            # In offline mode, save to the local store
+            progress = {
                 "current_scene": scene_id,
                 "updated_at": datetime.datetime.now().isoformat()
-            })
+            }
+            saved = self._save_offline_data("user_progress", user_id, progress)
+            if saved:
+                # The offline progress document holds exactly these fields
+                self.state_cache.update(user_id, progress, create=True)
+            return saved
             
         try:
-            user_ref = self.db.collection('users').document(user_id)
-            user_ref.set({
+            progress = {
                 'current_scene': scene_id,
-                'updated_at': firestore.SERVER_TIMESTAMP
-            }, merge=True)
+                'updated_at': self._server_timestamp()
+            }
+            self.state_cache.update(user_id, {
+                'current_scene': scene_id,
+                'updated_at': datetime.datetime.now(datetime.timezone.utc)
+            })
+            if self.writer:
+                self.writer.set_merge('users', user_id, progress)
+                return True
+            
+            with _firestore_slot():
+                user_ref = self.db.collection('users').document(user_id)
+                user_ref.set(progress, merge=True)
             return True
+        except Overloaded:
+            raise
         except Exception as e:
             print(f"Error saving user progress: {e}")
             return False
     
+    @_traced
     def get_user_state(self, user_id):
         """
         Get the user's current state
@@ -85,22 +162,44 @@ class FirebaseHandler:
         Returns:
             dict: User state data
         """
+        cached_state = self.state_cache.get(user_id)
+        if cached_state is not None:
+            return cached_state
+        
         if not self.connected:
-            # In offline mode, get from a local file
-            return self._get_offline_data("user_progress", user_id)
+            # In offline mode, get from the local store
+            state = self._get_offline_data("user_progress", user_id)
+            if "error" not in state and not state.get("first_time"):
+                self.state_cache.put(user_id, state)
+            return state
             
         try:
-            user_ref = self.db.collection('users').document(user_id)
-            user_doc = user_ref.get()
+            with _firestore_slot():
+                user_ref = self.db.collection('users').document(user_id)
+                user_doc = user_ref.get()
+            
+            # Read-your-writes: lay updates still queued for this user over the stored document
+            pending = self.writer.pending('users', user_id) if self.writer else None
+            if pending is not None:
+                sentinel = type(self._server_timestamp())
+                pending = {key: value for key, value in pending.items() if not isinstance(value, sentinel)}
             
-            if user_doc.exists:
-                return user_doc.to_dict()
+            if user_doc.exists or pending:
+                state = user_doc.to_dict() if user_doc.exists else {}
+                if pending:
+                    _merge(state, pending)
+                self.state_cache.put(user_id, state)
+                return state
             else:
                 return {"current_scene": "start", "first_time": True}
+        except Overloaded:
+            # Not a reason to send the player back to the start
+            raise
         except Exception as e:
             print(f"Error getting user state: {e}")
             return {"current_scene": "start", "error": str(e)}
     
+    @_traced
     def save_choice(self, user_id, scene_id, choice):
         """
         Save the user's choice for a scene
@@ -130,28 +229,48 @@ class FirebaseHandler:
                 'scene_id': scene_id,
                 'choice_id': choice.get("id"),
                 'choice_text': choice.get("text"),
-                'timestamp': firestore.SERVER_TIMESTAMP
+                'timestamp': self._server_timestamp()
             }
             
-            self.db.collection('choices').add(choice_data)
-            
             # Also update user document with latest choice
-            user_ref = self.db.collection('users').document(user_id)
-            user_ref.set({
+            latest_choice = {
                 'choices': {
                     scene_id: {
                         'choice_id': choice.get("id"),
                         'choice_text': choice.get("text"),
-                        'timestamp': firestore.SERVER_TIMESTAMP
+                        'timestamp': self._server_timestamp()
                     }
                 }
-            }, merge=True)
+            }
+            
+            self.state_cache.update(user_id, {
+                'choices': {
+                    scene_id: {
+                        'choice_id': choice.get("id"),
+                        'choice_text': choice.get("text"),
+                        'timestamp': datetime.datetime.now(datetime.timezone.utc)
+                    }
+                }
+            })
+            
+            if self.writer:
+                self.writer.add('choices', choice_data)
+                self.writer.set_merge('users', user_id, latest_choice)
+                return True
+            
+            with _firestore_slot():
+                self.db.collection('choices').add(choice_data)
+                user_ref = self.db.collection('users').document(user_id)
+                user_ref.set(latest_choice, merge=True)
             
             return True
+        except Overloaded:
+            raise
         except Exception as e:
             print(f"Error saving choice: {e}")
             return False
     
+    @_traced
     def log_metrics(self, user_id, data):
         """
         Log usage metrics
@@ -173,61 +292,79 @@ class FirebaseHandler:
             # Add timestamp
             metrics_data = data.copy()
             metrics_data['user_id'] = user_id
-            metrics_data['timestamp'] = firestore.SERVER_TIMESTAMP
+            metrics_data['timestamp'] = self._server_timestamp()
             
             # Save to metrics collection
-            self.db.collection('metrics').add(metrics_data)
+            if self.writer:
+                self.writer.add('metrics', metrics_data)
+                return True
+            
+            with _firestore_slot():
+                self.db.collection('metrics').add(metrics_data)
             return True
+        except Overloaded:
+            raise
         except Exception as e:
             print(f"Error logging metrics: {e}")
             return False
     
-    def _save_offline_data(self, data_type, user_id, data, append=False):
-        """Save data to a local file when offline"""
-        # Create directory structure
-        os.makedirs("offline_data", exist_ok=True)
-        os.makedirs(f"offline_data/{data_type}", exist_ok=True)
+    @_traced
+    def flush(self):
+        """Commit any queued Firestore writes now"""
+        if self.writer:
+            self.writer.flush()
+    
+    def close(self):
+        """Flush queued writes and stop the background writer"""
+        if self.writer:
+            self.writer.close()
+    
+    def write_stats(self):
+        """
+        Get write-behind queue statistics
         
-        file_path = f"offline_data/{data_type}/{user_id}.json"
+        Returns:
+            dict: Queue depth and flush latency, or None when writes are synchronous
+        """
+        return self.writer.stats() if self.writer else None
+    
+    @property
+    def offline_store(self):
+        """The embedded store used in offline mode, opened on first use"""
+        if self._offline_store is None:
+            self._offline_store = OfflineStore()
+        return self._offline_store
+    
+    def cache_stats(self):
+        """
+        Get user state cache statistics
         
-        if append and os.path.exists(file_path):
-            try:
-                with open(file_path, 'r') as f:
-                    existing_data = json.load(f)
-                
-                if isinstance(existing_data, list):
-                    existing_data.append(data)
-                    with open(file_path, 'w') as f:
-                        json.dump(existing_data, f, indent=2)
-                else:
-                    with open(file_path, 'w') as f:
-                        json.dump([existing_data, data], f, indent=2)
-            except Exception as e:
-                print(f"Error appending to offline data: {e}")
-                return False
-        else:
-            try:
-                with open(file_path, 'w') as f:
-                    if append:
-                        json.dump([data], f, indent=2)
-                    else:
-                        json.dump(data, f, indent=2)
-            except Exception as e:
-                print(f"Error saving offline data: {e}")
-                return False
+        Returns:
+            dict: Hit ratio, size and invalidation counts
+        """
+        return self.state_cache.stats()
+    
+    def _save_offline_data(self, data_type, user_id, data, append=False):
+        """Save data to the local store when offline"""
+        try:
+            if append:
+                self.offline_store.append_event(data_type, user_id, data)
+            else:
+                self.offline_store.put_document(data_type, user_id, data)
+        except Exception as e:
+            print(f"Error saving offline data: {e}")
+            return False
                 
         return True
     
     def _get_offline_data(self, data_type, user_id):
-        """Get data from a local file when offline"""
-        file_path = f"offline_data/{data_type}/{user_id}.json"
+        """Get data from the local store when offline"""
+        try:
+            data = self.offline_store.get_document(data_type, user_id)
+        except Exception as e:
+            print(f"Error reading offline data: {e}")
+            return {"current_scene": "start", "error": str(e)}
         
-        if os.path.exists(file_path):
-            try:
-                with open(file_path, 'r') as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"Error reading offline data: {e}")
-                return {"current_scene": "start", "error": str(e)}
-        else:
+        if data is None:
             return {"current_scene": "start", "first_time": True}
+        return data
@@ -0,0 +1,235 @@
+"""
+Offline Store Module - Embedded SQLite store for offline mode
+
+Replaces the per-user JSON files under offline_data/. User documents
+(progress, latest choices) are upserted and merged in place, and event
+logs (metrics) are appended as rows with an index on user, so every write
+is constant time regardless of history length. The database runs in WAL
+mode with a busy timeout, which makes it safe to share between worker
+processes.
+
+Usage:
+    python -m firebase.offline_store compact [--before-days N]
+    python -m firebase.offline_store import-json [offline_data]
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+
+# Location of the offline database
+DEFAULT_DB_PATH = os.getenv("OFFLINE_DB_PATH", "offline_data/offline.db")
+
+# Milliseconds a writer waits for another process holding the lock
+BUSY_TIMEOUT_MS = 5000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    kind TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (kind, user_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    data TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS events_by_user ON events (kind, user_id, id);
+"""
+
+
+class OfflineStore:
+    """SQLite (WAL) backed documents and append-only event logs"""
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        """
+        Args:
+            db_path (str): Path to the SQLite database file
+        """
+        self.db_path = db_path
+        self._local = threading.local()
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self):
+        """Get this thread's connection, reopening it after a fork"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def put_document(self, kind, user_id, data, merge=True):
+        """
+        Write a user document
+
+        Args:
+            kind (str): Document type (e.g. "user_progress")
+            user_id (str): The user's ID
+            data (dict): Document fields
+            merge (bool): Merge into the existing document instead of replacing it
+        """
+        payload = json.dumps(data)
+        if merge:
+            sql = ("INSERT INTO documents (kind, user_id, data, updated_at) VALUES (?, ?, ?, ?) "
+                   "ON CONFLICT (kind, user_id) DO UPDATE SET "
+                   "data = json_patch(documents.data, excluded.data), updated_at = excluded.updated_at")
+        else:
+            sql = "INSERT OR REPLACE INTO documents (kind, user_id, data, updated_at) VALUES (?, ?, ?, ?)"
+        self._connection().execute(sql, (kind, user_id, payload, time.time()))
+
+    def get_document(self, kind, user_id):
+        """
+        Read a user document
+
+        Returns:
+            dict: The document, or None if it does not exist
+        """
+        row = self._connection().execute(
+            "SELECT data FROM documents WHERE kind = ? AND user_id = ?", (kind, user_id)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def append_event(self, kind, user_id, data):
+        """
+        Append an event to a user's log
+
+        Args:
+            kind (str): Event log type (e.g. "metrics")
+            user_id (str): The user's ID
+            data (dict): Event fields
+        """
+        self._connection().execute(
+            "INSERT INTO events (kind, user_id, created_at, data) VALUES (?, ?, ?, ?)",
+            (kind, user_id, time.time(), json.dumps(data))
+        )
+
+    def get_events(self, kind, user_id, limit=None):
+        """
+        Read a user's events, most recent last
+
+        Args:
+            kind (str): Event log type
+            user_id (str): The user's ID
+            limit (int): Only return the most recent N events
+
+        Returns:
+            list: Event dictionaries
+        """
+        if limit is None:
+            rows = self._connection().execute(
+                "SELECT data FROM events WHERE kind = ? AND user_id = ? ORDER BY id", (kind, user_id)
+            ).fetchall()
+        else:
+            rows = self._connection().execute(
+                "SELECT data FROM (SELECT id, data FROM events WHERE kind = ? AND user_id = ? "
+                "ORDER BY id DESC LIMIT ?) ORDER BY id", (kind, user_id, limit)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def count_events(self, kind, user_id=None):
+        """Count events of a kind, optionally for a single user"""
+        if user_id is None:
+            row = self._connection().execute("SELECT COUNT(*) FROM events WHERE kind = ?", (kind,)).fetchone()
+        else:
+            row = self._connection().execute(
+                "SELECT COUNT(*) FROM events WHERE kind = ? AND user_id = ?", (kind, user_id)
+            ).fetchone()
+        return row[0]
+
+    def compact(self, before=None):
+        """
+        Drop old events and reclaim space
+
+        Args:
+            before (float): Delete events created before this Unix time (keep all if None)
+
+        Returns:
+            int: Number of events deleted
+        """
+        conn = self._connection()
+        deleted = 0
+        if before is not None:
+            deleted = conn.execute("DELETE FROM events WHERE created_at < ?", (before,)).rowcount
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("VACUUM")
+        return deleted
+
+    def import_json_dir(self, root="offline_data"):
+        """
+        Import data written by the old per-user JSON file backend
+
+        Args:
+            root (str): Directory containing <data_type>/<user_id>.json files
+
+        Returns:
+            int: Number of files imported
+        """
+        imported = 0
+        for data_type in ("user_progress", "user_choices", "metrics"):
+            directory = os.path.join(root, data_type)
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if not name.endswith(".json"):
+                    continue
+                user_id = name[:-5]
+                try:
+                    with open(os.path.join(directory, name), 'r') as f:
+                        data = json.load(f)
+                except (OSError, ValueError) as e:
+                    print(f"Skipping {data_type}/{name}: {e}")
+                    continue
+
+                if data_type == "metrics":
+                    for event in data if isinstance(data, list) else [data]:
+                        self.append_event(data_type, user_id, event)
+                else:
+                    self.put_document(data_type, user_id, data)
+                imported += 1
+        return imported
+
+
+def main(argv=None):
+    """Command-line entry point for store maintenance"""
+    parser = argparse.ArgumentParser(description="Maintain the offline mode database")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="Path to the SQLite database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    compact_parser = subparsers.add_parser("compact", help="Delete old events and reclaim space")
+    compact_parser.add_argument("--before-days", type=float,
+                                help="Delete events older than this many days")
+
+    import_parser = subparsers.add_parser("import-json", help="Import legacy offline JSON files")
+    import_parser.add_argument("root", nargs="?", default="offline_data")
+
+    args = parser.parse_args(argv)
+    store = OfflineStore(args.db)
+
+    if args.command == "compact":
+        before = time.time() - args.before_days * 86400 if args.before_days is not None else None
+        deleted = store.compact(before)
+        print(f"Compacted {args.db}: deleted {deleted} events")
+    elif args.command == "import-json":
+        imported = store.import_json_dir(args.root)
+        print(f"Imported {imported} files from {args.root} into {args.db}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+"""
+State Cache Module - In-process read-through cache of user state
+
+Keeps recently read or written user documents in a TTL-bounded LRU so
+get_user_state on the hot path does not cost a Firestore read or a
+database query. Writes made through the handler update the cache
+directly. When STATE_CACHE_INVALIDATION_DIR is set, every write also
+touches a per-user marker file; other processes compare its mtime
+against their cached copy, so their stale entries are dropped after a
+single stat call.
+"""
+import os
+import copy
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Seconds a cached user state stays valid
+DEFAULT_TTL = float(os.getenv("STATE_CACHE_TTL", 300))
+
+# Maximum users kept in memory
+DEFAULT_MAX_ENTRIES = int(os.getenv("STATE_CACHE_MAX_ENTRIES", 10000))
+
+# Directory of cross-process invalidation markers (disabled when unset)
+DEFAULT_INVALIDATION_DIR = os.getenv("STATE_CACHE_INVALIDATION_DIR")
+
+
+class UserStateCache:
+    """TTL + LRU cache of user state documents"""
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES,
+                 invalidation_dir=DEFAULT_INVALIDATION_DIR):
+        """
+        Args:
+            ttl (float): Seconds an entry stays valid
+            max_entries (int): Maximum users kept in memory
+            invalidation_dir (str): Shared directory for invalidation markers, or None
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.invalidation_dir = invalidation_dir
+        self._entries = OrderedDict()  # user_id -> (expires_at, cached_at_ns, state)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        if invalidation_dir:
+            os.makedirs(invalidation_dir, exist_ok=True)
+
+    def get(self, user_id):
+        """
+        Look up a user's state
+
+        Returns:
+            dict: A copy of the cached state, or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, cached_at_ns, state = entry
+            if expires_at <= now or self._changed_elsewhere(user_id, cached_at_ns):
+                del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return copy.deepcopy(state)
+
+    def put(self, user_id, state):
+        """Cache a user's full state (e.g. after a read from the backend)"""
+        with self._lock:
+            self._store(user_id, copy.deepcopy(state))
+
+    def update(self, user_id, fields, create=False):
+        """
+        Apply a write to the cached state
+
+        Args:
+            user_id (str): The user's ID
+            fields (dict): Fields written (nested dicts are merged)
+            create (bool): Create the entry if the user is not cached; only
+                safe when fields make up the whole document
+        """
+        # Mark first so our own entry is newer than the marker
+        self._touch_marker(user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                state = entry[2]
+            elif create:
+                state = {}
+            else:
+                state = None
+
+            if state is not None:
+                _merge(state, copy.deepcopy(fields))
+                self._store(user_id, state)
+
+    def invalidate(self, user_id):
+        """Drop a user's cached state here and, if enabled, in other processes"""
+        with self._lock:
+            if self._entries.pop(user_id, None) is not None:
+                self.invalidations += 1
+        self._touch_marker(user_id)
+
+    def stats(self):
+        """Return cache statistics"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+                "invalidations": self.invalidations
+            }
+
+    def _store(self, user_id, state):
+        """Insert an entry and evict the least recently used (lock held)"""
+        self._entries[user_id] = (time.time() + self.ttl, time.time_ns(), state)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _marker_path(self, user_id):
+        digest = hashlib.sha1(user_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.invalidation_dir, digest)
+
+    def _touch_marker(self, user_id):
+        """Record a write so other processes drop their cached copy"""
+        if not self.invalidation_dir:
+            return
+        path = self._marker_path(user_id)
+        try:
+            with open(path, 'a'):
+                pass
+            os.utime(path, ns=(time.time_ns(), time.time_ns()))
+        except OSError as e:
+            print(f"Error touching state cache marker: {e}")
+
+    def _changed_elsewhere(self, user_id, cached_at_ns):
+        """Check whether any process wrote this user after we cached it"""
+        if not self.invalidation_dir:
+            return False
+        try:
+            if os.stat(self._marker_path(user_id)).st_mtime_ns > cached_at_ns:
+                self.invalidations += 1
+                return True
+        except OSError:
+            pass
+        return False
+
+
+def _merge(target, updates):
+    """Merge nested dictionaries in place"""
+    for key, value in updates.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = value
@@ -0,0 +1,231 @@
+"""
+Write-Behind Module - Batches Firestore writes off the request thread
+
+Merge-writes to the same document are combined in memory and new
+documents are collected, then everything is committed as Firestore
+batches when the queue reaches a size threshold or a flush interval
+elapses. Request handlers only pay for a dictionary update.
+
+Writes of a batch that fails to commit are put back in the queue, under
+any newer writes to the same document, and retried with exponential
+backoff; they are dropped only after FIREBASE_MAX_RETRIES failures.
+"""
+import os
+import copy
+import time
+import atexit
+import threading
+from common.metrics import span
+from firebase.state_cache import _merge
+
+# Operations that trigger an immediate flush
+DEFAULT_BATCH_SIZE = int(os.getenv("FIREBASE_BATCH_SIZE", 200))
+
+# Maximum seconds a write waits in the queue
+DEFAULT_FLUSH_INTERVAL = float(os.getenv("FIREBASE_FLUSH_INTERVAL", 1.0))
+
+# Failed commits a write survives before it is dropped
+DEFAULT_MAX_RETRIES = int(os.getenv("FIREBASE_MAX_RETRIES", 5))
+
+# Seconds before the first retry of a failed batch (doubles per failure)
+DEFAULT_RETRY_BACKOFF = float(os.getenv("FIREBASE_RETRY_BACKOFF", 0.5))
+
+# Upper bound of the retry backoff, in seconds
+MAX_RETRY_BACKOFF = 30.0
+
+# Firestore rejects batches with more writes than this
+FIRESTORE_MAX_BATCH = 500
+
+
+class WriteBehindQueue:
+    """Coalescing, batched writer for a Firestore client"""
+
+    def __init__(self, db, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 max_retries=DEFAULT_MAX_RETRIES, retry_backoff=DEFAULT_RETRY_BACKOFF):
+        """
+        Args:
+            db: Firestore client
+            batch_size (int): Queued operations that trigger a flush
+            flush_interval (float): Maximum seconds between flushes
+            max_retries (int): Failed commits a write survives before it is dropped
+            retry_backoff (float): Seconds before the first retry of a failed batch
+        """
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._merges = {}  # (collection, document_id) -> merged data
+        self._adds = []  # (collection, data)
+        self._attempts = {}  # (collection, document_id) -> failed commits of its queued merge
+        self._add_attempts = []  # failed commits of each queued add, parallel to _adds
+        self._failures = 0  # consecutive failed flushes
+        self._retry_at = 0.0  # no background flush before this time
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._closed = False
+
+        # Statistics
+        self.enqueued = 0
+        self.written = 0
+        self.retried = 0
+        self.failed = 0
+        self.flushes = 0
+        self.last_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="firestore-write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def set_merge(self, collection, document_id, data):
+        """Queue a set(..., merge=True), combining it with pending writes to the document"""
+        with self._lock:
+            pending = self._merges.setdefault((collection, document_id), {})
+            _merge(pending, data)
+            self._enqueued()
+
+    def add(self, collection, data):
+        """Queue the creation of a new document with an auto-generated id"""
+        with self._lock:
+            self._adds.append((collection, data))
+            self._add_attempts.append(0)
+            self._enqueued()
+
+    def has_pending(self, collection, document_id):
+        """Check whether a document has writes that are not yet committed"""
+        with self._lock:
+            return (collection, document_id) in self._merges
+
+    def pending(self, collection, document_id):
+        """
+        Get the merge-writes queued for a document
+
+        Returns:
+            dict: A copy of the combined pending fields, or None if nothing is queued
+        """
+        with self._lock:
+            data = self._merges.get((collection, document_id))
+            return copy.deepcopy(data) if data is not None else None
+
+    def depth(self):
+        """Number of queued document writes"""
+        with self._lock:
+            return len(self._merges) + len(self._adds)
+
+    def flush(self):
+        """Commit everything queued so far on the calling thread"""
+        with self._flush_lock:
+            with self._lock:
+                merges, self._merges = self._merges, {}
+                adds, self._adds = self._adds, []
+                attempts, self._attempts = self._attempts, {}
+                add_attempts, self._add_attempts = self._add_attempts, []
+            if not merges and not adds:
+                return
+
+            start = time.perf_counter()
+            operations = [("merge", key, data, attempts.get(key, 0)) for key, data in merges.items()]
+            operations += [("add", collection, data, tries)
+                           for (collection, data), tries in zip(adds, add_attempts)]
+
+            failed = []
+            for i in range(0, len(operations), FIRESTORE_MAX_BATCH):
+                chunk = operations[i:i + FIRESTORE_MAX_BATCH]
+                try:
+                    batch = self.db.batch()
+                    for kind, target, data, _ in chunk:
+                        if kind == "merge":
+                            collection, document_id = target
+                            batch.set(self.db.collection(collection).document(document_id), data, merge=True)
+                        else:
+                            batch.set(self.db.collection(target).document(), data)
+                    with span("firestore.batch_commit", "firestore"):
+                        batch.commit()
+                    self.written += len(chunk)
+                except Exception as e:
+                    print(f"Error committing Firestore batch of {len(chunk)} writes: {e}")
+                    failed.extend(chunk)
+
+            self._requeue(failed)
+            elapsed = time.perf_counter() - start
+            self.flushes += 1
+            self.last_flush_seconds = elapsed
+            self.total_flush_seconds += elapsed
+
+    def _requeue(self, operations):
+        """Put failed writes back under any newer ones and schedule a retry"""
+        with self._lock:
+            if not operations:
+                self._failures = 0
+                self._retry_at = 0.0
+                return
+
+            adds = []
+            for kind, target, data, tries in operations:
+                tries += 1
+                if tries > self.max_retries:
+                    self.failed += 1
+                    continue
+                self.retried += 1
+                if kind == "merge":
+                    # Writes queued since the flush began are newer and win
+                    newer = self._merges.get(target)
+                    if newer is not None:
+                        _merge(data, newer)
+                    self._merges[target] = data
+                    self._attempts[target] = tries
+                else:
+                    adds.append((target, data, tries))
+            if adds:
+                self._adds[:0] = [(collection, data) for collection, data, _ in adds]
+                self._add_attempts[:0] = [tries for _, _, tries in adds]
+
+            self._failures += 1
+            backoff = min(self.retry_backoff * 2 ** (self._failures - 1), MAX_RETRY_BACKOFF)
+            self._retry_at = time.monotonic() + backoff
+
+    def close(self):
+        """Stop the background thread and flush remaining writes"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wakeup.notify()
+        self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+    def stats(self):
+        """Return queue depth, throughput and flush latency statistics"""
+        with self._lock:
+            depth = len(self._merges) + len(self._adds)
+        return {
+            "queue_depth": depth,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "retried": self.retried,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "last_flush_seconds": self.last_flush_seconds,
+            "avg_flush_seconds": (self.total_flush_seconds / self.flushes) if self.flushes else 0.0
+        }
+
+    def _enqueued(self):
+        """Count a queued operation and wake the writer if a batch is full (lock held)"""
+        self.enqueued += 1
+        if len(self._merges) + len(self._adds) >= self.batch_size:
+            self._wakeup.notify()
+
+    def _run(self):
+        """Background loop flushing on size or time triggers"""
+        while True:
+            with self._lock:
+                if not self._closed and len(self._merges) + len(self._adds) < self.batch_size:
+                    self._wakeup.wait(self.flush_interval)
+                # Back off after a failed commit, even if a batch filled up meanwhile
+                while not self._closed and time.monotonic() < self._retry_at:
+                    self._wakeup.wait(self._retry_at - time.monotonic())
+                if self._closed:
+                    return
+            self.flush()
@@ -2,25 +2,59 @@
 Interactive Audio Quest - Main Application
 Flask API to serve scenes and handle routes
 """
+import io
 import os
 import json
 import uuid
-import tempfile
+import time
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, send_from_directory, render_template
+from urllib.parse import urlencode
+from flask import (Flask, Request, Response, request, jsonify, send_from_directory, render_template,
+                   stream_with_context, g)
 
 # Import our custom modules
-from story.story_engine import generate_scene, get_start_scene
-from story.emotion_detector import detect_emotion
-from audio.tts_engine import generate_scene_audio, text_to_speech_demo
-from audio.stt_engine import get_text_from_audio, process_voice_command
+from story.story_engine import get_start_scene, generation_flight
+from story.emotion_detector import detect_emotion, emotion_cache_stats, emotion_flight
+from story.generation_cache import scene_cache
+from story.story_catalog import StoryCatalog, SAMPLE_STORY_ID
+from story.scene_payloads import ScenePayloadCache, encode_json, render_scene_response
+from story.speculative import SceneSpeculator
+from audio.tts_engine import generate_scene_audio, text_to_speech_demo, tts_queue_depth, tts_flight
+from audio.audio_cache import get_audio_cache
+from audio.local_tts_pool import local_tts_pending
+from audio.narration_stream import stream_narration, ScenePipeline
+from audio.audio_delivery import serve_audio_file
+from audio.audio_pack import build_scene_pack, pack_flight
+from audio.prerender import load_prerender_manifest
+from audio.prefetch import ScenePrefetcher
+from audio.stt_engine import process_voice_command, stt_queue_depth
 from firebase.firebase_handler import FirebaseHandler
+from story.gemini_client import get_gemini_model
+from common.metrics import request_seconds, register_collector, render_prometheus, PROMETHEUS_CONTENT_TYPE
+from common.lazy_imports import is_available, lazy_import, import_times
+from common.scheduler import Overloaded, scheduler_stats
 
 # Load environment variables
 load_dotenv()
 
+# Warm up before serving when the module is imported by a WSGI server (e.g. gunicorn workers)
+WARMUP_ON_IMPORT = os.getenv("WARMUP_ON_IMPORT", "false").lower() == "true"
+
+# Backend modules imported during warm-up, when installed
+WARMUP_MODULES = ("google.generativeai", "firebase_admin", "gtts", "speech_recognition", "requests")
+
+# Largest accepted request body (voice uploads), in bytes
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 10 * 1024 * 1024))
+
+class InMemoryUploadRequest(Request):
+    """Request that keeps uploaded files in memory instead of spooling to disk"""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
+
 # Initialize Flask application
 app = Flask(__name__, static_folder='static', template_folder='templates')
+app.request_class = InMemoryUploadRequest
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
 
 # Initialize Firebase handler
 firebase = FirebaseHandler()
@@ -28,17 +62,248 @@ firebase = FirebaseHandler()
 # Ensure audio directory exists
 os.makedirs('static/audio', exist_ok=True)
 
-def load_sample_story():
-    """Load the sample story from the JSON file"""
-    try:
-        with open('sample_data/sample_story.json', 'r') as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"Error loading sample story: {e}")
-        return None
+# Catalog of static stories, compiled lazily on first use
+story_catalog = StoryCatalog('sample_data')
+
+# Clips of shipped stories rendered ahead of time by `python -m audio.prerender`
+prerendered_audio = load_prerender_manifest()
+
+# Encoded static scenes (with their audio maps), keyed by story version
+scene_payloads = ScenePayloadCache()
+
+# Background generation of the scenes a dynamic story's choices lead to
+scene_speculator = SceneSpeculator()
 
-# Global variable to store the sample story
-sample_story = load_sample_story()
+def scene_is_warm(story, compiled_scene, stream_narrative=False):
+    """Check whether a static scene's payload (and so all its audio) is already cached"""
+    key = ScenePayloadCache.key(story, compiled_scene.scene_id, "stream" if stream_narrative else "")
+    return scene_payloads.contains(key)
+
+def collect_app_metrics():
+    """Cache hit ratios and queue depths, read when /metrics is scraped"""
+    caches = {
+        "audio": get_audio_cache('static/audio').stats(),
+        "generation": scene_cache.stats(),
+        "user_state": firebase.cache_stats(),
+        "emotion": emotion_cache_stats(),
+        "story_catalog": story_catalog.stats(),
+        "prerendered_audio": prerendered_audio.stats(),
+        "scene_payloads": scene_payloads.stats()
+    }
+    # Disk-tier hits of the generation cache count as hits
+    hits = {name: stats["hits"] + stats.get("disk_hits", 0) for name, stats in caches.items()}
+    yield ("cache_hits_total", "counter", "Cache lookups that hit",
+           [({"cache": name}, hits[name]) for name in caches])
+    yield ("cache_misses_total", "counter", "Cache lookups that missed",
+           [({"cache": name}, stats["misses"]) for name, stats in caches.items()])
+    yield ("cache_hit_ratio", "gauge", "Fraction of cache lookups that hit",
+           [({"cache": name}, hits[name] / (hits[name] + stats["misses"]))
+            for name, stats in caches.items() if hits[name] + stats["misses"]])
+    yield ("cache_entries", "gauge", "Entries held by a cache",
+           [({"cache": name}, stats["entries"]) for name, stats in caches.items() if "entries" in stats])
+    yield ("audio_cache_bytes", "gauge", "Bytes of audio held by the clip cache",
+           [({}, caches["audio"]["bytes"])])
+    yield ("audio_cache_evictions_total", "counter", "Clips evicted from the audio cache",
+           [({}, caches["audio"]["evictions"])])
+    
+    write_stats = firebase.write_stats()
+    yield ("queue_depth", "gauge", "Work items waiting in a queue", [
+        ({"queue": "tts"}, tts_queue_depth()),
+        ({"queue": "stt"}, stt_queue_depth()),
+        ({"queue": "local_tts_pool"}, local_tts_pending()),
+        ({"queue": "prefetch"}, scene_prefetcher.pending()),
+        ({"queue": "speculative_generation"}, scene_speculator.pending()),
+        ({"queue": "firestore_write_behind"}, write_stats["queue_depth"] if write_stats else 0)
+    ])
+    if write_stats:
+        yield ("firestore_writes_total", "counter", "Firestore writes committed by the write-behind queue",
+               [({"outcome": outcome}, write_stats[outcome]) for outcome in ("written", "retried", "failed")])
+    prefetch_stats = scene_prefetcher.stats()
+    yield ("prefetch_transitions_total", "counter", "Scene transitions by whether their audio was prefetched",
+           [({"outcome": outcome}, prefetch_stats[key])
+            for outcome, key in (("hit", "hits"), ("late", "late"), ("miss", "misses"))])
+    yield ("prefetch_hit_ratio", "gauge", "Fraction of scene transitions whose audio was prefetched in time",
+           [({}, prefetch_stats["hit_rate"])])
+    yield ("prefetch_scenes_total", "counter", "Child scenes considered for prefetching",
+           [({"outcome": outcome}, prefetch_stats[outcome])
+            for outcome in ("completed", "skipped_warm", "cancelled", "dropped", "failed")])
+    speculative_stats = scene_speculator.stats()
+    yield ("speculative_transitions_total", "counter",
+           "Dynamic scene transitions by whether the scene was generated speculatively",
+           [({"outcome": outcome}, speculative_stats[key])
+            for outcome, key in (("hit", "hits"), ("late", "late"), ("miss", "misses"))])
+    yield ("speculative_generations_total", "counter", "Candidate next scenes considered for generation",
+           [({"outcome": outcome}, speculative_stats[outcome])
+            for outcome in ("started", "cached", "over_budget", "cancelled")])
+    flights = {flight.name: flight.stats() for flight in (tts_flight, generation_flight, emotion_flight, pack_flight)}
+    yield ("singleflight_executions_total", "counter", "Backend jobs run by a single-flight group",
+           [({"flight": name}, stats["executions"]) for name, stats in flights.items()])
+    yield ("singleflight_coalesced_total", "counter", "Callers that waited for an identical in-flight job",
+           [({"flight": name}, stats["coalesced"]) for name, stats in flights.items()])
+    schedulers = scheduler_stats()
+    yield ("scheduler_active_calls", "gauge", "Backend calls holding a scheduler slot",
+           [({"backend": name}, stats["active"]) for name, stats in schedulers.items()])
+    yield ("scheduler_concurrency_limit", "gauge", "Backend calls allowed to run at once",
+           [({"backend": name}, stats["limit"]) for name, stats in schedulers.items()])
+    yield ("scheduler_queued_calls", "gauge", "Backend calls waiting for a slot, by priority class",
+           [({"backend": name, "priority": priority}, count)
+            for name, stats in schedulers.items() for priority, count in stats["queued"].items()])
+    yield ("scheduler_calls_total", "counter", "Backend calls by admission outcome",
+           [({"backend": name, "outcome": outcome}, stats[outcome])
+            for name, stats in schedulers.items()
+            for outcome in ("admitted", "rejected", "evicted", "timed_out")])
+    yield ("backend_import_seconds", "gauge", "Time spent importing a backend module on first use",
+           [({"module": name}, seconds) for name, seconds in sorted(import_times().items())])
+
+register_collector(collect_app_metrics)
+
+@app.before_request
+def start_request_timer():
+    """Remember when the request started, for the request histogram"""
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    """Record the request's duration by endpoint and status"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        request_seconds.observe(time.perf_counter() - started, request.endpoint or "unmatched",
+                                request.method, str(response.status_code))
+    return response
+
+@app.errorhandler(Overloaded)
+def backend_overloaded(error):
+    """Answer at once with 503 and Retry-After when a backend's queue is full"""
+    response = jsonify({
+        "error": f"Service busy: {error.backend} is overloaded",
+        "retry_after": error.retry_after
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+@app.after_request
+def prefetch_next_scenes(response):
+    """
+    Once a scene has been sent, prepare the scenes the player can reach from it:
+    audio for static stories, Gemini generations for dynamic ones
+    """
+    served = g.pop('served_scene', None)
+    generated = g.pop('generated_scene', None)
+    if response.status_code == 200:
+        if served is not None:
+            response.call_on_close(lambda: scene_prefetcher.schedule(*served))
+        if generated is not None:
+            response.call_on_close(lambda: scene_speculator.speculate(*generated))
+    return response
+
+def build_audio_map(scene, story=None, stream_narrative=False):
+    """
+    Synthesize a scene's audio and build its audio URL map
+    
+    Args:
+        scene (Mapping): The scene (a dict or a read-only scene view; not modified)
+        story (CompiledStory): The static story the scene belongs to, if any
+        stream_narrative (bool): Skip narrative synthesis and point the client
+            at the streaming endpoint instead (static stories only)
+    
+    Returns:
+        dict: URLs keyed "narrative", "choices" (by choice id), plus
+              "narrative_stream" for static stories and "pack" when available
+    """
+    stream_url = None
+    if story is not None:
+        stream_url = "/stream_narration?" + urlencode({
+            "story_id": story.story_key,
+            "scene_id": scene["scene_id"]
+        })
+    stream_narrative = stream_narrative and stream_url is not None
+    
+    audio_paths = None
+    if story is not None:
+        audio_paths = prerendered_audio.scene_audio(story.story_key, scene,
+                                                    include_narrative=not stream_narrative)
+    if audio_paths is None:
+        audio_paths = generate_scene_audio(scene, include_narrative=not stream_narrative)
+    
+    if stream_narrative:
+        narrative_url = stream_url
+    else:
+        narrative_url = f"/audio/{os.path.basename(audio_paths['narrative'])}" if audio_paths.get('narrative') else None
+    
+    audio = {
+        "narrative": narrative_url,
+        "choices": {}
+    }
+    if stream_url:
+        audio["narrative_stream"] = stream_url
+    
+    for i, choice in enumerate(scene.get("choices", [])):
+        audio_key = f"choice_{i+1}"
+        if audio_key in audio_paths and audio_paths[audio_key]:
+            audio["choices"][choice["id"]] = f"/audio/{os.path.basename(audio_paths[audio_key])}"
+    
+    # One-file pack of every clip, for clients that prefer a single request
+    pack_clips = [] if stream_narrative else [("narrative", audio_paths.get("narrative"))]
+    pack_clips += [(choice["id"], audio_paths.get(f"choice_{i+1}"))
+                   for i, choice in enumerate(scene.get("choices", []))]
+    pack_path, pack_index = build_scene_pack(pack_clips)
+    if pack_path:
+        audio["pack"] = {
+            "url": f"/audio/{os.path.basename(pack_path)}",
+            "index": pack_index
+        }
+    return audio
+
+def static_scene_json(story, compiled_scene, stream_narrative=False):
+    """
+    Get the encoded scene (with audio map) of a static story scene
+    
+    Bodies are cached once every clip is ready. A cached body is rebuilt
+    when one of the clips it references has since been evicted, so cached
+    URLs never point at missing files.
+    
+    Args:
+        story (CompiledStory): The story
+        compiled_scene (CompiledScene): The scene
+        stream_narrative (bool): Point narrative audio at the streaming endpoint
+        
+    Returns:
+        bytes: The scene encoded as JSON
+    """
+    key = ScenePayloadCache.key(story, compiled_scene.scene_id, "stream" if stream_narrative else "")
+    cache = get_audio_cache('static/audio')
+    
+    def clips_present(clips):
+        if not all(cache.contains(clip) for clip in clips):
+            return False
+        # Served from the payload, so the clips never go through lookup()
+        cache.touch(clips)
+        return True
+    
+    scene_json = scene_payloads.get(key, clips_present)
+    if scene_json is not None:
+        return scene_json
+    
+    view = compiled_scene.view()
+    audio = build_audio_map(view, story, stream_narrative)
+    scene_json = encode_json({**compiled_scene.to_dict(), "audio": audio})
+    
+    complete = (audio["narrative"] is not None and "pack" in audio
+                and len(audio["choices"]) == len(view["choices"]))
+    if complete:
+        urls = [audio["narrative"], audio["pack"]["url"], *audio["choices"].values()]
+        scene_payloads.put(key, scene_json, [os.path.splitext(os.path.basename(url))[0]
+                                             for url in urls if url.startswith("/audio/")])
+    return scene_json
+
+# Background synthesis of the scenes reachable from the one just served
+scene_prefetcher = ScenePrefetcher(finish_scene=static_scene_json, is_warm=scene_is_warm)
+
+def scene_response(scene_json, user_id, **fields):
+    """Build a JSON response around an encoded scene"""
+    return Response(render_scene_response(scene_json, user_id, **fields) + b"\n",
+                    mimetype="application/json")
 
 @app.route('/')
 def index():
@@ -60,7 +325,8 @@ def api_index():
             "/next_scene": "Get the next scene based on choice",
             "/voice_input": "Process voice input",
             "/save_progress": "Save user progress",
-            "/get_state": "Get user state"
+            "/get_state": "Get user state",
+            "/metrics": "Prometheus metrics"
         }
     })
 
@@ -71,143 +337,299 @@ def serve_static(filename):
 
 @app.route('/audio/<path:filename>')
 def serve_audio(filename):
-    """Serve audio files - with specific headers for audio streaming"""
-    response = send_from_directory('static/audio', filename)
-    response.headers['Content-Type'] = 'audio/mpeg'
-    response.headers['Accept-Ranges'] = 'bytes'
-    return response
+    """Serve audio files with Range support, ETags and immutable caching"""
+    get_audio_cache('static/audio').touch([os.path.splitext(os.path.basename(filename))[0]])
+    return serve_audio_file('static/audio', filename)
 
 @app.route('/start_story', methods=['GET'])
 def start_story():
     """Start a new story from the first scene"""
     user_id = request.args.get('user_id', str(uuid.uuid4()))
     use_sample = request.args.get('use_sample', 'true').lower() == 'true'
+    story_id = request.args.get('story_id', SAMPLE_STORY_ID)
+    stream_narrative = request.args.get('stream_narrative', 'false').lower() == 'true'
+    story = story_catalog.get(story_id) if use_sample else None
+    if use_sample and not story:
+        return jsonify({"error": f"Story {story_id} not found"}), 404
     
-    if use_sample and sample_story:
-        first_scene_id = list(sample_story["scenes"].keys())[0]
-        scene_data = sample_story["scenes"][first_scene_id]
+    if use_sample:
+        start_scene = story.start_scene()
+        scene_id = start_scene.scene_id
+        scene_json = static_scene_json(story, start_scene, stream_narrative)
+        g.served_scene = (user_id, story, scene_id, stream_narrative)
     else:
-        scene_data = get_start_scene()
-    
-    if not scene_data:
-        print("Failed to load scene data.")
-        return jsonify({"error": "Failed to load scene data."}), 500
-    
-    audio_paths = generate_scene_audio(scene_data)
-    
-    scene_data["audio"] = {
-        "narrative": f"/audio/{os.path.basename(audio_paths['narrative'])}" if audio_paths.get('narrative') else None,
-        "choices": {}
-    }
-    
-    for i, choice in enumerate(scene_data.get("choices", [])):
-        audio_key = f"choice_{i+1}"
-        if audio_key in audio_paths and audio_paths[audio_key]:
-            scene_data["audio"]["choices"][choice["id"]] = f"/audio/{os.path.basename(audio_paths[audio_key])}"
+        # Clips are synthesized while the scene is still being generated
+        pipeline = ScenePipeline()
+        scene_data = get_start_scene(pipeline)
+        if not scene_data:
+            print("Failed to load scene data.")
+            return jsonify({"error": "Failed to load scene data."}), 500
+        pipeline.wait()
+        scene_id = scene_data['scene_id']
+        scene_data["audio"] = build_audio_map(scene_data)
+        scene_json = encode_json(scene_data)
+        g.generated_scene = (user_id, scene_data)
     
-    firebase.save_user_progress(user_id, scene_data['scene_id'])
+    firebase.save_user_progress(user_id, scene_id)
     
     firebase.log_metrics(user_id, {
         "action": "start_story",
-        "scene_id": scene_data['scene_id'],
+        "scene_id": scene_id,
         "use_sample": use_sample
     })
     
-    return jsonify({
-        "user_id": user_id,
-        "scene": scene_data
-    })
+    return scene_response(scene_json, user_id)
 
 @app.route('/next_scene', methods=['POST'])
 def next_scene():
     """Get the next scene based on user choice"""
     data = request.json
     
-    # Log incoming request data for debugging
-    print(f"Received request data for next_scene: {data}")
-    
     if not data or not data.get('user_id') or not data.get('choice_id'):
         return jsonify({
             "error": "Missing required parameters",
             "required": ["user_id", "choice_id"],
-            "optional": ["scene_id", "use_sample", "emotion"]
+            "optional": ["scene_id", "use_sample", "emotion", "story_id", "stream_narrative"]
         }), 400
     
-    user_id = data['user_id']
-    choice_id = data['choice_id']
-    scene_id = data.get('scene_id')
-    use_sample = data.get('use_sample', True)
-    emotion = data.get('emotion')
+    scene_json, status = advance_story(
+        data['user_id'],
+        data['choice_id'],
+        scene_id=data.get('scene_id'),
+        use_sample=data.get('use_sample', True),
+        emotion=data.get('emotion'),
+        story_id=data.get('story_id', SAMPLE_STORY_ID),
+        stream_narrative=data.get('stream_narrative', False)
+    )
+    if status != 200:
+        return jsonify(scene_json), status
+    return scene_response(scene_json, data['user_id'])
+
+def advance_story(user_id, choice_id, scene_id=None, use_sample=True, emotion=None,
+                  story_id=SAMPLE_STORY_ID, stream_narrative=False):
+    """
+    Move a user to the scene their choice leads to
+    
+    Args:
+        user_id (str): The user's ID
+        choice_id (str): The chosen choice ID
+        scene_id (str): The current scene (read from user state if None)
+        use_sample (bool): Use a static story instead of Gemini generation
+        emotion (str): Detected emotion, passed to scene generation
+        story_id (str): Catalog key of the static story
+        stream_narrative (bool): Point narrative audio at the streaming endpoint
+        
+    Returns:
+        tuple: (encoded scene bytes, 200) on success, or (error dict, HTTP status code)
+        
+    Raises:
+        Overloaded: If a backend's queue is full (answered with 503)
+    """
+    story = story_catalog.get(story_id) if use_sample else None
+    current_scene = None
+    if use_sample and not story:
+        return {"error": f"Story {story_id} not found"}, 404
     
     if not scene_id:
         user_state = firebase.get_user_state(user_id)
         scene_id = user_state.get('current_scene', 'start')
     
-    if use_sample and sample_story:
+    if use_sample:
         try:
-            current_scene = sample_story["scenes"].get(scene_id)
+            current_scene = story.get_scene(scene_id)
             if not current_scene:
-                return jsonify({"error": f"Scene {scene_id} not found in sample story"}), 404
+                return {"error": f"Scene {scene_id} not found in sample story"}, 404
                 
-            next_scene_id = None
-            for choice in current_scene.get("choices", []):
-                if choice["id"] == choice_id:
-                    next_scene_id = choice.get("next_scene")
-                    break
-            
+            next_scene_id = story.next_scene_id(scene_id, choice_id)
             if not next_scene_id:
-                return jsonify({"error": f"Choice {choice_id} not found in scene {scene_id}"}), 404
+                return {"error": f"Choice {choice_id} not found in scene {scene_id}"}, 404
                 
-            scene_data = sample_story["scenes"].get(next_scene_id)
-            if not scene_data:
-                return jsonify({"error": f"Next scene {next_scene_id} not found in sample story"}), 404
+            next_compiled = story.get_scene(next_scene_id)
+            if not next_compiled:
+                return {"error": f"Next scene {next_scene_id} not found in sample story"}, 404
+            new_scene_id = next_compiled.scene_id
+            scene_prefetcher.record_transition(user_id, story.story_key, new_scene_id)
+            scene_json = static_scene_json(story, next_compiled, stream_narrative)
+            g.served_scene = (user_id, story, new_scene_id, stream_narrative)
+        except Overloaded:
+            raise
         except Exception as e:
             print(f"Error processing sample story: {str(e)}")
-            return jsonify({"error": f"Error processing sample story: {str(e)}"}), 500
+            return {"error": f"Error processing sample story: {str(e)}"}, 500
     else:
-        # This would use the Gemini API in a full implementation
-        previous_scene_summary = current_scene["narrative"] if current_scene else ""
-        scene_data = generate_scene(previous_scene_summary, choice_id, emotion)
+        # Promotes the speculative generation for this choice, if one was started
+        pipeline = ScenePipeline()
+        scene_data = scene_speculator.next_scene(user_id, choice_id, scene_id, emotion, pipeline)
+        pipeline.wait()
+        new_scene_id = scene_data['scene_id']
+        scene_data["audio"] = build_audio_map(scene_data)
+        scene_json = encode_json(scene_data)
+        g.generated_scene = (user_id, scene_data, emotion)
     
-    audio_paths = generate_scene_audio(scene_data)
-    
-    scene_data["audio"] = {
-        "narrative": f"/audio/{os.path.basename(audio_paths['narrative'])}" if audio_paths.get('narrative') else None,
-        "choices": {}
-    }
-    
-    for i, choice in enumerate(scene_data.get("choices", [])):
-        audio_key = f"choice_{i+1}"
-        if audio_key in audio_paths and audio_paths[audio_key]:
-            scene_data["audio"]["choices"][choice["id"]] = f"/audio/{os.path.basename(audio_paths[audio_key])}"
-    
-    firebase.save_user_progress(user_id, scene_data['scene_id'])
+    firebase.save_user_progress(user_id, new_scene_id)
     firebase.save_choice(user_id, scene_id, {
         "id": choice_id,
-        "text": "Unknown choice"  # This would come from the current_scene in a full implementation
+        "text": (current_scene.choice_text(choice_id) if current_scene else None) or "Unknown choice"
     })
     
     firebase.log_metrics(user_id, {
         "action": "next_scene",
         "previous_scene": scene_id,
         "choice_id": choice_id,
-        "new_scene": scene_data['scene_id'],
+        "new_scene": new_scene_id,
         "emotion": emotion
     })
     
-    return jsonify({
-        "user_id": user_id,
-        "scene": scene_data
-    })
+    return scene_json, 200
+
+@app.route('/voice_input', methods=['POST'])
+def voice_input():
+    """Recognize a spoken choice and advance the story in the same call"""
+    upload = request.files.get('audio')
+    user_id = request.form.get('user_id')
+    
+    if not upload or not user_id:
+        return jsonify({
+            "error": "Missing required parameters",
+            "required": ["user_id", "audio"],
+            "optional": ["scene_id", "story_id", "use_sample", "available_choices", "emotion", "stream_narrative"]
+        }), 400
+    
+    scene_id = request.form.get('scene_id')
+    story_id = request.form.get('story_id', SAMPLE_STORY_ID)
+    use_sample = request.form.get('use_sample', 'true').lower() == 'true'
+    stream_narrative = request.form.get('stream_narrative', 'false').lower() == 'true'
+    
+    story = story_catalog.get(story_id) if use_sample else None
+    if use_sample and not story:
+        return jsonify({"error": f"Story {story_id} not found"}), 404
+    
+    if not scene_id:
+        scene_id = firebase.get_user_state(user_id).get('current_scene', 'start')
+    
+    current_scene = story.get_scene(scene_id) if story else None
+    
+    if current_scene:
+        available_choices = current_scene.to_dict()["choices"]
+        matcher = current_scene.matcher
+    else:
+        try:
+            available_choices = json.loads(request.form.get('available_choices') or '[]')
+        except ValueError:
+            return jsonify({"error": "available_choices must be a JSON list"}), 400
+        matcher = None
+    
+    # Uploads are kept in memory (see InMemoryUploadRequest), so no temp file is written
+    match = process_voice_command(upload.stream, available_choices, matcher, session_id=user_id)
+    if "error" in match:
+        return jsonify({
+            "error": match["error"],
+            "transcript": match.get("transcript"),
+            "candidates": match.get("candidates", []),
+            "audio": match.get("audio")
+        }), 422
+    
+    # Static stories only log the emotion, so it is not worth a Gemini round trip
+    emotion = request.form.get('emotion') or detect_emotion(match["transcript"], local_only=story is not None)
+    scene_json, status = advance_story(user_id, match["id"], scene_id, use_sample, emotion,
+                                       story_id, stream_narrative)
+    voice = {
+        "transcript": match["transcript"],
+        "choice_id": match["id"],
+        "confidence": match["confidence"],
+        "ranked": match["ranked"],
+        "emotion": emotion,
+        "audio": match.get("audio")
+    }
+    if status != 200:
+        return jsonify({**scene_json, "voice": voice}), status
+    return scene_response(scene_json, user_id, voice=voice)
+
+@app.route('/stream_narration')
+def narration_stream():
+    """Stream a static scene's narration as MP3 over chunked HTTP"""
+    story = story_catalog.get(request.args.get('story_id', SAMPLE_STORY_ID))
+    scene_id = request.args.get('scene_id')
+    scene = story.get_scene(scene_id) if story and scene_id else None
+    
+    if not scene:
+        return jsonify({"error": f"Scene {scene_id} not found"}), 404
+    
+    return Response(
+        stream_with_context(stream_narration(scene.narrative)),
+        mimetype='audio/mpeg',
+        headers={'Cache-Control': 'no-cache'}
+    )
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint: span and request histograms, cache and queue gauges"""
+    return Response(render_prometheus(), content_type=PROMETHEUS_CONTENT_TYPE)
 
 @app.route('/test_audio')
 def test_audio():
     """Test the TTS system and return a demo audio URL"""
-    result = text_to_speech_demo()
-    return jsonify({"message": result, "audio_url": "/audio/demo.mp3"})
+    result, demo_path = text_to_speech_demo()
+    audio_url = f"/audio/{os.path.basename(demo_path)}" if demo_path else None
+    return jsonify({"message": result, "audio_url": audio_url})
 
 # Additional routes...
 
+def warm_up():
+    """
+    Pay start-up costs before the worker accepts traffic
+    
+    Imports the installed backends, creates the Gemini client, connects to
+    Firebase, compiles the sample story and renders its start scene (with
+    audio) into the payload cache, so the first request is not slower
+    than the rest.
+    
+    Returns:
+        dict: Seconds spent per warm-up step and per backend import
+    """
+    steps = {}
+    
+    def timed(name, action):
+        started = time.perf_counter()
+        try:
+            action()
+        except Exception as e:
+            print(f"Warm-up step {name} failed: {e}")
+        steps[name] = time.perf_counter() - started
+    
+    def import_backends():
+        for module_name in WARMUP_MODULES:
+            if is_available(module_name):
+                lazy_import(module_name)
+    
+    def create_gemini_client():
+        if os.getenv("GEMINI_API_KEY"):
+            get_gemini_model()
+    
+    def render_start_scene():
+        story = story_catalog.get()
+        if story is not None:
+            static_scene_json(story, story.start_scene())
+    
+    timed("imports", import_backends)
+    timed("gemini", create_gemini_client)
+    timed("firebase", lambda: firebase.connected)
+    timed("start_scene", render_start_scene)
+    
+    report = {"steps": steps, "imports": import_times()}
+    print("Warm-up finished in {:.2f}s".format(sum(steps.values())))
+    for name, seconds in sorted(report["imports"].items(), key=lambda item: -item[1]):
+        print(f"  import {name}: {seconds:.3f}s")
+    for name, seconds in steps.items():
+        print(f"  {name}: {seconds:.3f}s")
+    return report
+
+if WARMUP_ON_IMPORT:
+    warm_up()
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8080))
+    # The reloader re-imports this module in a child process; warm up only there
+    if os.getenv("WARMUP", "true").lower() == "true" and os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        warm_up()
     app.run(host='0.0.0.0', port=port, debug=True)
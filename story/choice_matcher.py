@@ -0,0 +1,250 @@
+"""
+Choice Matcher Module - Precomputed per-scene index for voice commands
+
+Each scene's choices are tokenized, stopword-filtered, stemmed and given
+IDF weights within the scene, and every stem also gets a Soundex key so
+near-homophones from speech recognition ("write" / "right") still match.
+Matching a transcript is then a walk over an inverted index that scores
+all choices at once and returns them ranked with a confidence. Direction
+and negation words are kept, since they are often all that tells two
+choices apart ("climb up" / "climb down"), and choices that tie for the
+best score are flagged as ambiguous rather than ranked by position.
+"""
+import re
+import math
+
+# Words ignored when matching (direction and negation words are deliberately absent)
+STOPWORDS = frozenset((
+    "a", "an", "the", "to", "of", "and", "or", "in", "on", "at", "for", "with", "from", "by",
+    "is", "are", "be", "it", "its", "this", "that",
+    "these", "those", "i", "me", "my", "we", "you", "your", "he", "she", "they", "them", "let",
+    "lets", "let's", "want", "would", "like", "please", "will", "shall", "should", "can", "could",
+    "do", "does", "just", "some", "any", "then", "so", "as", "but", "if", "um", "uh", "ok", "okay",
+    "choose", "pick", "select", "option", "go", "goes"
+))
+
+# Spoken ordinals that select a choice by position
+ORDINALS = {
+    "first": 0, "one": 0, "1": 0, "1st": 0,
+    "second": 1, "two": 1, "2": 1, "2nd": 1,
+    "third": 2, "three": 2, "3": 2, "3rd": 2,
+    "fourth": 3, "four": 3, "4": 3, "4th": 3
+}
+
+# Words that mark a following ordinal as a position ("option two", "the first one")
+ORDINAL_MARKERS = frozenset(("option", "choice", "number", "the", "pick", "choose"))
+
+# Weight of a phonetic-only match relative to an exact stem match
+PHONETIC_WEIGHT = 0.6
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+_SOUNDEX_CODES = {}
+for _letters, _code in (("bfpv", "1"), ("cgjkqsxz", "2"), ("dt", "3"), ("l", "4"), ("mn", "5"), ("r", "6")):
+    for _letter in _letters:
+        _SOUNDEX_CODES[_letter] = _code
+
+
+def tokenize(text):
+    """Lowercase text and split it into word tokens"""
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+def stem(word):
+    """
+    Reduce a word to a crude stem by stripping common English suffixes
+
+    Args:
+        word (str): A lowercase token
+
+    Returns:
+        str: The stem
+    """
+    if len(word) <= 3:
+        return word
+    if word.endswith("'s"):
+        word = word[:-2]
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    for suffix in ("ingly", "edly", "ing", "ed", "ly", "es", "er", "s"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)]
+            break
+    # Collapse doubled final consonants left behind ("stopp" -> "stop")
+    if len(word) > 3 and word[-1] == word[-2] and word[-1] not in "aeiouls":
+        word = word[:-1]
+    return word
+
+
+# Spelling patterns normalized before Soundex so silent letters do not split keys
+_PHONETIC_PREFIXES = (("wr", "r"), ("kn", "n"), ("gn", "n"), ("wh", "w"), ("ps", "s"), ("ph", "f"))
+_SILENT_GH = re.compile(r"gh(?=t|$)")
+
+
+def soundex(word):
+    """
+    Compute the Soundex key of a word, after normalizing silent letters
+
+    Args:
+        word (str): A lowercase token
+
+    Returns:
+        str: Four-character phonetic key, or "" for words without letters
+    """
+    for prefix, replacement in _PHONETIC_PREFIXES:
+        if word.startswith(prefix):
+            word = replacement + word[len(prefix):]
+            break
+    word = _SILENT_GH.sub("", word.replace("ph", "f"))
+    letters = [c for c in word if c.isalpha()]
+    if not letters:
+        return ""
+    first = letters[0]
+    key = [first.upper()]
+    previous = _SOUNDEX_CODES.get(first, "")
+    for c in letters[1:]:
+        code = _SOUNDEX_CODES.get(c, "")
+        if code and code != previous:
+            key.append(code)
+            if len(key) == 4:
+                break
+        if c not in "hw":
+            previous = code
+    return "".join(key).ljust(4, "0")
+
+
+def content_terms(text):
+    """Stems of the non-stopword tokens of a text, in order"""
+    return [stem(token) for token in tokenize(text) if token not in STOPWORDS]
+
+
+class ChoiceMatcher:
+    """Inverted index over one scene's choices"""
+
+    __slots__ = ("choice_ids", "choice_texts", "postings", "phonetic_postings", "totals")
+
+    def __init__(self, choices):
+        """
+        Args:
+            choices (list): Choice dicts with "id" and "text", or (id, text, ...) tuples
+        """
+        pairs = [(c["id"], c.get("text", "")) if isinstance(c, dict) else (c[0], c[1]) for c in choices]
+        self.choice_ids = tuple(choice_id for choice_id, _ in pairs)
+        self.choice_texts = tuple(text for _, text in pairs)
+
+        terms_per_choice = [set(content_terms(text)) for text in self.choice_texts]
+        document_frequency = {}
+        for terms in terms_per_choice:
+            for term in terms:
+                document_frequency[term] = document_frequency.get(term, 0) + 1
+
+        n_choices = len(pairs)
+        self.postings = {}  # stem -> ((choice index, weight), ...)
+        self.phonetic_postings = {}  # soundex -> ((choice index, weight, stem), ...)
+        self.totals = [0.0] * n_choices
+        for index, terms in enumerate(terms_per_choice):
+            for term in terms:
+                # Terms shared by every choice carry little information
+                weight = math.log(1 + n_choices / document_frequency[term])
+                self.postings.setdefault(term, []).append((index, weight))
+                key = soundex(term)
+                if key:
+                    self.phonetic_postings.setdefault(key, []).append((index, weight, term))
+                self.totals[index] += weight
+
+        self.postings = {term: tuple(entries) for term, entries in self.postings.items()}
+        self.phonetic_postings = {key: tuple(entries) for key, entries in self.phonetic_postings.items()}
+
+    def match(self, transcript):
+        """
+        Rank the scene's choices against a transcript
+
+        Args:
+            transcript (str): Recognized speech
+
+        Returns:
+            list: Dicts with "id", "text", "score" and "confidence", best first;
+                  only choices with a positive score are included. When
+                  several choices tie for the best score, each of them
+                  carries "ambiguous": True and none gets the top confidence.
+        """
+        n_choices = len(self.choice_ids)
+        if not n_choices:
+            return []
+
+        tokens = tokenize(transcript)
+        ordinal = self._ordinal(tokens)
+        if ordinal is not None:
+            return [{"id": self.choice_ids[ordinal], "text": self.choice_texts[ordinal],
+                     "score": 1.0, "confidence": 1.0}]
+
+        scores = [0.0] * n_choices
+        explained = [0.0] * n_choices  # transcript terms each choice accounts for
+        seen = set()
+        for token in tokens:
+            if token in STOPWORDS:
+                continue
+            term = stem(token)
+            if term in seen:
+                continue
+            seen.add(term)
+
+            exact = self.postings.get(term)
+            matched = set()
+            if exact:
+                for index, weight in exact:
+                    scores[index] += weight
+                    explained[index] += 1
+                    matched.add(index)
+            for index, weight, choice_term in self.phonetic_postings.get(soundex(term), ()):
+                if index not in matched and choice_term not in seen:
+                    scores[index] += PHONETIC_WEIGHT * weight
+                    explained[index] += PHONETIC_WEIGHT
+                    matched.add(index)
+
+        coverage = [scores[i] / self.totals[i] if self.totals[i] else 0.0 for i in range(n_choices)]
+        # A short command that only names a choice ("left") is as sure as one that
+        # repeats it in full; confidence blends choice coverage with the share of
+        # the transcript the choice explains
+        fit = [math.sqrt(min(1.0, coverage[i]) * explained[i] / len(seen)) if seen else 0.0
+               for i in range(n_choices)]
+        ranked = sorted((i for i in range(n_choices) if scores[i] > 0),
+                        key=lambda i: (coverage[i], scores[i]), reverse=True)
+        if not ranked:
+            return []
+
+        best = ranked[0]
+        runner_up = coverage[ranked[1]] if len(ranked) > 1 else 0.0
+        margin = (coverage[best] - runner_up) / coverage[best] if coverage[best] else 0.0
+        tied = {index for index in ranked
+                if math.isclose(coverage[index], coverage[best])
+                and math.isclose(scores[index], scores[best])}
+
+        results = []
+        for rank, index in enumerate(ranked):
+            if rank == 0 and len(tied) == 1:
+                confidence = fit[index] * (0.5 + 0.5 * margin)
+            else:
+                confidence = fit[index] * 0.5 * (1 - margin)
+            result = {
+                "id": self.choice_ids[index],
+                "text": self.choice_texts[index],
+                "score": round(scores[index], 4),
+                "confidence": round(confidence, 3)
+            }
+            if len(tied) > 1 and index in tied:
+                result["ambiguous"] = True
+            results.append(result)
+        return results
+
+    def _ordinal(self, tokens):
+        """Detect "option two" / "the first one" style selections"""
+        for i, token in enumerate(tokens):
+            position = ORDINALS.get(token)
+            if position is None or position >= len(self.choice_ids):
+                continue
+            # Bare numbers or ordinals like "second" count; "one" only after a marker
+            if token not in ("one", "two", "three", "four") or (i > 0 and tokens[i - 1] in ORDINAL_MARKERS):
+                if len(tokens) <= 4:
+                    return position
+        return None
@@ -0,0 +1,163 @@
+"""
+Emotion Classifier Module - Local lexicon/n-gram emotion classifier
+
+Scores short user utterances against a small weighted lexicon of words
+and phrases for each emotion label, with negation handling and
+punctuation cues. Returns a label and a confidence in [0, 1] so callers
+can decide when a remote model is worth asking.
+"""
+import re
+import math
+
+# Labels shared with emotion_detector
+VALID_EMOTIONS = ("happy", "sad", "angry", "scared", "curious",
+                  "excited", "confused", "neutral", "surprised")
+
+# Weighted cue words and phrases per emotion (phrases are matched as n-grams)
+EMOTION_LEXICON = {
+    "happy": {
+        "happy": 1.5, "glad": 1.2, "joy": 1.2, "joyful": 1.5, "delighted": 1.5, "pleased": 1.0,
+        "love": 1.0, "lovely": 1.0, "wonderful": 1.0, "great": 0.8, "good": 0.5, "nice": 0.6,
+        "yay": 1.2, "smile": 1.0, "smiling": 1.0, "cheerful": 1.5, "content": 0.8,
+        "feel good": 1.5, "so good": 1.2, "thank you": 0.8, "thanks": 0.6, "beautiful": 0.8
+    },
+    "sad": {
+        "sad": 1.5, "unhappy": 1.5, "depressed": 2.0, "miserable": 2.0, "lonely": 1.5,
+        "cry": 1.2, "crying": 1.5, "tears": 1.2, "sorry": 0.8, "heartbroken": 2.0, "lost": 0.6,
+        "hopeless": 1.8, "gloomy": 1.2, "down": 0.5, "miss": 0.6, "grief": 1.8, "upset": 1.0,
+        "feel bad": 1.2, "so sad": 2.0, "awful": 1.2, "horrible": 1.0, "terrible": 1.0,
+        "bored": 1.0, "boring": 0.8, "tired": 0.6, "sigh": 0.8
+    },
+    "angry": {
+        "angry": 1.5, "mad": 1.2, "furious": 2.0, "annoyed": 1.2, "annoying": 1.2, "hate": 1.5,
+        "irritated": 1.2, "rage": 1.8, "stupid": 1.0, "ridiculous": 1.0, "frustrated": 1.2,
+        "frustrating": 1.2, "fed up": 1.5, "sick of": 1.2, "damn": 1.0, "enough": 0.5,
+        "shut up": 1.5, "ugh": 1.0, "argh": 1.2, "unfair": 1.0
+    },
+    "scared": {
+        "scared": 1.5, "afraid": 1.5, "fear": 1.2, "frightened": 1.8, "terrified": 2.0,
+        "nervous": 1.0, "anxious": 1.0, "worried": 1.0, "creepy": 1.2, "spooky": 1.0,
+        "horrified": 1.8, "panic": 1.5, "danger": 0.8, "dangerous": 0.8, "run away": 1.2,
+        "help me": 1.2, "too dark": 1.0, "freaking out": 1.5, "scary": 1.5,
+        "horrible": 0.6, "eerie": 1.0, "dread": 1.2, "shaking": 1.0
+    },
+    "curious": {
+        "curious": 1.5, "wonder": 1.0, "wondering": 1.0, "interesting": 1.0, "intrigued": 1.5,
+        "explore": 0.8, "investigate": 1.0, "examine": 0.6, "learn": 0.6, "discover": 0.8,
+        "what is": 0.6, "what's": 0.5, "why": 0.5, "how": 0.3, "tell me": 0.8, "find out": 1.0,
+        "look closer": 1.0, "more about": 0.8
+    },
+    "excited": {
+        "excited": 1.8, "exciting": 1.5, "thrilled": 1.8, "awesome": 1.2, "amazing": 1.0,
+        "cool": 0.8, "epic": 1.2, "can't wait": 1.8, "let's go": 1.2, "lets go": 1.2, "woohoo": 1.5,
+        "adventure": 0.6, "pumped": 1.5, "hyped": 1.5, "yes": 0.4, "finally": 0.6
+    },
+    "confused": {
+        "confused": 1.8, "confusing": 1.5, "unsure": 1.2, "lost": 0.6, "huh": 1.2, "what": 0.3,
+        "don't understand": 1.8, "dont understand": 1.8, "do not understand": 1.8,
+        "don't know": 1.2, "dont know": 1.2, "not sure": 1.2,
+        "makes no sense": 1.8, "puzzled": 1.5, "unclear": 1.2, "which one": 0.8, "i guess": 0.6,
+        "hmm": 0.8, "what do i do": 1.5
+    },
+    "surprised": {
+        "surprised": 1.8, "surprising": 1.5, "wow": 1.5, "whoa": 1.5, "unexpected": 1.2,
+        "shocked": 1.8, "omg": 1.5, "oh my": 1.2, "no way": 1.5, "really": 0.5, "astonished": 1.8,
+        "unbelievable": 1.5, "didn't expect": 1.5, "can't believe": 1.5, "suddenly": 0.6
+    },
+    "neutral": {
+        "okay": 0.6, "ok": 0.6, "fine": 0.6, "alright": 0.6, "sure": 0.5, "whatever": 0.8,
+        "go": 0.2, "take": 0.2, "choose": 0.3, "left": 0.2, "right": 0.2, "continue": 0.4
+    }
+}
+
+# Words that flip the meaning of the next few tokens
+NEGATIONS = frozenset(("not", "no", "never", "don't", "dont", "isn't", "wasn't", "aren't",
+                       "can't", "cannot", "hardly", "without"))
+
+# Tokens after a negation that it applies to
+NEGATION_WINDOW = 3
+
+# Longest phrase in the lexicon, in tokens
+MAX_NGRAM = max(len(phrase.split()) for cues in EMOTION_LEXICON.values() for phrase in cues)
+
+# Flattened lookup: n-gram -> ((emotion, weight), ...)
+_NGRAM_INDEX = {}
+for _emotion, _cues in EMOTION_LEXICON.items():
+    for _phrase, _weight in _cues.items():
+        _NGRAM_INDEX.setdefault(_phrase, []).append((_emotion, _weight))
+_NGRAM_INDEX = {phrase: tuple(entries) for phrase, entries in _NGRAM_INDEX.items()}
+
+_TOKEN_RE = re.compile(r"[a-z]+(?:'[a-z]+)?")
+
+
+def normalize_text(text):
+    """Lowercase and collapse whitespace so equivalent utterances share a cache key"""
+    return " ".join((text or "").lower().split())
+
+
+def classify_emotion(text):
+    """
+    Classify the emotional tone of a short utterance locally
+
+    Args:
+        text (str): The text to analyze
+
+    Returns:
+        tuple: (emotion label, confidence between 0 and 1)
+    """
+    normalized = normalize_text(text)
+    tokens = _TOKEN_RE.findall(normalized)
+    if not tokens:
+        return "neutral", 1.0 if not normalized else 0.5
+
+    scores = dict.fromkeys(VALID_EMOTIONS, 0.0)
+    negated_until = -1
+    i = 0
+    while i < len(tokens):
+        # Prefer the longest phrase starting at this token
+        matched = 0
+        for n in range(min(MAX_NGRAM, len(tokens) - i), 0, -1):
+            entries = _NGRAM_INDEX.get(" ".join(tokens[i:i + n]))
+            if entries:
+                for emotion, weight in entries:
+                    if i <= negated_until and emotion != "neutral":
+                        # "not happy" is not happy; count it as weak sadness instead
+                        if emotion == "happy":
+                            scores["sad"] += weight * 0.5
+                        continue
+                    scores[emotion] += weight
+                matched = n
+                break
+
+        if not matched:
+            if tokens[i] in NEGATIONS:
+                negated_until = i + NEGATION_WINDOW
+            matched = 1
+        i += matched
+
+    # Punctuation cues
+    if "?" in normalized:
+        scores["curious"] += 0.4 * min(normalized.count("?"), 2)
+        scores["confused"] += 0.2 * min(normalized.count("?"), 2)
+    if "!" in normalized:
+        bang = 0.3 * min(normalized.count("!"), 3)
+        for emotion in ("excited", "surprised", "angry", "happy"):
+            if scores[emotion] > 0:
+                scores[emotion] += bang
+
+    emotional = {emotion: score for emotion, score in scores.items()
+                 if emotion != "neutral" and score > 0}
+    if not emotional:
+        # Short commands ("ok", "go left") are confidently neutral; text the
+        # lexicon has no cue for at all may carry tone it misses, so its
+        # confidence stays below the escalation threshold
+        if scores["neutral"] > 0 and len(tokens) <= 8:
+            return "neutral", 0.75
+        return "neutral", 0.4
+
+    label = max(emotional, key=emotional.get)
+    top = emotional[label]
+    total = sum(emotional.values()) + scores["neutral"]
+    share = top / total
+    strength = 1.0 - math.exp(-1.5 * top)
+    return label, round(share * strength, 3)
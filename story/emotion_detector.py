@@ -1,38 +1,84 @@
 """
-Emotion Detector Module - Detects emotional tone using Gemini
+Emotion Detector Module - Detects emotional tone locally, escalating to Gemini
 """
 import os
-import google.generativeai as genai
+import json
+import threading
+from collections import OrderedDict
 from dotenv import load_dotenv
+from story.gemini_client import get_gemini_model, gemini_slot
+from story.emotion_classifier import VALID_EMOTIONS, classify_emotion, normalize_text
+from common.metrics import span
+from common.singleflight import SingleFlight
 
 # Load environment variables
 load_dotenv()
 
+# Local classifications below this confidence are escalated to Gemini
+EMOTION_CONFIDENCE_THRESHOLD = float(os.getenv("EMOTION_CONFIDENCE_THRESHOLD", 0.6))
+
+# Detected emotions remembered by normalized text
+EMOTION_CACHE_SIZE = int(os.getenv("EMOTION_CACHE_SIZE", 4096))
+
+# Concurrent escalations of the same text share one Gemini call
+emotion_flight = SingleFlight("emotion")
+
+_emotion_cache = OrderedDict()
+_emotion_cache_lock = threading.Lock()
+_emotion_counts = {"hits": 0, "misses": 0, "escalations": 0}
+
 def init_gemini():
-    """Initialize the Gemini API with API key from environment variables"""
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY environment variable not set")
-    
-    genai.configure(api_key=api_key)
-    # Use gemini-1.5-pro or other available models with fallbacks
-    try:
-        # First try newer model version
-        return genai.GenerativeModel('gemini-1.5-pro')
-    except Exception:
-        try:
-            # Fall back to older version
-            return genai.GenerativeModel('gemini-pro')
-        except Exception as e:
-            print(f"Error initializing Gemini model for emotion detection: {e}")
-            return None
+    """Get the shared Gemini model (created once per process)"""
+    return get_gemini_model()
+
+def _cache_get(key):
+    """Look up a previously detected emotion by normalized text"""
+    with _emotion_cache_lock:
+        emotion = _emotion_cache.get(key)
+        if emotion is not None:
+            _emotion_cache.move_to_end(key)
+            _emotion_counts["hits"] += 1
+        else:
+            _emotion_counts["misses"] += 1
+        return emotion
+
+def _cache_put(key, emotion):
+    """Remember a detected emotion, evicting the least recently used"""
+    with _emotion_cache_lock:
+        _emotion_cache[key] = emotion
+        _emotion_cache.move_to_end(key)
+        while len(_emotion_cache) > EMOTION_CACHE_SIZE:
+            _emotion_cache.popitem(last=False)
+
+def _count_escalations(count):
+    """Record texts sent to Gemini because the local classifier was unsure"""
+    with _emotion_cache_lock:
+        _emotion_counts["escalations"] += count
+
+def emotion_cache_stats():
+    """Return emotion cache and escalation statistics"""
+    with _emotion_cache_lock:
+        lookups = _emotion_counts["hits"] + _emotion_counts["misses"]
+        return {
+            "entries": len(_emotion_cache),
+            "hits": _emotion_counts["hits"],
+            "misses": _emotion_counts["misses"],
+            "hit_ratio": (_emotion_counts["hits"] / lookups) if lookups else 0.0,
+            "escalations": _emotion_counts["escalations"]
+        }
 
-def detect_emotion(text_input):
+def detect_emotion(text_input, local_only=False):
     """
     Detect the emotional tone from user text input
     
+    The local classifier answers first; Gemini is only asked when its
+    confidence is below EMOTION_CONFIDENCE_THRESHOLD. Results are cached
+    by normalized text.
+    
     Args:
         text_input (str): The text to analyze for emotional content
+        local_only (bool): Never ask Gemini, e.g. when the emotion is only
+            logged; an unsure local guess is returned but not cached
         
     Returns:
         str: Detected emotion (happy, scared, curious, neutral, etc.)
@@ -40,10 +86,95 @@ def detect_emotion(text_input):
     if not text_input or text_input.strip() == "":
         return "neutral"
     
-    model = init_gemini()
+    key = normalize_text(text_input)
+    cached_emotion = _cache_get(key)
+    if cached_emotion is not None:
+        return cached_emotion
+    
+    emotion, confidence = classify_emotion(text_input)
+    if confidence < EMOTION_CONFIDENCE_THRESHOLD:
+        if local_only:
+            return emotion
+        def escalate():
+            _count_escalations(1)
+            return _detect_emotion_remote(text_input)
+        remote_emotion = emotion_flight.do(key, escalate)
+        if remote_emotion is None:
+            # Gemini unavailable - use the local guess but retry next time
+            return emotion
+        emotion = remote_emotion
+    
+    _cache_put(key, emotion)
+    return emotion
+
+def detect_emotions(text_inputs):
+    """
+    Detect the emotional tone of several texts at once
+    
+    Texts the local classifier is unsure about are sent to Gemini in a
+    single request.
+    
+    Args:
+        text_inputs (list): Texts to analyze
+        
+    Returns:
+        list: Detected emotions, in the same order as text_inputs
+    """
+    results = {}
+    uncertain = {}
+    
+    for text_input in text_inputs:
+        key = normalize_text(text_input)
+        if key in results or key in uncertain:
+            continue
+        if not key:
+            results[key] = "neutral"
+            continue
+        
+        cached_emotion = _cache_get(key)
+        if cached_emotion is not None:
+            results[key] = cached_emotion
+            continue
+        
+        emotion, confidence = classify_emotion(text_input)
+        if confidence < EMOTION_CONFIDENCE_THRESHOLD:
+            uncertain[key] = (text_input, emotion)
+        else:
+            results[key] = emotion
+            _cache_put(key, emotion)
+    
+    if uncertain:
+        def escalate(keys):
+            # Texts another caller is already escalating are waited for, not re-sent
+            _count_escalations(len(keys))
+            remote_emotions = _detect_emotions_remote([uncertain[key][0] for key in keys])
+            return dict(zip(keys, remote_emotions, strict=True))
+        remote_emotions = emotion_flight.do_batch(list(uncertain), escalate)
+        for key, (_, local_emotion) in uncertain.items():
+            remote_emotion = remote_emotions.get(key)
+            if remote_emotion is None:
+                results[key] = local_emotion
+            else:
+                results[key] = remote_emotion
+                _cache_put(key, remote_emotion)
+    
+    return [results[normalize_text(text_input)] for text_input in text_inputs]
+
+def _detect_emotion_remote(text_input):
+    """
+    Ask Gemini to classify a single text
+    
+    Returns:
+        str: A valid emotion label, or None if Gemini could not be used
+    """
+    try:
+        model = init_gemini()
+    except ValueError as e:
+        print(f"Gemini unavailable for emotion detection: {e}")
+        return None
     if model is None:
-        print("Falling back to default emotion: neutral")
-        return "neutral"
+        print("Gemini unavailable for emotion detection; using local classifier")
+        return None
     
     prompt = f"""
     Analyze the following text and determine the primary emotional state expressed.
@@ -55,21 +186,62 @@ def detect_emotion(text_input):
     """
     
     try:
-        response = model.generate_content(prompt)
+        with gemini_slot(), span("gemini.emotion", "gemini"):
+            response = model.generate_content(prompt)
         detected_emotion = response.text.strip().lower()
         
         # Validate that the response is one of our expected emotions
-        valid_emotions = ["happy", "sad", "angry", "scared", "curious", 
-                         "excited", "confused", "neutral", "surprised"]
-        
-        if detected_emotion in valid_emotions:
+        if detected_emotion in VALID_EMOTIONS:
             return detected_emotion
         else:
             return "neutral"
             
     except Exception as e:
         print(f"Error detecting emotion: {e}")
-        return "neutral"
+        return None
+
+def _detect_emotions_remote(text_inputs):
+    """
+    Ask Gemini to classify several texts in one request
+    
+    Returns:
+        list: Emotion labels (None where Gemini could not be used), in order
+    """
+    if len(text_inputs) == 1:
+        return [_detect_emotion_remote(text_inputs[0])]
+    
+    try:
+        model = init_gemini()
+    except ValueError as e:
+        print(f"Gemini unavailable for emotion detection: {e}")
+        return [None] * len(text_inputs)
+    if model is None:
+        return [None] * len(text_inputs)
+    
+    numbered = "\n".join(f"{i + 1}. {json.dumps(text)}" for i, text in enumerate(text_inputs))
+    prompt = f"""
+    For each numbered text below, determine the primary emotional state expressed.
+    Classify each as one of the following: happy, sad, angry, scared, curious, excited, confused, neutral, or surprised.
+    
+    {numbered}
+    
+    Return only a JSON array of emotion names, one per text, in the same order.
+    """
+    
+    try:
+        with gemini_slot(), span("gemini.emotion_batch", "gemini"):
+            response = model.generate_content(prompt)
+        response_text = response.text.strip()
+        if "```" in response_text:
+            response_text = response_text.split("```")[1].removeprefix("json").strip()
+        labels = json.loads(response_text)
+        if not isinstance(labels, list) or len(labels) != len(text_inputs):
+            raise ValueError(f"expected {len(text_inputs)} labels, got {labels!r}")
+        return [label.strip().lower() if isinstance(label, str) and label.strip().lower() in VALID_EMOTIONS
+                else "neutral" for label in labels]
+    except Exception as e:
+        print(f"Error detecting emotions in batch: {e}")
+        return [None] * len(text_inputs)
 
 def get_emotion_prompt_modifier(emotion):
     """
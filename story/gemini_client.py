@@ -0,0 +1,81 @@
+"""
+Gemini Client Module - Shared, lazily created Gemini model
+
+genai.configure and GenerativeModel construction happen once per process
+instead of on every story generation or emotion detection call. The
+google.generativeai package itself is only imported when the model is
+first needed. Calls to the model take a slot from the Gemini scheduler
+(see gemini_slot), which bounds how many run at once.
+"""
+import os
+import threading
+from dotenv import load_dotenv
+from common.lazy_imports import lazy_import
+from common.scheduler import backend_scheduler
+
+# Load environment variables
+load_dotenv()
+
+# Models tried in order when creating the shared client
+GEMINI_MODELS = ("gemini-1.5-pro", "gemini-pro")
+
+# Maximum concurrent Gemini calls (further calls queue by priority)
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", 8))
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def _create_model():
+    """Configure the Gemini API and build a model, trying fallbacks in order"""
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        raise ValueError("GEMINI_API_KEY environment variable not set")
+
+    genai = lazy_import("google.generativeai")
+    genai.configure(api_key=api_key)
+    for model_name in GEMINI_MODELS:
+        try:
+            return genai.GenerativeModel(model_name)
+        except Exception as e:
+            print(f"Error initializing Gemini model {model_name}: {e}")
+    return None
+
+
+def get_gemini_model():
+    """
+    Get the shared Gemini model, creating it on first use
+
+    Returns:
+        GenerativeModel: The shared model, or None if no model could be created
+
+    Raises:
+        ValueError: If GEMINI_API_KEY is not set
+    """
+    global _model
+    if _model is not None:
+        return _model
+    with _model_lock:
+        if _model is None:
+            _model = _create_model()
+        return _model
+
+
+def gemini_slot(priority=None):
+    """
+    Take a slot from the Gemini scheduler
+
+    Args:
+        priority (int or PriorityHandle): Defaults to the caller's priority
+
+    Raises:
+        Overloaded: If too many Gemini calls are already queued
+    """
+    return backend_scheduler("gemini", GEMINI_CONCURRENCY).slot(priority)
+
+
+def reset_gemini_model():
+    """Drop the shared model so the next call re-reads configuration"""
+    global _model
+    with _model_lock:
+        _model = None
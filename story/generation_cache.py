@@ -0,0 +1,172 @@
+"""
+Generation Cache Module - Memoizes Gemini scene generation
+
+Generated scenes are cached by (previous scene, choice, emotion, prompt
+version) in a TTL-bounded in-memory LRU, optionally backed by a disk tier
+shared between worker processes, so repeated paths through dynamic stories
+skip model calls entirely.
+"""
+import os
+import json
+import time
+import copy
+import hashlib
+import threading
+from collections import OrderedDict
+from common.singleflight import atomic_output
+
+# Seconds a generated scene stays valid
+DEFAULT_TTL = float(os.getenv("GENERATION_CACHE_TTL", 24 * 60 * 60))
+
+# Maximum scenes kept in memory
+DEFAULT_MAX_ENTRIES = int(os.getenv("GENERATION_CACHE_MAX_ENTRIES", 1024))
+
+# Directory for the optional disk tier (disabled when unset)
+DEFAULT_DISK_DIR = os.getenv("GENERATION_CACHE_DIR")
+
+
+def generation_cache_key(*parts):
+    """
+    Compute the cache key for a generation request
+
+    Args:
+        *parts: JSON-serializable inputs that determine the generated scene
+
+    Returns:
+        str: Hex digest of the inputs
+    """
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class GenerationCache:
+    """TTL + LRU cache of generated scenes with an optional disk tier"""
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, disk_dir=DEFAULT_DISK_DIR):
+        """
+        Args:
+            ttl (float): Seconds an entry stays valid
+            max_entries (int): Maximum entries kept in memory
+            disk_dir (str): Directory for the disk tier, or None to disable it
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, key):
+        """
+        Look up a cached scene
+
+        Args:
+            key (str): The generation key
+
+        Returns:
+            dict: A copy of the cached scene, or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return copy.deepcopy(value)
+                del self._entries[key]
+
+        value, expires_at = self._read_disk(key, now)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store(key, value, expires_at)
+        return copy.deepcopy(value)
+
+    def contains(self, key):
+        """Check for an unexpired scene in memory or on disk, without counting a lookup"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                return True
+        return bool(self.disk_dir) and os.path.exists(self._disk_path(key))
+
+    def put(self, key, value):
+        """
+        Cache a generated scene
+
+        Args:
+            key (str): The generation key
+            value (dict): The generated scene (copied; later mutation is safe)
+        """
+        expires_at = time.time() + self.ttl
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._store(key, value, expires_at)
+        self._write_disk(key, value, expires_at)
+
+    def stats(self):
+        """Return cache statistics"""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": ((self.hits + self.disk_hits) / lookups) if lookups else 0.0
+            }
+
+    def _store(self, key, value, expires_at):
+        """Insert into the memory tier and evict the oldest entries (lock held)"""
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _read_disk(self, key, now):
+        """Read an unexpired entry from the disk tier"""
+        if not self.disk_dir:
+            return None, None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None, None
+        if entry.get("expires_at", 0) <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None, None
+        return entry.get("value"), entry["expires_at"]
+
+    def _write_disk(self, key, value, expires_at):
+        """Write an entry to the disk tier atomically"""
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            with atomic_output(path) as tmp_path:
+                with open(tmp_path, 'w') as f:
+                    json.dump({"expires_at": expires_at, "value": value}, f)
+        except OSError as e:
+            print(f"Error writing generation cache entry: {e}")
+
+
+# Shared cache used by the story engine
+scene_cache = GenerationCache()
@@ -0,0 +1,129 @@
+"""
+Scene Payloads Module - Pre-serialized scene JSON for static stories
+
+A static scene's response body only differs between users in its user_id,
+so the scene (with its audio URL map) is encoded to JSON bytes once and
+cached under (story key, story version, scene id, variant). Editing a story
+changes its version, so stale bodies are never served. Responses are then
+assembled by splicing the cached bytes next to the encoded user_id, with
+the same compact, key-sorted encoding jsonify produces. Each body remembers
+the audio clips it references; a lookup can check they are still on disk,
+so a body pointing at an evicted clip is rebuilt instead of served.
+"""
+import os
+import json
+import threading
+from collections import OrderedDict
+
+# Pre-serialized scenes kept in memory
+DEFAULT_MAX_ENTRIES = int(os.getenv("SCENE_PAYLOAD_CACHE_MAX_ENTRIES", 4096))
+
+
+def encode_json(value):
+    """Encode a value the way Flask's jsonify does (sorted keys, compact, ASCII)"""
+    return json.dumps(value, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def render_scene_response(scene_json, user_id, **fields):
+    """
+    Assemble a {"scene": ..., "user_id": ...} response body around encoded scene bytes
+
+    Args:
+        scene_json (bytes): The scene, already encoded with encode_json
+        user_id (str): The user's ID
+        **fields: Additional top-level fields (e.g. voice)
+
+    Returns:
+        bytes: The JSON response body, keys in sorted order
+    """
+    parts = {"scene": scene_json, "user_id": encode_json(user_id)}
+    parts.update((name, encode_json(value)) for name, value in fields.items())
+    return b"{" + b",".join(encode_json(name) + b":" + parts[name] for name in sorted(parts)) + b"}"
+
+
+class ScenePayloadCache:
+    """LRU of encoded scene bodies keyed by story version"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        Args:
+            max_entries (int): Maximum number of cached bodies
+        """
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (encoded scene, clip keys)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(story, scene_id, variant=""):
+        """Cache key of a scene of a compiled story"""
+        return (story.story_key, story.version, scene_id, variant)
+
+    def get(self, key, clips_present=None):
+        """
+        Look up an encoded scene
+
+        Args:
+            key (tuple): The scene's cache key
+            clips_present (callable): Called with the clip keys the body
+                references; if it returns False the body is dropped and the
+                lookup counts as a miss
+
+        Returns:
+            bytes: The encoded scene, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and clips_present is not None and not clips_present(entry[1]):
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+            entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def contains(self, key):
+        """Check whether a scene is cached, without counting a lookup"""
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key, scene_json, clips=()):
+        """
+        Store an encoded scene, evicting the least recently used
+
+        Args:
+            key (tuple): The scene's cache key
+            scene_json (bytes): The encoded scene
+            clips (iterable): Keys of the audio clips the scene references
+        """
+        with self._lock:
+            self._entries[key] = (scene_json, tuple(clips))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_story(self, story_key):
+        """Drop every cached scene of a story"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == story_key]:
+                del self._entries[key]
+
+    def stats(self):
+        """Return cache statistics"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": sum(len(body) for body, _ in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0
+            }
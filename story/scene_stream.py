@@ -0,0 +1,178 @@
+"""
+Scene Stream Module - Incremental parsing of streamed scene JSON
+
+Gemini can stream a scene as a sequence of text chunks. SceneStreamParser
+consumes the chunks as they arrive (skipping a leading ```json fence) and
+reports the narrative text as it grows, each choice as soon as its object
+is complete, and every other top-level string field. Listeners, such as
+the audio pipeline, can start working on the scene before the model has
+finished writing it.
+"""
+import json
+
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+class SceneStreamListener:
+    """Receives parts of a scene as they are parsed; override what you need"""
+
+    def on_narrative(self, text):
+        """Called with each newly decoded piece of the narrative"""
+
+    def on_narrative_end(self, narrative):
+        """Called with the complete narrative once its string is closed"""
+
+    def on_choice(self, choice):
+        """Called with each choice dict as soon as its object is closed"""
+
+    def on_field(self, name, value):
+        """Called with each top-level string field (scene_id, title, ...)"""
+
+
+class SceneStreamParser:
+    """Incremental parser for one scene JSON object arriving in chunks"""
+
+    def __init__(self, listener=None):
+        """
+        Args:
+            listener (SceneStreamListener): Receives parsed parts of the scene
+        """
+        self.listener = listener or SceneStreamListener()
+        self.done = False
+        self._raw = ""  # text from the opening brace on
+        self._stack = []  # open containers, "{" or "["
+        self._expect_key = False
+        self._key = None  # last key read in the top-level object
+        self._in_string = False
+        self._string_is_key = False
+        self._string_chars = []
+        self._escape = None  # characters of an escape sequence being read
+        self._high_surrogate = None
+        self._narrative = False  # current string is the top-level narrative
+        self._narrative_delta = []
+        self._choice_start = None
+
+    def feed(self, chunk):
+        """
+        Parse the next chunk of the response
+
+        Args:
+            chunk (str): Text of the next streamed chunk
+        """
+        if self.done or not chunk:
+            return
+        if not self._stack and not self._raw:
+            start = chunk.find("{")
+            if start < 0:
+                return
+            chunk = chunk[start:]
+        offset = len(self._raw)
+        self._raw += chunk
+        for index, char in enumerate(chunk, offset):
+            if self._in_string:
+                self._string_char(char)
+            else:
+                self._structural_char(char, index)
+            if self.done:
+                break
+        self._flush_narrative()
+
+    def _structural_char(self, char, index):
+        stack = self._stack
+        if char == '"':
+            self._in_string = True
+            self._string_is_key = bool(stack) and stack[-1] == "{" and self._expect_key
+            self._narrative = (len(stack) == 1 and not self._string_is_key
+                               and self._key == "narrative")
+            self._string_chars = []
+        elif char == "{":
+            stack.append("{")
+            self._expect_key = True
+            if len(stack) == 3 and stack[1] == "[" and self._key == "choices":
+                self._choice_start = index
+        elif char == "[":
+            stack.append("[")
+        elif char in "}]":
+            if not stack:
+                return
+            stack.pop()
+            if char == "}" and len(stack) == 2 and self._choice_start is not None:
+                self._emit_choice(self._raw[self._choice_start:index + 1])
+                self._choice_start = None
+            if not stack:
+                self.done = True
+        elif char == ":":
+            self._expect_key = False
+        elif char == ",":
+            self._expect_key = bool(stack) and stack[-1] == "{"
+
+    def _string_char(self, char):
+        if self._escape is not None:
+            self._escape.append(char)
+            if self._escape[0] == "u":
+                if len(self._escape) < 5:
+                    return
+                code = int("".join(self._escape[1:]), 16)
+                self._escape = None
+                if 0xD800 <= code < 0xDC00:
+                    # High surrogate; wait for its pair
+                    self._flush_surrogate()
+                    self._high_surrogate = code
+                    return
+                if 0xDC00 <= code < 0xE000 and self._high_surrogate is not None:
+                    code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+                    self._high_surrogate = None
+                decoded = chr(code)
+            else:
+                decoded = _ESCAPES.get(char, char)
+                self._escape = None
+            self._flush_surrogate()
+            self._append(decoded)
+        elif char == "\\":
+            self._escape = []
+        elif char == '"':
+            self._flush_surrogate()
+            self._in_string = False
+            self._close_string()
+        else:
+            self._flush_surrogate()
+            self._append(char)
+
+    def _flush_surrogate(self):
+        """Keep an unpaired high surrogate as-is"""
+        if self._high_surrogate is not None:
+            self._append(chr(self._high_surrogate))
+            self._high_surrogate = None
+
+    def _append(self, char):
+        self._string_chars.append(char)
+        if self._narrative:
+            self._narrative_delta.append(char)
+
+    def _close_string(self):
+        value = "".join(self._string_chars)
+        if self._string_is_key:
+            if len(self._stack) == 1:
+                self._key = value
+            return
+        if len(self._stack) != 1:
+            return
+        if self._narrative:
+            self._flush_narrative()
+            self._narrative = False
+            self.listener.on_narrative_end(value)
+        self.listener.on_field(self._key, value)
+
+    def _flush_narrative(self):
+        if self._narrative_delta:
+            delta = "".join(self._narrative_delta)
+            self._narrative_delta = []
+            self.listener.on_narrative(delta)
+
+    def _emit_choice(self, text):
+        try:
+            choice = json.loads(text)
+        except ValueError:
+            return
+        if isinstance(choice, dict):
+            self.listener.on_choice(choice)
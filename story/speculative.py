@@ -0,0 +1,242 @@
+"""
+Speculative Module - Generates the candidate next scenes of dynamic stories
+
+In dynamic mode every /next_scene call used to wait a full Gemini round
+trip after the player chose. While the player listens to a generated
+scene, the scene each of its choices would lead to is generated in the
+background, within a per-player budget of model calls. When the player
+chooses, the matching generation is promoted: it is returned if it has
+finished, or joined if it is still in flight. Generations for the other
+choices are cancelled if they have not started, and otherwise land in the
+generation cache. Speculative calls queue behind interactive ones at the
+Gemini scheduler.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+from story.story_engine import generate_scene, scene_generation_key
+from story.generation_cache import scene_cache
+from common.scheduler import PREFETCH, priority_class
+
+# Set to false to only generate scenes once the player has chosen
+SPECULATIVE_ENABLED = os.getenv("SPECULATIVE_GENERATION", "true").lower() == "true"
+
+# Threads running speculative Gemini calls
+SPECULATIVE_WORKERS = int(os.getenv("SPECULATIVE_WORKERS", 4))
+
+# Speculative model calls allowed per player per budget window
+SPECULATIVE_SESSION_BUDGET = int(os.getenv("SPECULATIVE_SESSION_BUDGET", 12))
+
+# Length of the budget window in seconds
+SPECULATIVE_BUDGET_WINDOW = float(os.getenv("SPECULATIVE_BUDGET_WINDOW", 600))
+
+# Seconds a request waits for an in-flight speculative generation
+SPECULATIVE_JOIN_TIMEOUT = float(os.getenv("SPECULATIVE_JOIN_TIMEOUT", 30))
+
+# Players whose current scene is remembered
+SPECULATIVE_MAX_SESSIONS = int(os.getenv("SPECULATIVE_MAX_SESSIONS", 10000))
+
+
+class _Session:
+    """A player's current generated scene and the generations started from it"""
+
+    __slots__ = ("scene", "emotion", "pending", "window_start", "spent")
+
+    def __init__(self):
+        self.scene = None
+        self.emotion = None
+        self.pending = {}  # generation key -> Future
+        self.window_start = time.time()
+        self.spent = 0
+
+
+def _scene_summary(scene_data):
+    """Keep only the fields later generations are prompted with"""
+    return {
+        "scene_id": scene_data.get("scene_id"),
+        "narrative": scene_data.get("narrative", ""),
+        "choices": [{"id": choice.get("id"), "text": choice.get("text")}
+                    for choice in scene_data.get("choices", [])]
+    }
+
+
+def _generate_speculatively(summary, choice, emotion):
+    """Generate a candidate scene at prefetch priority (runs on the speculation pool)"""
+    with priority_class(PREFETCH):
+        return generate_scene(summary, choice, emotion)
+
+
+def _done_future():
+    future = Future()
+    future.set_result(None)
+    return future
+
+
+class SceneSpeculator:
+    """Per-player speculative generation of the scenes each choice leads to"""
+
+    def __init__(self, workers=SPECULATIVE_WORKERS, budget=SPECULATIVE_SESSION_BUDGET,
+                 window=SPECULATIVE_BUDGET_WINDOW, max_sessions=SPECULATIVE_MAX_SESSIONS):
+        """
+        Args:
+            workers (int): Threads running speculative generations
+            budget (int): Speculative generations allowed per player per window
+            window (float): Budget window in seconds
+            max_sessions (int): Players remembered
+        """
+        self.workers = workers
+        self.budget = budget
+        self.window = window
+        self.max_sessions = max_sessions
+        self._executor = None
+        self._sessions = OrderedDict()  # session id -> _Session
+        self._lock = threading.Lock()
+        self.started = 0
+        self.cached = 0
+        self.over_budget = 0
+        self.cancelled = 0
+        self.hits = 0
+        self.late = 0
+        self.misses = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                thread_name_prefix="speculate")
+        return self._executor
+
+    def speculate(self, session_id, scene_data, emotion=None):
+        """
+        Remember the scene a player was served and generate where its choices lead
+
+        Args:
+            session_id (str): The player's ID
+            scene_data (dict): The generated scene the player is now in
+            emotion (str): The player's last detected emotion, assumed to persist
+
+        Returns:
+            int: Number of generations started
+        """
+        scene = _scene_summary(scene_data)
+        keys = [(choice, scene_generation_key(scene["narrative"], choice, emotion))
+                for choice in scene["choices"]]
+        uncached = {key for _, key in keys if not scene_cache.contains(key)}
+
+        started = 0
+        with self._lock:
+            session = self._get_session_locked(session_id)
+            self._cancel_pending_locked(session)
+            session.scene = scene
+            session.emotion = emotion
+            if not SPECULATIVE_ENABLED:
+                return 0
+
+            now = time.time()
+            if now - session.window_start >= self.window:
+                session.window_start = now
+                session.spent = 0
+
+            for choice, key in keys:
+                if key not in uncached:
+                    # Already generated; record it so choosing it counts as a hit
+                    session.pending[key] = _done_future()
+                    self.cached += 1
+                    continue
+                if session.spent >= self.budget:
+                    self.over_budget += 1
+                    continue
+                session.spent += 1
+                self.started += 1
+                started += 1
+                session.pending[key] = self._get_executor().submit(
+                    _generate_speculatively, scene["narrative"], choice, emotion)
+        return started
+
+    def next_scene(self, session_id, choice_id, scene_id=None, emotion=None, listener=None):
+        """
+        Get the scene a player's choice leads to, promoting a speculative generation
+
+        Falls back to generating the scene now when nothing was speculated
+        for this choice and emotion.
+
+        Args:
+            session_id (str): The player's ID
+            choice_id (str): The chosen choice ID
+            scene_id (str): The scene the choice was made in (None for the remembered one)
+            emotion (str): Detected emotion, passed to scene generation
+            listener (SceneStreamListener): Receives the scene's parts if it is generated now
+
+        Returns:
+            dict: The generated scene
+        """
+        future = None
+        with self._lock:
+            session = self._sessions.get(session_id)
+            scene = session.scene if session is not None else None
+            if scene is not None and scene_id and scene["scene_id"] != scene_id:
+                scene = None
+
+            if scene is None:
+                summary, choice = "", choice_id
+            else:
+                summary = scene["narrative"]
+                choice = next((c for c in scene["choices"] if c["id"] == choice_id), choice_id)
+                future = session.pending.pop(scene_generation_key(summary, choice, emotion), None)
+            if session is not None:
+                self._cancel_pending_locked(session)
+
+            if future is None:
+                self.misses += 1
+            elif future.done():
+                self.hits += 1
+            else:
+                self.late += 1
+
+        if future is not None:
+            wait([future], timeout=SPECULATIVE_JOIN_TIMEOUT)
+        # A finished speculation is a generation cache hit; a failed one is retried
+        return generate_scene(summary, choice, emotion, listener)
+
+    def _get_session_locked(self, session_id):
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = _Session()
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            _, evicted = self._sessions.popitem(last=False)
+            self._cancel_pending_locked(evicted)
+        return session
+
+    def _cancel_pending_locked(self, session):
+        """Cancel generations that have not started; running ones finish into the cache"""
+        for future in session.pending.values():
+            if future.cancel():
+                # Never sent to the model, so it does not count against the budget
+                session.spent = max(session.spent - 1, 0)
+                self.cancelled += 1
+        session.pending = {}
+
+    def pending(self):
+        """Speculative generations queued or running"""
+        with self._lock:
+            return sum(1 for session in self._sessions.values()
+                       for future in session.pending.values() if not future.done())
+
+    def stats(self):
+        """Return speculation statistics"""
+        with self._lock:
+            transitions = self.hits + self.late + self.misses
+            return {
+                "sessions": len(self._sessions),
+                "started": self.started,
+                "cached": self.cached,
+                "over_budget": self.over_budget,
+                "cancelled": self.cancelled,
+                "hits": self.hits,
+                "late": self.late,
+                "misses": self.misses,
+                "hit_rate": (self.hits / transitions) if transitions else 0.0
+            }
@@ -0,0 +1,365 @@
+"""
+Story Catalog Module - Validates, compiles and caches static stories
+
+Each story JSON file is validated once, compiled into a compact scene graph
+with a precomputed (scene_id, choice_id) -> next_scene table, and kept in a
+memory-bounded LRU so the catalog can hold many more stories than fit in RAM.
+"""
+import os
+import sys
+import json
+import hashlib
+import threading
+from types import MappingProxyType
+from collections import OrderedDict
+from story.choice_matcher import ChoiceMatcher
+
+# Default memory budget for compiled stories held in the LRU (bytes)
+DEFAULT_MAX_BYTES = int(os.getenv("STORY_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+# Story key of the bundled sample story (file name without .json)
+SAMPLE_STORY_ID = "sample_story"
+
+
+class StoryValidationError(ValueError):
+    """Raised when a story file cannot be compiled into a scene graph"""
+
+
+class CompiledScene:
+    """A single scene of a compiled story graph"""
+
+    __slots__ = ("scene_id", "title", "narrative", "ambience", "choices", "extra", "matcher", "_view")
+
+    def __init__(self, scene_id, title, narrative, ambience, choices, extra):
+        self.scene_id = scene_id
+        self.title = title
+        self.narrative = narrative
+        self.ambience = ambience
+        # Tuple of (choice_id, text, next_scene) tuples, in story order
+        self.choices = choices
+        # Any additional fields of the source scene, kept for the payload
+        self.extra = extra
+        # Voice command index over the choices, built once per load
+        self.matcher = ChoiceMatcher(choices)
+        self._view = None
+
+    def choice_text(self, choice_id):
+        """Return the text of a choice, or None if the scene has no such choice"""
+        for cid, text, _ in self.choices:
+            if cid == choice_id:
+                return text
+        return None
+
+    def view(self):
+        """
+        Get a read-only view of the scene in the source JSON format
+
+        The view is built once and shared by every request; use to_dict()
+        for a copy that may be modified.
+
+        Returns:
+            MappingProxyType: Scene fields, with choices as a tuple of read-only mappings
+        """
+        if self._view is None:
+            scene = self.to_dict()
+            scene["choices"] = tuple(MappingProxyType(choice) for choice in scene["choices"])
+            self._view = MappingProxyType(scene)
+        return self._view
+
+    def to_dict(self):
+        """
+        Build a fresh scene dictionary in the source JSON format
+
+        Returns:
+            dict: A new dictionary that callers are free to mutate
+        """
+        scene = dict(self.extra)
+        scene.update({
+            "scene_id": self.scene_id,
+            "title": self.title,
+            "narrative": self.narrative,
+            "ambience": self.ambience,
+            "choices": [
+                {"id": cid, "text": text, "next_scene": next_scene}
+                for cid, text, next_scene in self.choices
+            ]
+        })
+        return scene
+
+
+class CompiledStory:
+    """An immutable, validated scene graph with O(1) transitions"""
+
+    __slots__ = ("story_id", "story_key", "title", "description", "author", "start_scene_id",
+                 "scenes", "transitions", "dangling", "size_bytes", "version")
+
+    def __init__(self, story_id, story_key, title, description, author, start_scene_id,
+                 scenes, transitions, dangling, size_bytes, version):
+        self.story_id = story_id
+        # Catalog key (file name without .json) the story was loaded under
+        self.story_key = story_key
+        self.title = title
+        self.description = description
+        self.author = author
+        self.start_scene_id = start_scene_id
+        self.scenes = scenes
+        self.transitions = transitions
+        self.dangling = dangling
+        self.size_bytes = size_bytes
+        # Hash of the story content; changes whenever the story file is edited
+        self.version = version
+
+    def has_scene(self, scene_id):
+        """Check whether a scene exists in the story"""
+        return scene_id in self.scenes
+
+    def get_scene(self, scene_id):
+        """
+        Get a compiled scene by id
+
+        Args:
+            scene_id (str): The scene ID
+
+        Returns:
+            CompiledScene: The scene, or None if it does not exist
+        """
+        return self.scenes.get(scene_id)
+
+    def start_scene(self):
+        """Get the compiled start scene of the story"""
+        return self.scenes[self.start_scene_id]
+
+    def next_scene_id(self, scene_id, choice_id):
+        """
+        Look up the scene a choice leads to
+
+        Args:
+            scene_id (str): The current scene ID
+            choice_id (str): The chosen choice ID
+
+        Returns:
+            str: The next scene ID, or None if the scene has no such choice
+        """
+        return self.transitions.get((scene_id, choice_id))
+
+
+def _reject_duplicate_keys(pairs):
+    """json object_pairs_hook that refuses duplicate keys (e.g. scene ids)"""
+    result = {}
+    for key, value in pairs:
+        if key in result:
+            raise StoryValidationError(f"Duplicate key '{key}' in story file")
+        result[key] = value
+    return result
+
+
+def _text_size(value):
+    """Approximate the memory held by a string field"""
+    return sys.getsizeof(value) if isinstance(value, str) else 0
+
+
+def story_version(story_data):
+    """Short content hash of parsed story data, independent of key order and whitespace"""
+    canonical = json.dumps(story_data, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+def compile_story(story_data, story_key=None):
+    """
+    Validate story data and compile it into a CompiledStory
+
+    Args:
+        story_data (dict): Parsed story JSON
+        story_key (str): Catalog key used when the story has no story_id
+
+    Returns:
+        CompiledStory: The compiled scene graph
+
+    Raises:
+        StoryValidationError: If the story is structurally invalid
+    """
+    if not isinstance(story_data, dict):
+        raise StoryValidationError("Story must be a JSON object")
+
+    raw_scenes = story_data.get("scenes")
+    if not isinstance(raw_scenes, dict) or not raw_scenes:
+        raise StoryValidationError("Story has no scenes")
+
+    story_id = sys.intern(str(story_data.get("story_id") or story_key or "story"))
+    start_scene_id = story_data.get("start_scene") or next(iter(raw_scenes))
+    if start_scene_id not in raw_scenes:
+        raise StoryValidationError(f"Start scene '{start_scene_id}' not found in story {story_id}")
+
+    scenes = {}
+    transitions = {}
+    dangling = []
+    size_bytes = sys.getsizeof(raw_scenes)
+
+    for key, raw in raw_scenes.items():
+        if not isinstance(raw, dict):
+            raise StoryValidationError(f"Scene '{key}' must be a JSON object")
+
+        scene_id = raw.get("scene_id", key)
+        if scene_id != key:
+            raise StoryValidationError(f"Scene key '{key}' does not match scene_id '{scene_id}'")
+        scene_id = sys.intern(scene_id)
+
+        choices = []
+        seen_choices = set()
+        for choice in raw.get("choices", []):
+            choice_id = choice.get("id")
+            if not choice_id:
+                raise StoryValidationError(f"Choice without id in scene '{scene_id}'")
+            if choice_id in seen_choices:
+                raise StoryValidationError(f"Duplicate choice '{choice_id}' in scene '{scene_id}'")
+            seen_choices.add(choice_id)
+
+            choice_id = sys.intern(choice_id)
+            next_scene = choice.get("next_scene")
+            if next_scene is not None:
+                next_scene = sys.intern(next_scene)
+                if next_scene not in raw_scenes:
+                    dangling.append((scene_id, choice_id, next_scene))
+                transitions[(scene_id, choice_id)] = next_scene
+
+            choices.append((choice_id, choice.get("text", ""), next_scene))
+            size_bytes += _text_size(choice.get("text")) + 3 * 64
+
+        extra = {k: v for k, v in raw.items()
+                 if k not in ("scene_id", "title", "narrative", "ambience", "choices")}
+        scenes[scene_id] = CompiledScene(
+            scene_id,
+            raw.get("title"),
+            raw.get("narrative", ""),
+            raw.get("ambience"),
+            tuple(choices),
+            extra
+        )
+        size_bytes += (_text_size(raw.get("title")) + _text_size(raw.get("narrative"))
+                       + _text_size(raw.get("ambience")) + 128)
+
+    if dangling:
+        for scene_id, choice_id, target in dangling:
+            print(f"Warning: story {story_id} scene '{scene_id}' choice '{choice_id}' "
+                  f"points to missing scene '{target}'")
+
+    return CompiledStory(
+        story_id,
+        story_key or story_id,
+        story_data.get("title"),
+        story_data.get("description"),
+        story_data.get("author"),
+        sys.intern(start_scene_id),
+        scenes,
+        transitions,
+        tuple(dangling),
+        size_bytes,
+        story_version(story_data)
+    )
+
+
+def load_story_file(path, story_key=None):
+    """
+    Read, validate and compile a story JSON file
+
+    Args:
+        path (str): Path to the story JSON file
+        story_key (str): Catalog key used when the story has no story_id
+
+    Returns:
+        CompiledStory: The compiled scene graph
+    """
+    with open(path, 'r') as f:
+        story_data = json.load(f, object_pairs_hook=_reject_duplicate_keys)
+    return compile_story(story_data, story_key)
+
+
+class StoryCatalog:
+    """Lazily loads compiled stories from a directory under a memory-bounded LRU"""
+
+    def __init__(self, story_dir="sample_data", max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Args:
+            story_dir (str): Directory containing <story_key>.json files
+            max_bytes (int): Approximate memory budget for loaded stories
+        """
+        self.story_dir = story_dir
+        self.max_bytes = max_bytes
+        self._stories = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def story_path(self, story_key):
+        """Resolve a story key to its file path (keys may not contain path parts)"""
+        if not story_key or os.path.basename(story_key) != story_key:
+            return None
+        return os.path.join(self.story_dir, f"{story_key}.json")
+
+    def list_stories(self):
+        """List the keys of all stories available in the catalog directory"""
+        try:
+            return sorted(name[:-5] for name in os.listdir(self.story_dir)
+                          if name.endswith(".json"))
+        except OSError:
+            return []
+
+    def get(self, story_key=SAMPLE_STORY_ID):
+        """
+        Get a compiled story, loading and compiling it on first use
+
+        Args:
+            story_key (str): The story key (file name without .json)
+
+        Returns:
+            CompiledStory: The compiled story, or None if missing or invalid
+        """
+        with self._lock:
+            story = self._stories.get(story_key)
+            if story is not None:
+                self._stories.move_to_end(story_key)
+                self.hits += 1
+                return story
+            self.misses += 1
+
+        path = self.story_path(story_key)
+        if not path or not os.path.isfile(path):
+            return None
+
+        try:
+            story = load_story_file(path, story_key)
+        except (OSError, ValueError) as e:
+            print(f"Error loading story {story_key}: {e}")
+            return None
+
+        with self._lock:
+            if story_key not in self._stories:
+                self._stories[story_key] = story
+                self._bytes += story.size_bytes
+                self._evict()
+            return self._stories.get(story_key, story)
+
+    def invalidate(self, story_key):
+        """Drop a story from memory so the next get() recompiles it"""
+        with self._lock:
+            story = self._stories.pop(story_key, None)
+            if story is not None:
+                self._bytes -= story.size_bytes
+
+    def _evict(self):
+        """Evict least recently used stories until within budget (lock held)"""
+        while self._bytes > self.max_bytes and len(self._stories) > 1:
+            _, story = self._stories.popitem(last=False)
+            self._bytes -= story.size_bytes
+
+    def stats(self):
+        """Return catalog cache statistics"""
+        with self._lock:
+            return {
+                "loaded": len(self._stories),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses
+            }
@@ -2,44 +2,114 @@
 Story Engine Module - Handles Gemini-based story generation
 """
 import os
+import copy
 import json
-import google.generativeai as genai
 from dotenv import load_dotenv
+from story.gemini_client import get_gemini_model, gemini_slot
+from story.generation_cache import scene_cache, generation_cache_key
+from story.scene_stream import SceneStreamParser
+from common.metrics import span
+from common.singleflight import SingleFlight
+from common.scheduler import Overloaded
 
 # Load environment variables
 load_dotenv()
 
+# Bump whenever the prompts change so cached scenes are not reused
+PROMPT_VERSION = "1"
+
+# Stream responses to listeners (e.g. the TTS pipeline) instead of waiting for the full text
+STREAM_GENERATION = os.getenv("STREAM_GENERATION", "true").lower() == "true"
+
+# Concurrent requests for the same scene share one Gemini call
+generation_flight = SingleFlight("generation")
+
 def init_gemini():
-    """Initialize the Gemini API with API key from environment variables"""
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY environment variable not set")
-    
-    genai.configure(api_key=api_key)
-    # Use gemini-1.5-pro or other available models with fallbacks
-    try:
-        # First try newer model version
-        return genai.GenerativeModel('gemini-1.5-pro')
-    except Exception:
-        try:
-            # Fall back to older version
-            return genai.GenerativeModel('gemini-pro')
-        except Exception as e:
-            print(f"Error initializing Gemini model: {e}")
-            return None
+    """Get the shared Gemini model (created once per process)"""
+    return get_gemini_model()
+
+def _parse_scene_json(response_text):
+    """
+    Parse a scene from a model response, with or without a ```json fence
+    
+    Raises:
+        json.JSONDecodeError: If the response does not contain valid JSON
+    """
+    if "```json" in response_text and "```" in response_text.split("```json")[1]:
+        json_str = response_text.split("```json")[1].split("```")[0].strip()
+        return json.loads(json_str)
+    return json.loads(response_text)
+
+def _generate_text(model, prompt, listener=None):
+    """
+    Run a generation and return the response text
+    
+    With a listener, the response is streamed and parsed incrementally so the
+    listener hears about the narrative and choices while the model is writing.
+    """
+    if listener is None or not STREAM_GENERATION:
+        return model.generate_content(prompt).text
+    parser = SceneStreamParser(listener)
+    parts = []
+    for chunk in model.generate_content(prompt, stream=True):
+        text = chunk.text
+        parts.append(text)
+        parser.feed(text)
+    return "".join(parts)
+
+def _coalesced(cache_key, generate):
+    """
+    Run a scene generation once per key, however many callers ask concurrently
+    
+    With the generation cache's disk tier enabled, worker processes sharing
+    it coalesce too. The caller that runs the generation takes a Gemini slot
+    before the cross-process lock. Every caller gets its own copy of the scene.
+    """
+    def job():
+        # Generated by an earlier flight or another process while we waited
+        if scene_cache.contains(cache_key):
+            cached_scene = scene_cache.get(cache_key)
+            if cached_scene is not None:
+                return cached_scene
+        return generate()
+    lock_dir = os.path.join(scene_cache.disk_dir, ".locks") if scene_cache.disk_dir else None
+    return copy.deepcopy(generation_flight.do(cache_key, job, lock_dir, admission=gemini_slot))
+
+def scene_generation_key(previous_scene_summary=None, user_choice=None, emotion=None):
+    """Cache key of a generate_scene call"""
+    return generation_cache_key("scene", previous_scene_summary or "",
+                                _choice_text(user_choice), emotion, PROMPT_VERSION)
 
-def generate_scene(previous_scene_summary=None, user_choice=None, emotion=None):
+def _choice_text(user_choice):
+    """Accept either a choice dict or a bare choice id/text"""
+    if isinstance(user_choice, dict):
+        return user_choice.get("text") or user_choice.get("id")
+    return user_choice
+
+def generate_scene(previous_scene_summary=None, user_choice=None, emotion=None, listener=None):
     """
     Generate a new scene based on previous scene and user choice
     
+    Results are memoized by (previous scene, choice, emotion, prompt version).
+    
     Args:
         previous_scene_summary (str): Summary of the previous scene
-        user_choice (dict): The choice made by the user
+        user_choice (dict): The choice made by the user (or its id/text)
         emotion (str): Detected emotion from the user's voice
+        listener (SceneStreamListener): Receives the scene's parts while it is
+            generated (not called on cache hits)
         
     Returns:
         dict: JSON object containing the new scene
+        
+    Raises:
+        Overloaded: If Gemini's queue is full (no fallback scene is served)
     """
+    cache_key = scene_generation_key(previous_scene_summary, user_choice, emotion)
+    cached_scene = scene_cache.get(cache_key)
+    if cached_scene is not None:
+        return cached_scene
+    
     model = init_gemini()
     if model is None:
         print("Falling back to default scene generation.")
@@ -52,7 +122,7 @@ def generate_scene(previous_scene_summary=None, user_choice=None, emotion=None):
         prompt += f"\n\nPrevious scene summary: {previous_scene_summary}"
     
     if user_choice:
-        prompt += f"\n\nUser chose: {user_choice['text']}"
+        prompt += f"\n\nUser chose: {_choice_text(user_choice)}"
     
     if emotion:
         prompt += f"\n\nUser's emotional state: {emotion}. Adapt the scene to this emotion."
@@ -73,24 +143,23 @@ def generate_scene(previous_scene_summary=None, user_choice=None, emotion=None):
     }
     """
 
-    try:
-        response = model.generate_content(prompt)
-        response_text = response.text
-        
+    def request_scene():
         try:
-            if "```json" in response_text and "```" in response_text.split("```json")[1]:
-                json_str = response_text.split("```json")[1].split("```")[0].strip()
-                scene_data = json.loads(json_str)
-            else:
-                scene_data = json.loads(response_text)
-                
-            return scene_data
-        except json.JSONDecodeError:
-            return create_fallback_scene()
+            with span("gemini.generate_scene", "gemini"):
+                response_text = _generate_text(model, prompt, listener)
+        
+            try:
+                scene_data = _parse_scene_json(response_text)
+                scene_cache.put(cache_key, scene_data)
+                return scene_data
+            except json.JSONDecodeError:
+                return create_fallback_scene()
             
-    except Exception as e:
-        print(f"Error generating scene: {e}")
-        return create_fallback_scene()
+        except Exception as e:
+            print(f"Error generating scene: {e}")
+            return create_fallback_scene()
+    
+    return _coalesced(cache_key, request_scene)
 
 def create_fallback_scene():
     """Create a fallback scene in case of API failure"""
@@ -106,8 +175,18 @@ def create_fallback_scene():
         ]
     }
 
-def get_start_scene():
-    """Get the first scene of a story"""
+def get_start_scene(listener=None):
+    """
+    Generate the first scene of a story
+    
+    Not memoized: every player gets a freshly generated opening.
+    
+    Args:
+        listener (SceneStreamListener): Receives the scene's parts while it is generated
+        
+    Raises:
+        Overloaded: If Gemini's queue is full
+    """
     model = init_gemini()
     
     prompt = """
@@ -129,19 +208,29 @@ def get_start_scene():
     }
     """
     
-    try:
-        response = model.generate_content(prompt)
-        response_text = response.text
-        
+    def request_scene():
         try:
-            if "```json" in response_text and "```" in response_text.split("```json")[1]:
-                json_str = response_text.split("```json")[1].split("```")[0].strip()
-                scene_data = json.loads(json_str)
-            else:
-                scene_data = json.loads(response_text)
-                
-            return scene_data
-        except json.JSONDecodeError:
+            with gemini_slot(), span("gemini.start_scene", "gemini"):
+                response_text = _generate_text(model, prompt, listener)
+        
+            try:
+                return _parse_scene_json(response_text)
+            except json.JSONDecodeError:
+                return {
+                    "scene_id": "start",
+                    "title": "The Whispering Forest",
+                    "narrative": "You stand at the edge of the Whispering Forest. The ancient trees sway gently, their leaves rustling with secrets older than time itself. A narrow path winds its way into the dense foliage, barely visible in the dappled sunlight. From somewhere deep within, you hear what sounds like distant voices carried on the breeze.",
+                    "ambience": "Rustling leaves, distant whispers, occasional bird calls",
+                    "choices": [
+                        {"id": "enter_forest", "text": "Enter the forest and follow the path"},
+                        {"id": "listen_carefully", "text": "Stand still and listen carefully to the whispers"},
+                        {"id": "circle_perimeter", "text": "Circle around the perimeter to find another entrance"}
+                    ]
+                }
+        except Overloaded:
+            raise
+        except Exception as e:
+            print(f"Error generating start scene: {e}")
             return {
                 "scene_id": "start",
                 "title": "The Whispering Forest",
@@ -153,16 +242,5 @@ def get_start_scene():
                     {"id": "circle_perimeter", "text": "Circle around the perimeter to find another entrance"}
                 ]
             }
-    except Exception as e:
-        print(f"Error generating start scene: {e}")
-        return {
-            "scene_id": "start",
-            "title": "The Whispering Forest",
-            "narrative": "You stand at the edge of the Whispering Forest. The ancient trees sway gently, their leaves rustling with secrets older than time itself. A narrow path winds its way into the dense foliage, barely visible in the dappled sunlight. From somewhere deep within, you hear what sounds like distant voices carried on the breeze.",
-            "ambience": "Rustling leaves, distant whispers, occasional bird calls",
-            "choices": [
-                {"id": "enter_forest", "text": "Enter the forest and follow the path"},
-                {"id": "listen_carefully", "text": "Stand still and listen carefully to the whispers"},
-                {"id": "circle_perimeter", "text": "Circle around the perimeter to find another entrance"}
-            ]
-        }
+    
+    return request_scene()